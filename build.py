@@ -49,6 +49,9 @@ def set_properties(project):
     # https://github.com/mitya57/secretstorage/issues/4
     project.depends_on("secretstorage!=2.2.0")
     project.set_property('flake8_include_test_sources', True)
+    if sys.version_info[0:2] < (3, 5):
+        # async/await is a syntax error for older interpreters
+        project.set_property('flake8_exclude_patterns', 'async_client.py')
     project.set_property('flake8_break_build', True)
     project.set_property('copy_resources_target', '$dir_dist')
 
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmarks of the afp-cli against afp_mock.py.
+
+Every scenario runs the afp command as a user would, with its own
+home directory, and measures the wall time of the invocations, how many
+requests each invocation sent to the mock and, for fetching many
+credentials, the throughput. The results are written as JSON, and
+compared to the results of an earlier run with --compare:
+
+    afp_benchmark.py --output new.json --compare old.json
+
+By default, the afp of this source tree is benchmarked. Use e.g.
+--afp afp to benchmark an installed release instead.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from six.moves.urllib.request import urlopen
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(TEST_DIR), 'main')
+MOCK = os.path.join(TEST_DIR, 'afp_mock.py')
+# Seconds to wait for the mock to answer after starting it
+MOCK_STARTUP_TIMEOUT = 10
+
+
+def get_free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class Mock(object):
+    """afp_mock.py running in the background with the given options"""
+
+    def __init__(self, options, workdir):
+        self.port = get_free_port()
+        self.url = 'http://localhost:{0}'.format(self.port)
+        self.process = subprocess.Popen(
+            [sys.executable, MOCK, '--port', str(self.port)] + options,
+            cwd=workdir)
+        deadline = time.time() + MOCK_STARTUP_TIMEOUT
+        while True:
+            try:
+                self.get_stats()
+                break
+            except IOError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError("afp_mock.py did not start")
+                time.sleep(0.1)
+
+    def get_stats(self):
+        response = urlopen(self.url + '/_mock/stats', timeout=5)
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+
+    def get_requests(self):
+        stats = self.get_stats()
+        return stats['account'] + stats['credentials']
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class Afp(object):
+    """Run afp invocations against a mock and time them"""
+
+    def __init__(self, command, mock, workdir):
+        self.command = command
+        self.mock = mock
+        self.workdir = workdir
+        self.env = get_env(command)
+
+    @contextmanager
+    def home(self):
+        """A home directory with empty caches"""
+        home = tempfile.mkdtemp(dir=self.workdir)
+        try:
+            yield home
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+
+    def start(self, arguments, home):
+        env = dict(self.env, HOME=home)
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.Popen(
+                self.command + ['-p', 'testing', '-a', self.mock.url] +
+                arguments, env=env, stdin=subprocess.PIPE, stdout=devnull,
+                stderr=devnull)
+
+    def run(self, arguments, home, stdin=None):
+        """Return whether the invocation failed"""
+        process = self.start(arguments, home)
+        process.communicate(stdin.encode('utf-8') if stdin else None)
+        return process.returncode != 0
+
+
+def get_default_command():
+    return [sys.executable, os.path.join(SOURCE_DIR, 'scripts', 'afpv2')]
+
+
+def get_env(command):
+    env = dict(os.environ)
+    env.pop('AFP_TIMING', None)
+    if command == get_default_command():
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(SOURCE_DIR, 'python')] +
+            [path for path in [os.environ.get('PYTHONPATH')] if path])
+    return env
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    index = int(round(percentile / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def summarize(times):
+    return {'min': min(times),
+            'median': get_percentile(times, 50),
+            'p90': get_percentile(times, 90),
+            'max': max(times)}
+
+
+def measure(afp, repeat, invoke, invocations=1, items=None):
+    """
+    Call invoke() `repeat` times and return the wall time, requests per
+    invocation, failures and, if `items` are handled per call, their
+    throughput.
+    """
+    times, failures = [], 0
+    requests_before = afp.mock.get_requests()
+    for _ in range(repeat):
+        start = time.time()
+        failures += invoke()
+        times.append(time.time() - start)
+    requests = afp.mock.get_requests() - requests_before
+    result = {'wall': summarize(times),
+              'requests_per_invocation': requests / (repeat * invocations),
+              'failures': failures}
+    if items:
+        result['throughput'] = items / result['wall']['median']
+    return result
+
+
+def benchmark_list(afp, repeat):
+    results = {}
+
+    def list_cold():
+        with afp.home() as home:
+            return afp.run(['list', '-o', 'json'], home)
+
+    results['list-cold'] = measure(afp, repeat, list_cold)
+    with afp.home() as home:
+        afp.run(['list', '-o', 'json'], home)
+        results['list-warm'] = measure(
+            afp, repeat, lambda: afp.run(['list', '-o', 'json'], home))
+    return results
+
+
+def benchmark_credentials(afp, repeat, pairs, workers, concurrency):
+    results = {}
+    show = ['show', 'account-00000', 'role-0']
+
+    def show_cold():
+        with afp.home() as home:
+            return afp.run(show, home)
+
+    results['show-cold'] = measure(afp, repeat, show_cold)
+    with afp.home() as home:
+        afp.run(show, home)
+        results['show-cached'] = measure(
+            afp, repeat, lambda: afp.run(show, home))
+
+    lines = ''.join('account-{0:05d}/role-0\n'.format(number)
+                    for number in range(pairs))
+
+    def fetch():
+        with afp.home() as home:
+            return afp.run(['--no-cache', 'fetch', '--workers', str(workers),
+                            '-o', 'json', '--from-file', '-'], home,
+                           stdin=lines)
+
+    results['fetch-{0}'.format(pairs)] = measure(afp, repeat, fetch,
+                                                 items=pairs)
+
+    def show_concurrently():
+        with afp.home() as home:
+            processes = [afp.start(['--no-cache'] + show, home)
+                         for _ in range(concurrency)]
+            threads = [threading.Thread(target=process.communicate)
+                       for process in processes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return len([p for p in processes if p.returncode != 0])
+
+    results['concurrent-{0}'.format(concurrency)] = measure(
+        afp, repeat, show_concurrently, invocations=concurrency,
+        items=concurrency)
+    return results
+
+
+def get_version(command, env):
+    try:
+        output = subprocess.check_output(command + ['version'], env=env)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip().rpartition(' ')[2]
+
+
+def get_mock_options(arguments):
+    options = ['--jitter', str(arguments.jitter)]
+    for name in ['latency', 'error_rate', 'payload_size']:
+        for value in getattr(arguments, name) or []:
+            options.extend(['--' + name.replace('_', '-'), value])
+    return options
+
+
+def run(arguments):
+    command = shlex.split(arguments.afp) if arguments.afp \
+        else get_default_command()
+    version = get_version(command, get_env(command))
+    workdir = tempfile.mkdtemp(prefix='afp-benchmark-')
+    results = {}
+    try:
+        mock_options = get_mock_options(arguments)
+        for accounts in arguments.accounts:
+            accounts_options = ['--accounts', str(accounts)]
+            mock = Mock(accounts_options + mock_options, workdir)
+            try:
+                afp = Afp(command, mock, workdir)
+                for name, result in benchmark_list(
+                        afp, arguments.repeat).items():
+                    results['{0}-{1}'.format(name, accounts)] = result
+                if accounts == max(arguments.accounts):
+                    results.update(benchmark_credentials(
+                        afp, arguments.repeat,
+                        min(arguments.pairs, accounts), arguments.workers,
+                        arguments.concurrency))
+            finally:
+                mock.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'version': version,
+            'python': platform.python_version(),
+            'time': time.time(),
+            'host': socket.gethostname(),
+            'mock': mock_options,
+            'repeat': arguments.repeat,
+            'results': results}
+
+
+def compare(previous, current, tolerance):
+    """Print the change of every scenario, return the regressions"""
+    regressions = []
+    print("{0:<22}{1:>12}{2:>12}{3:>9}".format(
+        'scenario', 'before', 'now', 'change'))
+    for name in sorted(current['results']):
+        if name not in previous['results']:
+            continue
+        before = previous['results'][name]['wall']['median']
+        now = current['results'][name]['wall']['median']
+        change = (now - before) / before if before else 0
+        print("{0:<22}{1:>9.0f} ms{2:>9.0f} ms{3:>+8.0%}".format(
+            name, before * 1000, now * 1000, change))
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(report):
+    print("afp-cli {0} on Python {1}".format(report['version'],
+                                             report['python']))
+    print("{0:<22}{1:>12}{2:>12}{3:>10}{4:>12}".format(
+        'scenario', 'median', 'p90', 'requests', 'per second'))
+    for name, result in sorted(report['results'].items()):
+        print("{0:<22}{1:>9.0f} ms{2:>9.0f} ms{3:>10.1f}{4:>12}".format(
+            name, result['wall']['median'] * 1000,
+            result['wall']['p90'] * 1000,
+            result['requests_per_invocation'],
+            '{0:.1f}'.format(result['throughput'])
+            if 'throughput' in result else '-'))
+        if result['failures']:
+            print("  {0} failed invocations".format(result['failures']))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0])
+    parser.add_argument('--afp', help="The afp command to benchmark.")
+    parser.add_argument('--accounts', default='10,1000,10000',
+                        type=lambda value: [int(v) for v in value.split(',')],
+                        help="Account list sizes to benchmark, separated "
+                             "by commas.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--pairs', type=int, default=100,
+                        help="How many credentials 'afp fetch' fetches.")
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help="How many afp processes run at the same time.")
+    parser.add_argument('--latency', action='append',
+                        metavar='[ENDPOINT=]SECONDS')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', action='append',
+                        metavar='[ENDPOINT=]FRACTION')
+    parser.add_argument('--payload-size', action='append',
+                        metavar='[ENDPOINT=]BYTES')
+    parser.add_argument('--output', help="Write the results to this file.")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare to the results of an earlier run.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Exit with 1 if a median got slower by more "
+                             "than this share.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    report = run(arguments)
+    print_results(report)
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if arguments.compare:
+        with open(arguments.compare) as previous:
+            regressions = compare(json.load(previous), report,
+                                  arguments.tolerance)
+        if regressions:
+            print("Slower than before: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
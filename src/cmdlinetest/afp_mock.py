@@ -1,37 +1,187 @@
 #!/usr/bin/env python
-""" Simple AFP mock to allow testing the afp-cli. """
+"""
+Simple AFP mock to allow testing and benchmarking the afp-cli.
+
+Without options, it serves two fixed accounts on port 5544 as fast as it
+can, which is what the cram tests expect. For benchmarks, the number of
+accounts, the latency, the error rate and the payload size of every
+endpoint can be configured, e.g.:
+
+    afp_mock.py --accounts 10000 --latency 0.05 \\
+        --latency credentials=0.2 --error-rate credentials=0.01
+
+GET /_mock/stats returns how many requests each endpoint answered.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from textwrap import dedent
+from wsgiref.simple_server import WSGIServer
+
 import bottle
 from bottle import route
 from bottledaemon import daemon_run
-from textwrap import dedent
-import sys
+from six.moves.socketserver import ThreadingMixIn
+
+ENDPOINTS = ('account', 'credentials')
+
+ACCOUNTS = '{"test_account": ["test_role"],' \
+           '"test_account_with_long_name": ["test_role_with_long_name"]}'
+ACCOUNTS_ETAG = '"accounts-v1"'
+
+CREDENTIALS = dedent("""
+                     {"Code": "Success",
+                      "LastUpdated": "1970-01-01T00:00:00Z",
+                      "AccessKeyId": "XXXXXXXXXXXX",
+                      "SecretAccessKey": "XXXXXXXXXXXX",
+                      "Token": "XXXXXXXXXXXX",
+                      "Expiration": "2032-01-01T00:00:00Z",
+                      "Type": "AWS-HMAC"}""").strip()
+
+settings = {
+    'accounts': ACCOUNTS,
+    'accounts_etag': ACCOUNTS_ETAG,
+    'latency': dict.fromkeys(ENDPOINTS, 0.0),
+    'jitter': 0.0,
+    'error_rate': dict.fromkeys(ENDPOINTS, 0.0),
+    'payload_size': dict.fromkeys(ENDPOINTS, 0),
+}
+stats = dict.fromkeys(ENDPOINTS + ('errors',), 0)
+stats_lock = threading.Lock()
+
+
+def generate_accounts(count, roles_per_account=1):
+    """Return the JSON account list of `count` made up accounts"""
+    return json.dumps(dict(
+        ('account-{0:05d}'.format(number),
+         ['role-{0}'.format(role) for role in range(roles_per_account)])
+        for number in range(count)), sort_keys=True)
+
 
+def respond(endpoint, body, etag=None):
+    """Answer like a server with the configured latency and errors"""
+    with stats_lock:
+        stats[endpoint] += 1
+    latency = settings['latency'][endpoint]
+    if latency or settings['jitter']:
+        time.sleep(latency + random.random() * settings['jitter'])
+    if random.random() < settings['error_rate'][endpoint]:
+        with stats_lock:
+            stats['errors'] += 1
+        bottle.response.status = 503
+        return 'AFP mock is overloaded'
+    if etag is not None:
+        bottle.response.set_header('ETag', etag)
+        if bottle.request.get_header('If-None-Match') == etag:
+            bottle.response.status = 304
+            return ''
+    # JSON allows trailing whitespace, so padding does not change the data
+    return body.ljust(settings['payload_size'][endpoint])
 
 
 @route('/account')
 def account():
-    return '{"test_account": ["test_role"],' \
-           '"test_account_with_long_name": ["test_role_with_long_name"]}'
+    return respond('account', settings['accounts'], settings['accounts_etag'])
 
 
 @route('/account/<account>/<role>')
 def credentials(account, role):
-    return dedent("""
-                  {"Code": "Success",
-                   "LastUpdated": "1970-01-01T00:00:00Z",
-                   "AccessKeyId": "XXXXXXXXXXXX",
-                   "SecretAccessKey": "XXXXXXXXXXXX",
-                   "Token": "XXXXXXXXXXXX",
-                   "Expiration": "2032-01-01T00:00:00Z",
-                   "Type": "AWS-HMAC"}""").strip()
-
-try:
-    if len(sys.argv) > 1:
-        daemon_run(host='localhost', port=5555)
-    else:
-        # manual testing mode on different port, so it won't stop
-        # "pyb install" from running tests
-        bottle.run(host='localhost', port=5544)
-except Exception as exc:
-    with open('./bottle.log', 'a') as log:
-        log.write('AFP mock failed to start: ' + str(exc) +  '\n')
+    return respond('credentials', CREDENTIALS)
+
+
+@route('/_mock/stats')
+def get_stats():
+    with stats_lock:
+        return dict(stats)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """Answer concurrent requests concurrently, as the real AFP does"""
+    daemon_threads = True
+    # Do not refuse connections when benchmarked with many workers
+    request_queue_size = 128
+
+
+def parse_per_endpoint(values, type_):
+    """
+    Parse options given as VALUE for all endpoints or ENDPOINT=VALUE for
+    one of them, later ones overriding earlier ones.
+    """
+    result = {}
+    for value in values or []:
+        endpoint, _, number = value.rpartition('=')
+        endpoints = [endpoint] if endpoint else ENDPOINTS
+        if endpoint and endpoint not in ENDPOINTS:
+            raise ValueError("Unknown endpoint '{0}', use one of {1}".format(
+                endpoint, ', '.join(ENDPOINTS)))
+        for endpoint in endpoints:
+            result[endpoint] = type_(number)
+    return result
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--daemon', action='store_true',
+                        help="Detach from the terminal, on port 5555 "
+                             "unless --port is given.")
+    parser.add_argument('--accounts', type=int,
+                        help="Serve this many made up accounts instead of "
+                             "the two test accounts.")
+    parser.add_argument('--roles-per-account', type=int, default=1)
+    parser.add_argument('--latency', action='append', metavar='[ENDPOINT=]'
+                        'SECONDS', help="Time to answer a request.")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        metavar='SECONDS', help="Random extra time to "
+                        "answer a request.")
+    parser.add_argument('--error-rate', action='append',
+                        metavar='[ENDPOINT=]FRACTION',
+                        help="Share of requests answered with status 503.")
+    parser.add_argument('--payload-size', action='append',
+                        metavar='[ENDPOINT=]BYTES',
+                        help="Pad answers with whitespace to this size.")
+    arguments = parser.parse_args(argv)
+    try:
+        arguments.latency = parse_per_endpoint(arguments.latency, float)
+        arguments.error_rate = parse_per_endpoint(
+            arguments.error_rate, float)
+        arguments.payload_size = parse_per_endpoint(
+            arguments.payload_size, int)
+    except ValueError as exc:
+        parser.error(str(exc))
+    return arguments
+
+
+def configure(arguments):
+    if arguments.accounts is not None:
+        settings['accounts'] = generate_accounts(
+            arguments.accounts, arguments.roles_per_account)
+        settings['accounts_etag'] = '"accounts-{0}-{1}"'.format(
+            arguments.accounts, arguments.roles_per_account)
+    settings['latency'].update(arguments.latency)
+    settings['jitter'] = arguments.jitter
+    settings['error_rate'].update(arguments.error_rate)
+    settings['payload_size'].update(arguments.payload_size)
+
+
+def main(argv=None):
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    configure(arguments)
+    try:
+        if arguments.daemon:
+            daemon_run(host='localhost', port=arguments.port or 5555)
+        else:
+            # manual testing mode on different port, so it won't stop
+            # "pyb install" from running tests
+            bottle.run(host='localhost', port=arguments.port or 5544,
+                       server_class=ThreadingWSGIServer, quiet=True)
+    except Exception as exc:
+        with open('./bottle.log', 'a') as log:
+            log.write('AFP mock failed to start: ' + str(exc) + '\n')
+
+
+if __name__ == '__main__':
+    main()
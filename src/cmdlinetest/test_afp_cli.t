@@ -62,6 +62,10 @@
    u?'--write': False, (re)
    u?'<accountname>': None, (re)
    u?'<rolename>': None} (re)
+  Attempt 1 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 2 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 3 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Giving up on GET http://localhost:5544/account after 4 attempts
   [1]
 
 # Test failing to access AFP with debug and username
@@ -79,6 +83,10 @@
    u?'--write': False, (re)
    u?'<accountname>': None, (re)
    u?'<rolename>': None} (re)
+  Attempt 1 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 2 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 3 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Giving up on GET http://localhost:5544/account after 4 attempts
   [1]
 
 # BEGIN mocking AFP
@@ -26,9 +26,17 @@
   Usage:
       afp [options] help
       afp [options] version
-      afp [options] list [--output <output_format>]
-      afp [options] (show | export | shell) <accountname> [<rolename>]
+      afp [options] list [--output <output_format>] [--filter <pattern>] [--role <pattern>]
+      afp [options] (show | export | shell | credential-process) <accountname> [<rolename>]
       afp [options] write [--profile <profile_name>] <accountname> [<rolename>]
+      afp [options] agent [--foreground]
+      afp [options] serve-metadata [--port <port>]
+      afp [options] fetch [--output <output_format>] [--workers <count>] [--write] [--from-file <pairs_file>] [<pair>...]
+      afp [options] stream [--workers <count>]
+      afp [options] bench [--output <output_format>] [--workers <count>] [--requests <count>] [--duration <seconds>] [--rate <per_second>] [<pair>...]
+      afp [options] find [--limit <count>] [--assume] <query>...
+      afp [options] complete accounts [<prefix>]
+      afp [options] complete roles <accountname> [<prefix>]
       afp [options] <accountname> [<rolename>]
   [1]
 
@@ -38,24 +46,54 @@
   Usage:
       afp [options] help
       afp [options] version
-      afp [options] list [--output <output_format>]
-      afp [options] (show | export | shell) <accountname> [<rolename>]
+      afp [options] list [--output <output_format>] [--filter <pattern>] [--role <pattern>]
+      afp [options] (show | export | shell | credential-process) <accountname> [<rolename>]
       afp [options] write [--profile <profile_name>] <accountname> [<rolename>]
+      afp [options] agent [--foreground]
+      afp [options] serve-metadata [--port <port>]
+      afp [options] fetch [--output <output_format>] [--workers <count>] [--write] [--from-file <pairs_file>] [<pair>...]
+      afp [options] stream [--workers <count>]
+      afp [options] bench [--output <output_format>] [--workers <count>] [--requests <count>] [--duration <seconds>] [--rate <per_second>] [<pair>...]
+      afp [options] find [--limit <count>] [--assume] <query>...
+      afp [options] complete accounts [<prefix>]
+      afp [options] complete roles <accountname> [<prefix>]
       afp [options] <accountname> [<rolename>]
   
   Options:
     -h, --help                          Show this.
     -d, --debug                         Activate debug output.
+    --timing                            Show on stderr how long each phase of afp took, e.g. DNS, password and HTTP.
     -u, --user <username>               The user you want to use.
-    -s, --server <servername>           The AFP server to use.
-    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest). Takes precedence over --server.
+    -s, --server <servername>           The AFP server to use, or several separated by commas.
+    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest), or several separated by commas. Takes precedence over --server.
     -p, --password-provider <provider>  Password provider. Valid values are: 'prompt', 'keyring' and 'testing'.
-    -o, --output <output_format>        Output format for 'list'. Valid values are: 'human', 'json' and 'csv'
+    -o, --output <output_format>        Output format for 'list', 'fetch' and 'bench'. Valid values are: 'human', 'json' and 'csv'
+    --filter <pattern>                  Only list accounts matching this glob pattern, e.g. 'prod-*', or regular expression between slashes, e.g. '/^prod-(eu|us)/'.
+    --role <pattern>                    Only list roles matching this glob pattern or regular expression between slashes, and the accounts having them.
     --profile <profile_name>            Which profile to use in the aws credentials file.
+    --no-cache                          Always fetch fresh credentials instead of using cached ones.
+    --connect-timeout <seconds>         Seconds to wait for a connection to the AFP server. Defaults to 10.
+    --read-timeout <seconds>            Seconds to wait for an answer of the AFP server. Defaults to 30.
+    --pool-size <count>                 How many connections to the AFP server to keep open. Defaults to 10.
+    --no-keep-alive                     Open a new connection for every request to the AFP server.
+    --refresh                           Fetch new credentials for the subshell before the current ones expire.
+    --foreground                        Do not detach the agent from the terminal.
+    --workers <count>                   How many credentials to fetch or requests to send concurrently [default: 10].
+    --requests <count>                  How many requests to send. Defaults to 100, unless --duration is given.
+    --duration <seconds>                For how many seconds to send requests.
+    --rate <per_second>                 How many requests to start per second. Defaults to as many as the workers can send.
+    --port <port>                       The local port on which to serve credentials [default: 8123].
+    --limit <count>                     How many matches to show [default: 10].
+    --assume                            Use the best match like <accountname> and <rolename>, e.g. to open a subshell for it.
+    --from-file <pairs_file>            Read <account>/<role> pairs from a file, one per line. Use '-' for stdin.
+    --write                             Also write fetched credentials to the aws credentials file, as profiles named '<account>-<role>'.
   
   Arguments:
     <accountname>                       The AWS account id you want to login to.
     <rolename>                          The AWS role you want to use for login. Defaults to the first role.
+    <pair>                              An AWS account id and role separated by a slash, e.g. 'myaccount/myrole'.
+    <prefix>                            Only complete names starting with this.
+    <query>                             Words to look for in account and role names, typos are allowed.
   
   Subcommands:
     help                                Show help.
@@ -65,6 +103,14 @@
     export                              Show credentials in an export suitable format.
     write                               Write credentials to aws credentials file.
     shell                               Open a subshell with exported credentials.
+    credential-process                  Show credentials in the format of the AWS SDK 'credential_process' setting.
+    agent                               Start a background process which answers requests of other afp invocations.
+    fetch                               Fetch credentials for many accounts and roles concurrently.
+    serve-metadata                      Serve credentials to AWS SDKs like the ECS container credentials endpoint.
+    stream                              Read <account> <role> lines from stdin and write the credentials for each as a line of JSON as soon as they are fetched.
+    bench                               Send many requests to the AFP server, for the account list and the credentials of every <pair>, and report latency, throughput and errors.
+    find                                Search accounts and roles in the cached account list and show the best matches as <account>/<role>.
+    complete                            Complete accounts or roles from the cached account list, for shell completion.
 
   $ afp --help
   Command line client for the AFP V2 (AWS Federation Proxy)
@@ -72,24 +118,54 @@
   Usage:
       afp [options] help
       afp [options] version
-      afp [options] list [--output <output_format>]
-      afp [options] (show | export | shell) <accountname> [<rolename>]
+      afp [options] list [--output <output_format>] [--filter <pattern>] [--role <pattern>]
+      afp [options] (show | export | shell | credential-process) <accountname> [<rolename>]
       afp [options] write [--profile <profile_name>] <accountname> [<rolename>]
+      afp [options] agent [--foreground]
+      afp [options] serve-metadata [--port <port>]
+      afp [options] fetch [--output <output_format>] [--workers <count>] [--write] [--from-file <pairs_file>] [<pair>...]
+      afp [options] stream [--workers <count>]
+      afp [options] bench [--output <output_format>] [--workers <count>] [--requests <count>] [--duration <seconds>] [--rate <per_second>] [<pair>...]
+      afp [options] find [--limit <count>] [--assume] <query>...
+      afp [options] complete accounts [<prefix>]
+      afp [options] complete roles <accountname> [<prefix>]
       afp [options] <accountname> [<rolename>]
   
   Options:
     -h, --help                          Show this.
     -d, --debug                         Activate debug output.
+    --timing                            Show on stderr how long each phase of afp took, e.g. DNS, password and HTTP.
     -u, --user <username>               The user you want to use.
-    -s, --server <servername>           The AFP server to use.
-    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest). Takes precedence over --server.
+    -s, --server <servername>           The AFP server to use, or several separated by commas.
+    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest), or several separated by commas. Takes precedence over --server.
     -p, --password-provider <provider>  Password provider. Valid values are: 'prompt', 'keyring' and 'testing'.
-    -o, --output <output_format>        Output format for 'list'. Valid values are: 'human', 'json' and 'csv'
+    -o, --output <output_format>        Output format for 'list', 'fetch' and 'bench'. Valid values are: 'human', 'json' and 'csv'
+    --filter <pattern>                  Only list accounts matching this glob pattern, e.g. 'prod-*', or regular expression between slashes, e.g. '/^prod-(eu|us)/'.
+    --role <pattern>                    Only list roles matching this glob pattern or regular expression between slashes, and the accounts having them.
     --profile <profile_name>            Which profile to use in the aws credentials file.
+    --no-cache                          Always fetch fresh credentials instead of using cached ones.
+    --connect-timeout <seconds>         Seconds to wait for a connection to the AFP server. Defaults to 10.
+    --read-timeout <seconds>            Seconds to wait for an answer of the AFP server. Defaults to 30.
+    --pool-size <count>                 How many connections to the AFP server to keep open. Defaults to 10.
+    --no-keep-alive                     Open a new connection for every request to the AFP server.
+    --refresh                           Fetch new credentials for the subshell before the current ones expire.
+    --foreground                        Do not detach the agent from the terminal.
+    --workers <count>                   How many credentials to fetch or requests to send concurrently [default: 10].
+    --requests <count>                  How many requests to send. Defaults to 100, unless --duration is given.
+    --duration <seconds>                For how many seconds to send requests.
+    --rate <per_second>                 How many requests to start per second. Defaults to as many as the workers can send.
+    --port <port>                       The local port on which to serve credentials [default: 8123].
+    --limit <count>                     How many matches to show [default: 10].
+    --assume                            Use the best match like <accountname> and <rolename>, e.g. to open a subshell for it.
+    --from-file <pairs_file>            Read <account>/<role> pairs from a file, one per line. Use '-' for stdin.
+    --write                             Also write fetched credentials to the aws credentials file, as profiles named '<account>-<role>'.
   
   Arguments:
     <accountname>                       The AWS account id you want to login to.
     <rolename>                          The AWS role you want to use for login. Defaults to the first role.
+    <pair>                              An AWS account id and role separated by a slash, e.g. 'myaccount/myrole'.
+    <prefix>                            Only complete names starting with this.
+    <query>                             Words to look for in account and role names, typos are allowed.
   
   Subcommands:
     help                                Show help.
@@ -99,6 +175,14 @@
     export                              Show credentials in an export suitable format.
     write                               Write credentials to aws credentials file.
     shell                               Open a subshell with exported credentials.
+    credential-process                  Show credentials in the format of the AWS SDK 'credential_process' setting.
+    agent                               Start a background process which answers requests of other afp invocations.
+    fetch                               Fetch credentials for many accounts and roles concurrently.
+    serve-metadata                      Serve credentials to AWS SDKs like the ECS container credentials endpoint.
+    stream                              Read <account> <role> lines from stdin and write the credentials for each as a line of JSON as soon as they are fetched.
+    bench                               Send many requests to the AFP server, for the account list and the credentials of every <pair>, and report latency, throughput and errors.
+    find                                Search accounts and roles in the cached account list and show the best matches as <account>/<role>.
+    complete                            Complete accounts or roles from the cached account list, for shell completion.
 
   $ afp help
   Command line client for the AFP V2 (AWS Federation Proxy)
@@ -106,24 +190,54 @@
   Usage:
       afp [options] help
       afp [options] version
-      afp [options] list [--output <output_format>]
-      afp [options] (show | export | shell) <accountname> [<rolename>]
+      afp [options] list [--output <output_format>] [--filter <pattern>] [--role <pattern>]
+      afp [options] (show | export | shell | credential-process) <accountname> [<rolename>]
       afp [options] write [--profile <profile_name>] <accountname> [<rolename>]
+      afp [options] agent [--foreground]
+      afp [options] serve-metadata [--port <port>]
+      afp [options] fetch [--output <output_format>] [--workers <count>] [--write] [--from-file <pairs_file>] [<pair>...]
+      afp [options] stream [--workers <count>]
+      afp [options] bench [--output <output_format>] [--workers <count>] [--requests <count>] [--duration <seconds>] [--rate <per_second>] [<pair>...]
+      afp [options] find [--limit <count>] [--assume] <query>...
+      afp [options] complete accounts [<prefix>]
+      afp [options] complete roles <accountname> [<prefix>]
       afp [options] <accountname> [<rolename>]
   
   Options:
     -h, --help                          Show this.
     -d, --debug                         Activate debug output.
+    --timing                            Show on stderr how long each phase of afp took, e.g. DNS, password and HTTP.
     -u, --user <username>               The user you want to use.
-    -s, --server <servername>           The AFP server to use.
-    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest). Takes precedence over --server.
+    -s, --server <servername>           The AFP server to use, or several separated by commas.
+    -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest), or several separated by commas. Takes precedence over --server.
     -p, --password-provider <provider>  Password provider. Valid values are: 'prompt', 'keyring' and 'testing'.
-    -o, --output <output_format>        Output format for 'list'. Valid values are: 'human', 'json' and 'csv'
+    -o, --output <output_format>        Output format for 'list', 'fetch' and 'bench'. Valid values are: 'human', 'json' and 'csv'
+    --filter <pattern>                  Only list accounts matching this glob pattern, e.g. 'prod-*', or regular expression between slashes, e.g. '/^prod-(eu|us)/'.
+    --role <pattern>                    Only list roles matching this glob pattern or regular expression between slashes, and the accounts having them.
     --profile <profile_name>            Which profile to use in the aws credentials file.
+    --no-cache                          Always fetch fresh credentials instead of using cached ones.
+    --connect-timeout <seconds>         Seconds to wait for a connection to the AFP server. Defaults to 10.
+    --read-timeout <seconds>            Seconds to wait for an answer of the AFP server. Defaults to 30.
+    --pool-size <count>                 How many connections to the AFP server to keep open. Defaults to 10.
+    --no-keep-alive                     Open a new connection for every request to the AFP server.
+    --refresh                           Fetch new credentials for the subshell before the current ones expire.
+    --foreground                        Do not detach the agent from the terminal.
+    --workers <count>                   How many credentials to fetch or requests to send concurrently [default: 10].
+    --requests <count>                  How many requests to send. Defaults to 100, unless --duration is given.
+    --duration <seconds>                For how many seconds to send requests.
+    --rate <per_second>                 How many requests to start per second. Defaults to as many as the workers can send.
+    --port <port>                       The local port on which to serve credentials [default: 8123].
+    --limit <count>                     How many matches to show [default: 10].
+    --assume                            Use the best match like <accountname> and <rolename>, e.g. to open a subshell for it.
+    --from-file <pairs_file>            Read <account>/<role> pairs from a file, one per line. Use '-' for stdin.
+    --write                             Also write fetched credentials to the aws credentials file, as profiles named '<account>-<role>'.
   
   Arguments:
     <accountname>                       The AWS account id you want to login to.
     <rolename>                          The AWS role you want to use for login. Defaults to the first role.
+    <pair>                              An AWS account id and role separated by a slash, e.g. 'myaccount/myrole'.
+    <prefix>                            Only complete names starting with this.
+    <query>                             Words to look for in account and role names, typos are allowed.
   
   Subcommands:
     help                                Show help.
@@ -133,6 +247,14 @@
     export                              Show credentials in an export suitable format.
     write                               Write credentials to aws credentials file.
     shell                               Open a subshell with exported credentials.
+    credential-process                  Show credentials in the format of the AWS SDK 'credential_process' setting.
+    agent                               Start a background process which answers requests of other afp invocations.
+    fetch                               Fetch credentials for many accounts and roles concurrently.
+    serve-metadata                      Serve credentials to AWS SDKs like the ECS container credentials endpoint.
+    stream                              Read <account> <role> lines from stdin and write the credentials for each as a line of JSON as soon as they are fetched.
+    bench                               Send many requests to the AFP server, for the account list and the credentials of every <pair>, and report latency, throughput and errors.
+    find                                Search accounts and roles in the cached account list and show the best matches as <account>/<role>.
+    complete                            Complete accounts or roles from the cached account list, for shell completion.
 
 # Test failing to access AFP
 
@@ -150,20 +272,52 @@
   $ afp -d -p testing -a http://localhost:5544 list
   Failed to get account list from AWS: .* (re)
   {u?'--api-url': 'http://localhost:5544', (re)
+   u?'--assume': False, (re)
+   u?'--connect-timeout': None, (re)
    u?'--debug': True, (re)
+   u?'--duration': None, (re)
+   u?'--filter': None, (re)
+   u?'--foreground': False, (re)
+   u?'--from-file': None, (re)
    u?'--help': False, (re)
+   u?'--limit': '10', (re)
+   u?'--no-cache': False, (re)
+   u?'--no-keep-alive': False, (re)
    u?'--output': None, (re)
    u?'--password-provider': 'testing', (re)
+   u?'--pool-size': None, (re)
+   u?'--port': '8123', (re)
    u?'--profile': None, (re)
+   u?'--rate': None, (re)
+   u?'--read-timeout': None, (re)
+   u?'--refresh': False, (re)
+   u?'--requests': None, (re)
+   u?'--role': None, (re)
    u?'--server': None, (re)
+   u?'--timing': False, (re)
    u?'--user': None, (re)
+   u?'--workers': '10', (re)
+   u?'--write': False, (re)
    u?'<accountname>': None, (re)
+   u?'<pair>': \[\], (re)
+   u?'<prefix>': None, (re)
+   u?'<query>': \[\], (re)
    u?'<rolename>': None, (re)
+   u?'accounts': False, (re)
+   u?'agent': False, (re)
+   u?'bench': False, (re)
+   u?'complete': False, (re)
+   u?'credential-process': False, (re)
    u?'export': False, (re)
+   u?'fetch': False, (re)
+   u?'find': False, (re)
    u?'help': False, (re)
    u?'list': True, (re)
+   u?'roles': False, (re)
+   u?'serve-metadata': False, (re)
    u?'shell': False, (re)
    u?'show': False, (re)
+   u?'stream': False, (re)
    u?'version': False, (re)
    u?'write': False} (re)
   Subcommand is 'list'
@@ -171,6 +325,10 @@
   'username' is '.*' (re)
   'password-provider' is 'testing'
   'output' is 'human'
+  Attempt 1 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 2 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 3 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Giving up on GET http://localhost:5544/account after 4 attempts
   [1]
 
 # Test failing to access AFP with debug and username
@@ -178,20 +336,52 @@
   $ afp --debug --password-provider testing --api-url=http://localhost:5544 --user=test_user list
   Failed to get account list from AWS: .* (re)
   {u?'--api-url': 'http://localhost:5544', (re)
+   u?'--assume': False, (re)
+   u?'--connect-timeout': None, (re)
    u?'--debug': True, (re)
+   u?'--duration': None, (re)
+   u?'--filter': None, (re)
+   u?'--foreground': False, (re)
+   u?'--from-file': None, (re)
    u?'--help': False, (re)
+   u?'--limit': '10', (re)
+   u?'--no-cache': False, (re)
+   u?'--no-keep-alive': False, (re)
    u?'--output': None, (re)
    u?'--password-provider': 'testing', (re)
+   u?'--pool-size': None, (re)
+   u?'--port': '8123', (re)
    u?'--profile': None, (re)
+   u?'--rate': None, (re)
+   u?'--read-timeout': None, (re)
+   u?'--refresh': False, (re)
+   u?'--requests': None, (re)
+   u?'--role': None, (re)
    u?'--server': None, (re)
+   u?'--timing': False, (re)
    u?'--user': 'test_user', (re)
+   u?'--workers': '10', (re)
+   u?'--write': False, (re)
    u?'<accountname>': None, (re)
+   u?'<pair>': \[\], (re)
+   u?'<prefix>': None, (re)
+   u?'<query>': \[\], (re)
    u?'<rolename>': None, (re)
+   u?'accounts': False, (re)
+   u?'agent': False, (re)
+   u?'bench': False, (re)
+   u?'complete': False, (re)
+   u?'credential-process': False, (re)
    u?'export': False, (re)
+   u?'fetch': False, (re)
+   u?'find': False, (re)
    u?'help': False, (re)
    u?'list': True, (re)
+   u?'roles': False, (re)
+   u?'serve-metadata': False, (re)
    u?'shell': False, (re)
    u?'show': False, (re)
+   u?'stream': False, (re)
    u?'version': False, (re)
    u?'write': False} (re)
   Subcommand is 'list'
@@ -199,6 +389,10 @@
   'username' is 'test_user'
   'password-provider' is 'testing'
   'output' is 'human'
+  Attempt 1 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 2 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 3 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Giving up on GET http://localhost:5544/account after 4 attempts
   [1]
 
 # Test failing to access AFP with debug and username with long options
@@ -206,20 +400,52 @@
   $ afp -d -p testing -a http://localhost:5544 -u test_user list
   Failed to get account list from AWS: .* (re)
   {u?'--api-url': 'http://localhost:5544', (re)
+   u?'--assume': False, (re)
+   u?'--connect-timeout': None, (re)
    u?'--debug': True, (re)
+   u?'--duration': None, (re)
+   u?'--filter': None, (re)
+   u?'--foreground': False, (re)
+   u?'--from-file': None, (re)
    u?'--help': False, (re)
+   u?'--limit': '10', (re)
+   u?'--no-cache': False, (re)
+   u?'--no-keep-alive': False, (re)
    u?'--output': None, (re)
    u?'--password-provider': 'testing', (re)
+   u?'--pool-size': None, (re)
+   u?'--port': '8123', (re)
    u?'--profile': None, (re)
+   u?'--rate': None, (re)
+   u?'--read-timeout': None, (re)
+   u?'--refresh': False, (re)
+   u?'--requests': None, (re)
+   u?'--role': None, (re)
    u?'--server': None, (re)
+   u?'--timing': False, (re)
    u?'--user': 'test_user', (re)
+   u?'--workers': '10', (re)
+   u?'--write': False, (re)
    u?'<accountname>': None, (re)
+   u?'<pair>': \[\], (re)
+   u?'<prefix>': None, (re)
+   u?'<query>': \[\], (re)
    u?'<rolename>': None, (re)
+   u?'accounts': False, (re)
+   u?'agent': False, (re)
+   u?'bench': False, (re)
+   u?'complete': False, (re)
+   u?'credential-process': False, (re)
    u?'export': False, (re)
+   u?'fetch': False, (re)
+   u?'find': False, (re)
    u?'help': False, (re)
    u?'list': True, (re)
+   u?'roles': False, (re)
+   u?'serve-metadata': False, (re)
    u?'shell': False, (re)
    u?'show': False, (re)
+   u?'stream': False, (re)
    u?'version': False, (re)
    u?'write': False} (re)
   Subcommand is 'list'
@@ -227,6 +453,10 @@
   'username' is 'test_user'
   'password-provider' is 'testing'
   'output' is 'human'
+  Attempt 1 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 2 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Attempt 3 of 4 to GET http://localhost:5544/account failed: .* (re)
+  Giving up on GET http://localhost:5544/account after 4 attempts
   [1]
 
 # BEGIN mocking AFP
@@ -261,6 +491,33 @@
   test_account,test_role
   test_account_with_long_name,test_role_with_long_name
 
+# Test filtering the account list
+
+  $ afp -p testing -a http://localhost:5544 list --filter 'test_account_*'
+  test_account_with_long_name    test_role_with_long_name
+
+  $ afp -p testing -a http://localhost:5544 list --filter '/^test_acc/' --role '*_long_*' -o csv
+  test_account_with_long_name,test_role_with_long_name
+
+  $ afp -p testing -a http://localhost:5544 list --filter '/(/'
+  '/\(/' is not a valid filter: .* (re)
+  [1]
+
+# Test timing the phases of an invocation
+
+  $ afp --timing --no-cache -p testing -a http://localhost:5544 show test_account test_role 2>&1 >/dev/null | sed 's/ *[0-9]* ms.*//'
+  afp timing:
+    config
+    imports
+    password
+    cookies
+    http
+    other
+
+  $ AFP_TIMING=$HOME/timing.jsonl afp -p testing -a http://localhost:5544 list > /dev/null
+  $ python -c 'import json, sys; print(json.load(sys.stdin)["subcommand"])' < $HOME/timing.jsonl
+  list
+
 
 # Test credentials with subshell
 
@@ -312,6 +569,29 @@
   export AWS_SESSION_TOKEN='XXXXXXXXXXXX'
   export AWS_VALID_SECONDS='.*' (re)
 
+# Test credentials for the AWS SDK credential_process setting
+
+  $ afp -p testing -a http://localhost:5544 credential-process test_account test_role
+  {"AccessKeyId": "XXXXXXXXXXXX", "Expiration": "2032-01-01T00:00:00Z", "SecretAccessKey": "XXXXXXXXXXXX", "SessionToken": "XXXXXXXXXXXX", "Version": 1}
+
+# Test that cached credentials are used without asking for a password
+
+  $ afp -p no_such_provider -a http://localhost:5544 show test_account test_role
+  AWS_ACCESS_KEY_ID='XXXXXXXXXXXX'
+  AWS_ACCOUNT_NAME='test_account'
+  AWS_ASSUMED_ROLE='test_role'
+  AWS_EXPIRATION_DATE='2032-01-01T00:00:00Z'
+  AWS_SECRET_ACCESS_KEY='XXXXXXXXXXXX'
+  AWS_SECURITY_TOKEN='XXXXXXXXXXXX'
+  AWS_SESSION_TOKEN='XXXXXXXXXXXX'
+  AWS_VALID_SECONDS='.*' (re)
+
+# Test that the default role is remembered, so cached credentials are used
+# without asking for a password even if no role is given
+
+  $ afp -p no_such_provider -a http://localhost:5544 show test_account | grep ROLE
+  AWS_ASSUMED_ROLE='test_role'
+
 # Test credentials for user/account names that need url-encoding.
 
   $ afp -p testing -a http://localhost:5544 export '##test_account##' '??test_role??'
@@ -340,6 +620,92 @@
   $ afp -p testing -a http://localhost:5544 write test_account test_rolé
   Wrote credentials to file: '*/.aws/credentials' (glob)
 
+# Test streaming credentials for pairs read from stdin
+
+  $ printf 'test_account test_role\n# comment\ntest_account/test_role\n' | afp -p testing -a http://localhost:5544 stream | cut -c1-44
+  {"account": "test_account", "credentials": {
+  {"account": "test_account", "credentials": {
+
+  $ echo invalid | afp -p testing -a http://localhost:5544 stream
+  Skipping invalid line: 'invalid' is not a valid <account>/<role> pair.
+  Skipped 1 invalid lines.
+  [1]
+
+# Test sending many requests to measure the AFP server
+
+  $ afp -p testing -a http://localhost:5544 bench --requests 4 -o csv test_account/test_role | cut -d, -f1-3
+  target,requests,errors
+  total,4,0
+  /account,2,0
+  /account/test_account/test_role,2,0
+
+# Test fetching credentials for many accounts and roles
+
+  $ printf 'test_account/test_role\n# comment\n\ntest_account test_role_with_long_name\n' > pairs.txt
+  $ afp -p testing -a http://localhost:5544 fetch --from-file pairs.txt other_account/other_role
+  other_account/other_role                 OK
+  test_account/test_role                   OK
+  test_account/test_role_with_long_name    OK
+
+# Test writing credentials for many accounts and roles at once
+
+  $ afp -p testing -a http://localhost:5544 fetch --write test_account/test_role test_account/test_role_with_long_name
+  test_account/test_role                   OK
+  test_account/test_role_with_long_name    OK
+  Wrote credentials of 2 profiles to file: '*/.aws/credentials' (glob)
+  $ grep '^\[' $HOME/.aws/credentials
+  [default]
+  [test_account-test_role]
+  [test_account-test_role_with_long_name]
+  $ rm $HOME/.aws/credentials
+
+# Test that a running agent is used without asking for a password
+
+  $ afp -p testing -a http://localhost:5544 agent --foreground >agent.log &
+  $ AGENTPID=$!
+  $ sleep 1
+  $ afp -p no_such_provider -a http://localhost:5544 list
+  test_account                   test_role
+  test_account_with_long_name    test_role_with_long_name
+  $ kill $AGENTPID
+
+# Test serving credentials like the ECS container credentials endpoint
+
+  $ afp -p testing -a http://localhost:5544 serve-metadata --port 5545 >metadata.log &
+  $ METADATAPID=$!
+  $ sleep 1
+  $ head -1 metadata.log
+  Serving credentials on 'http://127.0.0.1:5545/<account>/<role>', use them with:
+  $ TOKEN=$(sed -n "s/.*TOKEN='\(.*\)'/\1/p" metadata.log)
+  $ python -c "
+  > import sys, requests
+  > r = requests.get('http://127.0.0.1:5545/test_account/test_role', headers={'Authorization': sys.argv[1]})
+  > print(r.status_code, r.text)
+  > r = requests.get('http://127.0.0.1:5545/test_account/test_role')
+  > print(r.status_code)" "$TOKEN"
+  200 {"AccessKeyId": "XXXXXXXXXXXX", "Expiration": "2032-01-01T00:00:00Z", "SecretAccessKey": "XXXXXXXXXXXX", "Token": "XXXXXXXXXXXX"}
+  401
+  $ kill $METADATAPID
+
+# Test completing accounts and roles from the cached account list
+
+  $ afp -a http://localhost:5544 complete accounts test_account_
+  test_account_with_long_name
+  $ afp -a http://localhost:5544 complete roles test_account
+  test_role
+  $ afp -a http://localhost:5544 complete roles test_account nothing_matches
+  $ afp -a http://localhost:5544 -u someone_else complete accounts
+
+# Test finding accounts and roles in the cached account list
+
+  $ afp -a http://localhost:5544 find long
+  test_account_with_long_name/test_role_with_long_name
+  $ afp -a http://localhost:5544 find --limit 1 tst acount
+  test_account/test_role
+  $ afp -a http://localhost:5544 find nothing_matches
+  No account or role matches 'nothing_matches'.
+  [1]
+
 # Output version of self
 
   $ afp version
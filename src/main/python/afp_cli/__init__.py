@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function
 
-from .client import AWSFederationClientCmd
+import sys
 
 __all__ = ['AWSFederationClientCmd']
 
 __version__ = '${version}'
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # Importing the client means importing requests, which is by far
+        # the slowest part of starting afp. Do it on first use only.
+        if name == 'AWSFederationClientCmd':
+            from .client import AWSFederationClientCmd
+            return AWSFederationClientCmd
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name))
+else:  # pragma: no cover
+    from .client import AWSFederationClientCmd  # NOQA
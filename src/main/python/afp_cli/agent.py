@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+A long running process that keeps one AWSFederationClientCmd (session,
+cookies and password) alive and answers requests over a Unix socket.
+
+The protocol is one JSON document per line: the client sends a single
+request and the agent answers with either {"result": ...} or
+{"error": "..."} before closing the connection.
+"""
+from __future__ import print_function, absolute_import, division
+
+import hashlib
+import json
+import os
+import signal
+import socket
+import sys
+
+from six.moves import socketserver
+
+from .exceptions import APICallError
+from .fileutils import ensure_dir
+from .log import debug
+
+PING, ACCOUNTS, CREDENTIALS = 'ping', 'accounts', 'credentials'
+
+# Seconds to wait for the agent before giving up on it
+AGENT_TIMEOUT = 30
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def get_socket_path(api_url, username):
+    """Return the socket path of the agent serving api_url and username"""
+    key = json.dumps([api_url, username])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser("~/.afp-cli"),
+                        'agent-{0}.sock'.format(digest))
+
+
+class AgentClient(object):
+    """Drop-in replacement for AWSFederationClientCmd using a running agent"""
+
+    def __init__(self, socket_path, timeout=AGENT_TIMEOUT, no_cache=False):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        # Ask the agent for fresh credentials instead of its cached ones
+        self.no_cache = no_cache
+
+    def request(self, command, **kwargs):
+        kwargs['command'] = command
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            sock.close()
+
+        try:
+            response = json.loads(b''.join(chunks).decode('utf-8'))
+        except ValueError:
+            raise APICallError("Invalid response from afp agent")
+        if 'error' in response:
+            raise APICallError(response['error'])
+        return response['result']
+
+    def get_account_and_role_list(self):
+        return self.request(ACCOUNTS)
+
+    def get_aws_credentials(self, account, role):
+        if self.no_cache:
+            return self.request(CREDENTIALS, account=account, role=role,
+                                no_cache=True)
+        return self.request(CREDENTIALS, account=account, role=role)
+
+
+def get_agent_client(api_url, username, no_cache=False):
+    """Return an AgentClient if an agent is running, None otherwise"""
+    if not is_supported():
+        return None
+    socket_path = get_socket_path(api_url, username)
+    if not os.path.exists(socket_path):
+        return None
+    agent_client = AgentClient(socket_path, no_cache=no_cache)
+    try:
+        agent_client.request(PING)
+    except (socket.error, APICallError) as exc:
+        debug("Ignoring afp agent at '{0}': {1}".format(socket_path, exc))
+        return None
+    debug("Using afp agent at '{0}'".format(socket_path))
+    return agent_client
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = {'result': self.server.dispatch(request)}
+        except Exception as exc:
+            response = {'error': str(exc)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class AgentServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, federation_client):
+        self.federation_client = federation_client
+        ensure_dir(os.path.dirname(socket_path))
+        if os.path.exists(socket_path):
+            # Left over from an agent that did not shut down cleanly
+            os.remove(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(
+                self, socket_path, AgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def dispatch(self, request):
+        command = request.get('command')
+        if command == PING:
+            return 'pong'
+        elif command == ACCOUNTS:
+            return self.federation_client.get_account_and_role_list()
+        elif command == CREDENTIALS:
+            if request.get('no_cache'):
+                return self.federation_client.fetch_aws_credentials(
+                    request['account'], request['role'])
+            return self.federation_client.get_aws_credentials(
+                request['account'], request['role'])
+        raise APICallError("Unknown afp agent command: %r" % command)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def _daemonize():
+    """Detach from the terminal, the parent process exits right away"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def run_agent(server, foreground=False):
+    """Serve requests until the agent is terminated"""
+    if not foreground:
+        _daemonize()
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio counterpart of AWSFederationClientCmd, for Python 3.5 and newer.
+
+Needs the optional 'aiohttp' module. All requests of a client share one
+pool of connections, which are kept alive between requests.
+"""
+from __future__ import print_function, absolute_import, division
+
+import asyncio
+import json
+
+from requests.utils import requote_uri
+from six.moves.urllib.parse import quote
+
+from .bulk import DEFAULT_WORKERS, FetchResult
+from .client import (USER_AGENT,
+                     get_api_call_error,
+                     parse_aws_credentials)
+from .compat import OrderedDict
+from .exceptions import APICallError
+from .transport import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+class AsyncAWSFederationClient(object):
+    """
+    Client for the afp api whose methods are coroutines.
+
+    Errors of the server, timeouts and failed connections are raised as
+    APICallError. Requests time out after `connect_timeout` and
+    `read_timeout` like those of AWSFederationClientCmd. Use the client
+    as async context manager, or call close() when done with it. If no
+    aiohttp `session` is given, the client creates one with at most
+    `limit` connections.
+    """
+
+    def __init__(self, api_url=None, username='', password='',
+                 ssl_verify=True, limit=DEFAULT_WORKERS, session=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        if aiohttp is None:
+            raise ImportError("The async client needs the 'aiohttp' "
+                              "module, which is not installed.")
+        self.api_url = api_url
+        self.username = username
+        self.password = password
+        # Sent with every request, since a given session knows neither
+        self.headers = {
+            'User-Agent': USER_AGENT,
+            'Authorization': aiohttp.BasicAuth(username, password).encode()}
+        self.ssl_verify = ssl_verify
+        self.limit = limit
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = session
+        self.owns_session = session is None
+
+    def get_session(self):
+        # aiohttp wants its session to be created within the event loop
+        if self.session is None:
+            connector_options = {'limit': self.limit}
+            if not self.ssl_verify:
+                connector_options['ssl'] = False
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**connector_options))
+        return self.session
+
+    async def close(self):
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def call_api(self, url_suffix):
+        """Send a request to the aws federation proxy"""
+        url_orig = '{0}{1}'.format(self.api_url, url_suffix)
+        try:
+            response = await self.get_session().get(
+                requote_uri(url_orig), headers=self.headers,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.connect_timeout,
+                    sock_read=self.read_timeout))
+            try:
+                text = await response.text()
+            finally:
+                response.release()
+        except asyncio.TimeoutError:
+            raise APICallError(
+                "API call to AWS ({0}) failed: timed out".format(url_orig))
+        except aiohttp.ClientError as exc:
+            raise APICallError("API call to AWS ({0}) failed: {1}".format(
+                url_orig, exc))
+        if response.status != 200:
+            raise get_api_call_error(url_orig, response.status,
+                                     response.reason, text)
+        return text
+
+    async def get_account_and_role_list(self):
+        """Create an aws federation proxy request and return the result"""
+        return json.loads(await self.call_api("/account"))
+
+    async def get_aws_credentials(self, account, role):
+        """Return AWS credentials for a specified user and account"""
+        return parse_aws_credentials(await self.call_api(
+            "/account/{0}/{1}".format(quote(account), quote(role))))
+
+    async def fetch_credentials(self, account, role):
+        """Return a FetchResult instead of raising on errors"""
+        try:
+            aws_credentials = await self.get_aws_credentials(account, role)
+        except Exception as exc:
+            return FetchResult(account, role, None, str(exc))
+        return FetchResult(account, role, aws_credentials, None)
+
+    async def fetch_all(self, pairs, workers=DEFAULT_WORKERS):
+        """
+        Fetch credentials for all (account, role) pairs, at most
+        `workers` at a time.
+
+        Return a list of FetchResults in the order of `pairs`, without
+        duplicates.
+        """
+        semaphore = asyncio.Semaphore(workers)
+
+        async def fetch(pair):
+            async with semaphore:
+                return await self.fetch_credentials(*pair)
+
+        return await asyncio.gather(
+            *[fetch(pair) for pair in OrderedDict.fromkeys(pairs)])
@@ -2,13 +2,35 @@
 from six.moves import configparser
 from afp_cli.compat import OrderedDict
 import os
+import stat
 import six
+from .cache import get_cache_dir, get_key_digest
+from .fileutils import file_lock, write_atomic
 from .log import info
+from .timing import timed
+
+
+def get_default_filename():
+    return os.path.expanduser("~") + '/.aws/credentials'
 
 
 def write(aws_credentials, filename=None, profile_name=None):
     profile_name = profile_name or 'default'
+    write_profiles({profile_name: aws_credentials}, filename)
+
 
+@timed('credentials-file')
+def write_profiles(profiles, filename=None, quiet=False):
+    """
+    Write the credentials of many profiles to the aws credentials file.
+
+    `profiles` maps profile names to aws credentials. The file is read
+    and written only once while holding a lock, and replaced atomically,
+    so concurrent writers do not lose each other's profiles. The lock
+    file is kept in the cache directory of afp, not next to the file. If
+    the file is a symlink, its target is replaced, keeping its
+    permissions.
+    """
     if six.PY2:
         # WTF
         ORIG_DEFAULTSECT = configparser.DEFAULTSECT
@@ -17,30 +39,43 @@ def write(aws_credentials, filename=None, profile_name=None):
     try:
 
         if not filename:
-            filename = os.path.expanduser("~") + '/.aws/credentials'
-
-        if not os.path.exists(os.path.dirname(filename)):
-            os.makedirs(os.path.dirname(filename))
+            filename = get_default_filename()
 
-        config = configparser.RawConfigParser(dict_type=OrderedDict)
-        config.read(filename)
+        # Replacing the symlink itself would leave its target behind
+        real_filename = os.path.realpath(filename)
+        lock_filename = os.path.join(
+            get_cache_dir(),
+            'credentials-file-{0}.lock'.format(get_key_digest(real_filename)))
+        with file_lock(lock_filename):
+            config = configparser.RawConfigParser(dict_type=OrderedDict)
+            config.read(real_filename)
 
-        if not config.has_section(profile_name) and \
-                (profile_name.lower() != 'default' or six.PY3):
-            config.add_section(profile_name)
+            for profile_name, aws_credentials in profiles.items():
+                if not config.has_section(profile_name) and \
+                        (profile_name.lower() != 'default' or six.PY3):
+                    config.add_section(profile_name)
 
-        config.set(profile_name, 'aws_access_key_id',
-                   aws_credentials['AWS_ACCESS_KEY_ID'])
-        config.set(profile_name, 'aws_secret_access_key',
-                   aws_credentials['AWS_SECRET_ACCESS_KEY'])
-        config.set(profile_name, 'aws_session_token',
-                   aws_credentials['AWS_SESSION_TOKEN'])
-        config.set(profile_name, 'aws_security_token',
-                   aws_credentials['AWS_SECURITY_TOKEN'])
+                config.set(profile_name, 'aws_access_key_id',
+                           aws_credentials['AWS_ACCESS_KEY_ID'])
+                config.set(profile_name, 'aws_secret_access_key',
+                           aws_credentials['AWS_SECRET_ACCESS_KEY'])
+                config.set(profile_name, 'aws_session_token',
+                           aws_credentials['AWS_SESSION_TOKEN'])
+                config.set(profile_name, 'aws_security_token',
+                           aws_credentials['AWS_SECURITY_TOKEN'])
 
-        with open(filename, 'w') as config_file:
+            try:
+                mode = stat.S_IMODE(os.stat(real_filename).st_mode)
+            except OSError:
+                mode = None
+            config_file = six.StringIO()
             config.write(config_file)
-        info("Wrote credentials to file: '{0}'".format(filename))
+            write_atomic(real_filename, config_file.getvalue(), mode)
+        if not quiet and len(profiles) == 1:
+            info("Wrote credentials to file: '{0}'".format(filename))
+        elif not quiet:
+            info("Wrote credentials of {0} profiles to file: '{1}'".format(
+                len(profiles), filename))
 
     finally:
         if six.PY2:
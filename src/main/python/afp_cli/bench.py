@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Load generation for capacity tests of an AFP server, see 'afp bench'.
+
+run_load() sends requests concurrently and optionally at a fixed rate,
+summarize() turns the latencies and errors of the requests into
+percentiles, throughput and an error breakdown.
+"""
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import time
+from collections import namedtuple
+
+from .bulk import DEFAULT_WORKERS, imap_unordered
+from .compat import OrderedDict
+
+# How many requests are sent if neither a number nor a duration is given
+DEFAULT_REQUESTS = 100
+PERCENTILES = (50, 90, 99)
+
+Sample = namedtuple('Sample', ['target', 'latency', 'error'])
+
+
+def describe_error(exc):
+    """Return the category of a failed request, e.g. 'HTTP 503'"""
+    status_code = getattr(exc, 'status_code', None)
+    if status_code is not None:
+        return 'HTTP {0}'.format(status_code)
+    return exc.__class__.__name__
+
+
+def get_schedule(targets, requests=None, duration=None, rate=None,
+                 clock=time.time):
+    """
+    Yield (target, due) for every request, round robin over targets.
+
+    `due` is the time at which the request is to be sent with a `rate`,
+    None otherwise. The schedule ends after `requests` requests or
+    `duration` seconds, whichever comes first.
+    """
+    start = clock()
+    for number, target in enumerate(itertools.cycle(targets)):
+        if requests is not None and number >= requests:
+            return
+        due = start + number / rate if rate else None
+        if duration is not None and \
+                (due if due is not None else clock()) - start >= duration:
+            return
+        yield target, due
+
+
+def run_load(send, targets, workers=DEFAULT_WORKERS, requests=None,
+             duration=None, rate=None, clock=time.time, sleep=time.sleep):
+    """
+    Call send(target) round robin over targets from `workers` threads,
+    and return the Samples of all requests and the seconds they took.
+
+    With a `rate`, requests are started at that many per second, no
+    matter how fast earlier requests are answered. Latencies are then
+    measured from the time a request was due, so that requests which
+    wait for a free worker count as slow.
+    """
+    if requests is None and duration is None:
+        requests = DEFAULT_REQUESTS
+
+    def send_and_measure(scheduled):
+        target, due = scheduled
+        if due is not None and due > clock():
+            sleep(due - clock())
+        start = clock() if due is None else due
+        try:
+            send(target)
+        except Exception as exc:
+            return Sample(target, clock() - start, describe_error(exc))
+        return Sample(target, clock() - start, None)
+
+    start = clock()
+    samples = list(imap_unordered(
+        send_and_measure,
+        get_schedule(targets, requests, duration, rate, clock), workers))
+    return samples, clock() - start
+
+
+def get_percentile(sorted_values, percentile):
+    """Return the nearest-rank percentile of sorted_values"""
+    if not sorted_values:
+        return None
+    rank = int(-(-percentile * len(sorted_values) // 100))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize_samples(samples, elapsed):
+    latencies = sorted(sample.latency for sample in samples
+                       if sample.error is None)
+    errors = OrderedDict()
+    for sample in samples:
+        if sample.error is not None:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    summary = OrderedDict([
+        ('requests', len(samples)),
+        ('errors', len(samples) - len(latencies)),
+        ('throughput', len(latencies) / elapsed if elapsed else None)])
+    summary['latency'] = OrderedDict(
+        [('p{0}'.format(percentile), get_percentile(latencies, percentile))
+         for percentile in PERCENTILES] +
+        [('max', latencies[-1] if latencies else None),
+         ('mean', sum(latencies) / len(latencies) if latencies else None)])
+    summary['error_breakdown'] = errors
+    return summary
+
+
+def summarize(samples, elapsed, targets):
+    """
+    Return the summary of all samples under 'total', followed by the
+    summaries per target. Throughput counts successful requests only.
+    """
+    summaries = OrderedDict([('total', summarize_samples(samples, elapsed))])
+    if len(targets) > 1:
+        for target in targets:
+            summaries[target] = summarize_samples(
+                [sample for sample in samples if sample.target == target],
+                elapsed)
+    return summaries
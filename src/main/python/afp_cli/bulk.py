@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import threading
+from collections import namedtuple
+
+from six.moves import queue
+
+from .cli_functions import get_aws_credentials, get_cached_aws_credentials
+from .compat import OrderedDict
+from .log import CMDLineExit
+
+# Matches the default connection pool size of requests
+DEFAULT_WORKERS = 10
+
+FetchResult = namedtuple('FetchResult',
+                         ['account', 'role', 'aws_credentials', 'error'])
+
+
+def parse_pair(text):
+    """Parse 'account/role' or 'account role' into (account, role)"""
+    fields = text.split()
+    if len(fields) == 1:
+        fields = fields[0].split('/', 1)
+    if len(fields) != 2 or not all(fields):
+        raise CMDLineExit(
+            "'{0}' is not a valid <account>/<role> pair.".format(text))
+    return tuple(fields)
+
+
+def read_pairs(lines, on_error=None):
+    """
+    Yield (account, role) for all lines, skipping blanks and comments.
+
+    Invalid lines raise a CMDLineExit, unless `on_error` is given: then
+    on_error(exception) is called and the line is skipped. Lines that
+    can not be read raise a CMDLineExit in any case.
+    """
+    lines = iter(lines)
+    while True:
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        except (IOError, OSError, UnicodeError) as exc:
+            raise CMDLineExit("Failed to read pairs: {0}".format(exc))
+        line = line.strip()
+        if line and not line.startswith('#'):
+            try:
+                yield parse_pair(line)
+            except CMDLineExit as exc:
+                if on_error is None:
+                    raise
+                on_error(exc)
+
+
+class _Failure(object):
+    """Carries an exception of the items from a worker to the consumer"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def imap_unordered(function, items, workers=DEFAULT_WORKERS):
+    """
+    Yield function(item) for all items in order of completion.
+
+    At most `workers` items are processed concurrently and items are
+    consumed only as fast as results are taken, so `items` may be an
+    arbitrarily long iterator.
+    `function` is expected to handle its own errors. If `items` raises,
+    the items taken so far are finished and the error is raised then.
+    """
+    items = iter(items)
+    items_lock = threading.Lock()
+    results = queue.Queue(maxsize=workers)
+    done = object()
+    failed = []
+
+    def worker():
+        try:
+            while True:
+                with items_lock:
+                    if failed:
+                        return
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    except Exception as exc:
+                        failed.append(exc)
+                        results.put(_Failure(exc))
+                        return
+                results.put(function(item))
+        finally:
+            results.put(done)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    running = len(threads)
+    failure = None
+    while running:
+        result = results.get()
+        if result is done:
+            running -= 1
+        elif isinstance(result, _Failure):
+            failure = result
+        else:
+            yield result
+    if failure is not None:
+        raise failure.exception
+
+
+def fetch_credentials(federation_client, account, role):
+    """Return a FetchResult instead of raising on errors"""
+    try:
+        aws_credentials = get_aws_credentials(federation_client, account, role)
+    except Exception as exc:
+        return FetchResult(account, role, None, str(exc))
+    return FetchResult(account, role, aws_credentials, None)
+
+
+def fetch_all(get_federation_client, pairs, workers=DEFAULT_WORKERS,
+              credentials_cache=None, api_url=None, username=None):
+    """
+    Fetch credentials for all (account, role) pairs concurrently.
+
+    Cached credentials are used directly, get_federation_client() is
+    only called if at least one pair has to be fetched from the server.
+    Return a list of FetchResults in the order of `pairs`, without
+    duplicates.
+    """
+    pairs = list(OrderedDict.fromkeys(pairs))
+    results = {}
+    missing = []
+    for account, role in pairs:
+        aws_credentials = get_cached_aws_credentials(
+            credentials_cache, api_url, username, account, role)
+        if aws_credentials is None:
+            missing.append((account, role))
+        else:
+            results[account, role] = FetchResult(
+                account, role, aws_credentials, None)
+
+    if missing:
+        federation_client = get_federation_client()
+        resize_connection_pool = getattr(
+            federation_client, 'resize_connection_pool', None)
+        if resize_connection_pool is not None:
+            resize_connection_pool(workers)
+        for result in imap_unordered(
+                lambda pair: fetch_credentials(federation_client, *pair),
+                missing, min(workers, len(missing))):
+            results[result.account, result.role] = result
+
+    return [results[pair] for pair in pairs]
+
+
+def stream_credentials(get_federation_client, pairs, workers=DEFAULT_WORKERS,
+                       credentials_cache=None, api_url=None, username=None):
+    """
+    Yield a FetchResult for every (account, role) of `pairs`, in order of
+    completion.
+
+    Unlike fetch_all(), this neither keeps nor sorts the results: pairs
+    are taken from the iterable `pairs` only as fast as results are
+    taken, with at most `workers` fetches in flight, so arbitrarily many
+    pairs can be streamed with flat memory use. get_federation_client()
+    is called once, when the first pair is not cached.
+    """
+    client_lock = threading.Lock()
+    clients = []
+
+    def get_client():
+        with client_lock:
+            if not clients:
+                try:
+                    federation_client = get_federation_client()
+                    resize_connection_pool = getattr(
+                        federation_client, 'resize_connection_pool', None)
+                    if resize_connection_pool is not None:
+                        resize_connection_pool(workers)
+                    clients.append((federation_client, None))
+                except Exception as exc:
+                    # Ask for the password only once, even if it failed
+                    clients.append((None, exc))
+            federation_client, exc = clients[0]
+        if exc is not None:
+            raise exc
+        return federation_client
+
+    def fetch(pair):
+        account, role = pair
+        aws_credentials = get_cached_aws_credentials(
+            credentials_cache, api_url, username, account, role)
+        if aws_credentials is not None:
+            return FetchResult(account, role, aws_credentials, None)
+        try:
+            federation_client = get_client()
+        except Exception as exc:
+            return FetchResult(account, role, None, str(exc))
+        return fetch_credentials(federation_client, account, role)
+
+    return imap_unordered(fetch, pairs, workers)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .fileutils import try_file_lock, write_atomic
+from .log import debug
+from .timing import timed
+
+# Seconds before their expiration at which cached credentials are refetched
+DEFAULT_MARGIN = 300
+EXPIRATION_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Seconds after which the default roles of all accounts are refreshed
+DEFAULT_ROLE_TTL = 24 * 60 * 60
+# Seconds for which the account list is used without asking the server
+DEFAULT_ACCOUNT_LIST_TTL = 5 * 60
+# Seconds to wait for the server before using a stale account list
+REVALIDATION_TIMEOUT = 5
+# Seconds to wait for another process fetching the same credentials
+LOCK_TIMEOUT = 30
+# Seconds for which the hosts behind a server name are not looked up again
+DEFAULT_HOST_TTL = 60 * 60
+
+
+def get_cache_dir():
+    return os.path.join(os.path.expanduser("~/.afp-cli"), 'cache')
+
+
+def get_completion_index_filename(api_url, username, cache_dir=None):
+    return os.path.join(
+        cache_dir or get_cache_dir(),
+        'completion-index-' + get_key_digest(api_url, username))
+
+
+def get_search_index_filename(api_url, username, cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(),
+                        'search-index-' + get_key_digest(api_url, username))
+
+
+def write_completion_index(accounts_and_roles, api_url, username,
+                           cache_dir=None):
+    """
+    Write the accounts and roles of username on api_url in the form
+    used by shell completion.
+
+    Accounts are sorted so that all accounts with a given prefix can be
+    found with a binary search.
+    """
+    index = {'accounts': sorted(accounts_and_roles),
+             'roles': dict((account, sorted(roles))
+                           for account, roles in accounts_and_roles.items())}
+    write_atomic(get_completion_index_filename(api_url, username, cache_dir),
+                 json.dumps(index))
+
+
+def expires_within(aws_credentials, seconds, utcnow=None):
+    """Return whether the credentials expire within the next seconds"""
+    valid_until = datetime.strptime(
+        aws_credentials['AWS_EXPIRATION_DATE'], EXPIRATION_FORMAT)
+    utcnow = utcnow or datetime.utcnow()
+    return valid_until - timedelta(seconds=seconds) <= utcnow
+
+
+def get_key_digest(*key):
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+class CredentialsCache(object):
+    """
+    Keep AWS credentials on disk until shortly before they expire.
+
+    Entries are keyed by (api_url, username, account, role) and are
+    considered stale `margin` seconds before their AWS_EXPIRATION_DATE.
+    """
+
+    def __init__(self, cache_dir=None, margin=DEFAULT_MARGIN,
+                 lock_timeout=LOCK_TIMEOUT):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.margin = margin
+        self.lock_timeout = lock_timeout
+
+    def get_filename(self, api_url, username, account, role):
+        return os.path.join(
+            self.cache_dir,
+            'credentials-' + get_key_digest(api_url, username, account, role))
+
+    def get_lock_filename(self, api_url, username, account, role):
+        # Lock files are never removed, since a process may be waiting
+        # for the lock. Entries share them by the first byte of their
+        # digest, so that there are at most 256 of them.
+        return os.path.join(
+            self.cache_dir, 'credentials-{0}.lock'.format(
+                get_key_digest(api_url, username, account, role)[:2]))
+
+    @timed('credentials-cache')
+    def get(self, api_url, username, account, role, utcnow=None):
+        """Return the cached credentials or None if missing or stale"""
+        filename = self.get_filename(api_url, username, account, role)
+        try:
+            with open(filename) as cache_file:
+                aws_credentials = json.load(cache_file)
+            expired = expires_within(aws_credentials, self.margin, utcnow)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if expired:
+            debug("Cached credentials for {0}/{1} are about to expire".format(
+                account, role))
+            return None
+        debug("Using cached credentials for {0}/{1}".format(account, role))
+        return aws_credentials
+
+    @timed('credentials-cache')
+    def put(self, api_url, username, account, role, aws_credentials):
+        filename = self.get_filename(api_url, username, account, role)
+        try:
+            write_atomic(filename, json.dumps(aws_credentials))
+        except (IOError, OSError) as exc:
+            debug("Failed to cache credentials in '{0}': {1}".format(
+                filename, exc))
+
+    def get_or_fetch(self, api_url, username, account, role, fetch):
+        """
+        Return the cached credentials or fetch() and cache new ones.
+
+        Processes that want the same credentials at the same time take
+        turns on a lock file, so only the first one calls fetch() and
+        the others find its result in the cache. If the lock can not be
+        taken within `lock_timeout` seconds, or not at all, fetch() is
+        called anyway.
+        """
+        aws_credentials = self.get(api_url, username, account, role)
+        if aws_credentials is not None:
+            return aws_credentials
+        with try_file_lock(self.get_lock_filename(
+                api_url, username, account, role),
+                timeout=self.lock_timeout) as lock_error:
+            if lock_error is None:
+                aws_credentials = self.get(api_url, username, account, role)
+            else:
+                debug("Fetching credentials for {0}/{1} without lock: "
+                      "{2}".format(account, role, lock_error))
+            if aws_credentials is None:
+                aws_credentials = fetch()
+                self.put(api_url, username, account, role, aws_credentials)
+            return aws_credentials
+
+
+class DefaultRoleIndex(object):
+    """
+    Remember the default (i.e. first) role of every account.
+
+    This saves downloading the whole account list just to pick a role.
+    Entries older than `ttl` seconds are still returned, but flagged as
+    stale so that the caller can refresh them in the background.
+    """
+
+    def __init__(self, api_url, username, cache_dir=None,
+                 ttl=DEFAULT_ROLE_TTL):
+        self.filename = os.path.join(
+            cache_dir or get_cache_dir(),
+            'default-roles-' + get_key_digest(api_url, username))
+        self.ttl = ttl
+        self.refresh_thread = None
+
+    def get(self, account, now=None):
+        """Return (role, is_fresh), role is None for unknown accounts"""
+        try:
+            with open(self.filename) as index_file:
+                index = json.load(index_file)
+            role = index['roles'].get(account)
+            updated = float(index['updated'])
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            return None, False
+        now = now or time.time()
+        return role, now - updated < self.ttl
+
+    def update(self, accounts_and_roles, now=None):
+        roles = dict((account, min(roles))
+                     for account, roles in accounts_and_roles.items()
+                     if roles)
+        index = {'updated': now or time.time(), 'roles': roles}
+        try:
+            write_atomic(self.filename, json.dumps(index))
+        except (IOError, OSError) as exc:
+            debug("Failed to write default roles to '{0}': {1}".format(
+                self.filename, exc))
+
+    def refresh(self, federation_client):
+        try:
+            self.update(federation_client.get_account_and_role_list())
+        except Exception as exc:
+            debug("Failed to refresh default roles: {0}".format(exc))
+
+    def refresh_in_background(self, federation_client):
+        """
+        Refresh the index while the caller goes on with its work.
+
+        The thread is not a daemon thread, so the interpreter waits for
+        the refresh to finish before it exits.
+        """
+        if self.refresh_thread is None:
+            self.refresh_thread = threading.Thread(
+                target=self.refresh, args=(federation_client,))
+            self.refresh_thread.start()
+
+
+class AccountListCache(object):
+    """
+    Keep the account list on disk, together with the ETag and
+    Last-Modified headers needed to revalidate it.
+
+    The list is used as is for `ttl` seconds. After that, the server is
+    asked with a conditional request and the stale copy is used if the
+    server does not answer within `timeout` seconds.
+    """
+
+    def __init__(self, api_url, username, cache_dir=None,
+                 ttl=DEFAULT_ACCOUNT_LIST_TTL, timeout=REVALIDATION_TIMEOUT):
+        self.api_url = api_url
+        self.username = username
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.filename = os.path.join(
+            self.cache_dir, 'accounts-' + get_key_digest(api_url, username))
+        self.ttl = ttl
+        self.timeout = timeout
+
+    def get(self, now=None):
+        """Return (entry, is_fresh), entry is None if nothing is cached"""
+        try:
+            with open(self.filename) as cache_file:
+                entry = json.load(cache_file)
+            updated = float(entry['updated'])
+            entry['body']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None, False
+        now = now or time.time()
+        return entry, now - updated < self.ttl
+
+    def put(self, body, etag=None, last_modified=None, now=None):
+        entry = {'updated': now or time.time(),
+                 'body': body,
+                 'etag': etag,
+                 'last_modified': last_modified}
+        try:
+            write_atomic(self.filename, json.dumps(entry))
+            write_completion_index(json.loads(body), self.api_url,
+                                   self.username, self.cache_dir)
+        except (IOError, OSError, ValueError, AttributeError) as exc:
+            debug("Failed to cache account list in '{0}': {1}".format(
+                self.filename, exc))
+
+
+class HostCache(object):
+    """
+    Remember the FQDNs of the hosts behind a server name.
+
+    Resolving a name and looking up the FQDN of every IP can take longer
+    than the rest of an afp invocation. Entries are used for `ttl`
+    seconds.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_HOST_TTL):
+        self.filename = os.path.join(cache_dir or get_cache_dir(), 'hosts')
+        self.ttl = ttl
+
+    def load(self):
+        try:
+            with open(self.filename) as cache_file:
+                hosts = json.load(cache_file)
+            if not isinstance(hosts, dict):
+                raise ValueError()
+            return hosts
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, server_name, now=None):
+        """Return the cached FQDNs or None if missing or stale"""
+        try:
+            entry = self.load()[server_name]
+            fqdns = [str(fqdn) for fqdn in entry['fqdns']]
+            updated = float(entry['updated'])
+        except (KeyError, ValueError, TypeError):
+            return None
+        now = now or time.time()
+        if not fqdns or now - updated >= self.ttl:
+            return None
+        debug("Using cached hosts of {0}: {1}".format(
+            server_name, ', '.join(fqdns)))
+        return fqdns
+
+    def get_last(self, server_name):
+        """Return the FQDNs looked up last, however old, or None"""
+        try:
+            fqdns = [str(fqdn) for fqdn in self.load()[server_name]['fqdns']]
+        except (KeyError, TypeError):
+            return None
+        return fqdns or None
+
+    def put(self, server_name, fqdns, now=None):
+        self.update(server_name, {'updated': now or time.time(),
+                                  'fqdns': fqdns})
+
+    def invalidate(self, server_name):
+        self.update(server_name, None)
+
+    def update(self, server_name, entry):
+        hosts = self.load()
+        if entry is None:
+            if hosts.pop(server_name, None) is None:
+                return
+        else:
+            hosts[server_name] = entry
+        try:
+            write_atomic(self.filename, json.dumps(hosts))
+        except (IOError, OSError) as exc:
+            debug("Failed to cache hosts in '{0}': {1}".format(
+                self.filename, exc))
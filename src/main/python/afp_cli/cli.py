@@ -33,16 +33,19 @@ from . import __version__, log
 from .aws_credentials_file import write
 from .cli_functions import (get_api_url,
                             get_aws_credentials,
+                            get_circuit_breakers,
+                            get_connection_settings,
+                            get_credentials_cache,
+                            get_default_role_index,
                             get_first_role,
+                            get_retry_policy,
                             sanitize_credentials)
-from .client import AWSFederationClientCmd
 from .config import load_config
 from .exporters import (enter_subx,
                         format_account_and_role_list,
                         format_aws_credentials,
                         print_export)
 from .log import CMDLineExit, debug, error, info
-from .password_providers import get_password
 
 
 def main():
@@ -57,6 +60,10 @@ def unprotected_main():
     """Main function for script execution"""
     arguments = docopt(
         __doc__, version='afp-cli version {0}'.format(__version__))
+    # Imported only now, so that e.g. '--version' does not load requests
+    from .client import AWSFederationClientCmd
+    from .password_providers import get_password
+
     if arguments['--debug']:
         log.DEBUG = True
     debug(arguments)
@@ -78,11 +85,16 @@ def unprotected_main():
     sanitize_credentials(username, password)
 
     federation_client = AWSFederationClientCmd(
-        api_url=api_url, username=username, password=password)
+        api_url=api_url, username=username, password=password,
+        credentials_cache=get_credentials_cache(arguments, config),
+        retry_policy=get_retry_policy(arguments, config),
+        circuit_breakers=get_circuit_breakers(arguments, config),
+        **get_connection_settings(arguments, config))
     if arguments['<accountname>']:
         account = arguments['<accountname>']
         role = arguments['<rolename>'] or get_first_role(
-            federation_client, account)
+            federation_client, account,
+            get_default_role_index(arguments, config, api_url, username))
         aws_credentials = get_aws_credentials(federation_client, account, role)
 
         if arguments['--show']:
@@ -1,12 +1,34 @@
 from __future__ import (
     absolute_import, division, print_function, unicode_literals)
 
+import re
 import socket
 import sys
 from datetime import datetime
+from fnmatch import translate
 
-from .client import APICallError
-from .log import CMDLineExit
+from six import string_types
+
+from .cache import (DEFAULT_ACCOUNT_LIST_TTL,
+                    DEFAULT_HOST_TTL,
+                    DEFAULT_MARGIN,
+                    DEFAULT_ROLE_TTL,
+                    AccountListCache,
+                    CredentialsCache,
+                    DefaultRoleIndex,
+                    HostCache)
+from .exceptions import APICallError
+from .compat import OrderedDict
+from .log import CMDLineExit, debug
+from .retry import (DEFAULT_BACKOFF,
+                    DEFAULT_CIRCUIT_BREAKER_COOLDOWN,
+                    DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+                    DEFAULT_MAX_BACKOFF,
+                    DEFAULT_RETRIES,
+                    CircuitBreakers,
+                    RetryPolicy)
+from .servers import ServerRanking, get_ranking_filename
+from .timing import timed
 
 
 def get_valid_seconds(aws_expiration_date, utcnow):
@@ -24,6 +46,52 @@ def get_valid_seconds(aws_expiration_date, utcnow):
         return default_seconds
 
 
+@timed('dns')
+def sanitize_hosts(server_name, host_cache=None):
+    """
+    Return the FQDNs of all hosts behind the server name passed.
+
+    This is done by resolving the given server name into (potentially
+    multiple) IPs, then a reverse-lookup is performed on every IP to get
+    its FQDN. The FQDNs are returned in the order of the IPs, the first
+    one is the host that sanitize_host() returns.
+
+    IPs that do not resolve to a hostname are left out, unless no IP
+    does. With a `host_cache`, the lookups are skipped while the cache
+    knows the hosts.
+    """
+    if host_cache is not None:
+        fqdns = host_cache.get(server_name)
+        if fqdns:
+            return fqdns
+    try:
+        addrinfo_tuple = socket.getaddrinfo(
+            server_name, 443, socket.AF_INET, socket.SOCK_STREAM)
+    except Exception as exc:
+        raise CMDLineExit("Could not resolve hostname %r: %s" % (
+            server_name, exc))
+    fqdns, first_error = [], None
+    for afp_server_ip in OrderedDict.fromkeys(
+            addrinfo[4][0] for addrinfo in addrinfo_tuple):
+        try:
+            fqdn = socket.gethostbyaddr(afp_server_ip)[0]
+        except Exception as exc:
+            debug("DNS reverse lookup failed for IP %s: %s" % (
+                afp_server_ip, exc))
+            first_error = first_error or CMDLineExit(
+                "DNS reverse lookup failed for IP %s: %s" % (
+                    afp_server_ip, exc))
+            continue
+        if fqdn not in fqdns:
+            fqdns.append(fqdn)
+    if not fqdns:
+        raise first_error
+    if host_cache is not None:
+        host_cache.put(server_name, fqdns)
+    return fqdns
+
+
+@timed('dns')
 def sanitize_host(server_name):
     """
     Return the FQDN of the host passed.
@@ -56,28 +124,308 @@ def sanitize_host(server_name):
             afp_server_ip, exc))
 
 
+def _split_names(value):
+    """Return a list of names given as list or comma separated string"""
+    if value is None:
+        return []
+    if isinstance(value, string_types):
+        value = value.split(',')
+    return [name.strip() for name in value if name and name.strip()]
+
+
 def get_api_url(arguments=None, config=None):
     """
     Return a calculated/sanitized API URL from config and/or command
     line parameters.
+
+    If several servers are given, return the URL of the first one.
     """
     arguments = arguments or {}
     config = config or {}
-    passed_api_url = arguments.get('--api-url') or config.get('api_url')
-    if passed_api_url is not None:
+    passed_api_urls = _split_names(
+        arguments.get('--api-url') or config.get('api_url'))
+    if passed_api_urls:
         # No checks whatsoever, just return the preferred API URL
-        return passed_api_url
-    server_name = arguments.get('--server') or config.get('server')
-    if server_name:
-        return 'https://{fqdn}/afp-api/latest'.format(fqdn=server_name)
+        return passed_api_urls[0]
+    server_names = _split_names(
+        arguments.get('--server') or config.get('server'))
+    if server_names:
+        return 'https://{fqdn}/afp-api/latest'.format(fqdn=server_names[0])
 
     sanitized_server_name = sanitize_host("afp")
     return 'https://{fqdn}/afp-api/latest'.format(fqdn=sanitized_server_name)
 
 
-def get_first_role(federation_client, account):
+def get_api_urls(arguments=None, config=None, host_cache=None, fresh=False):
+    """
+    Return the API URLs of all servers given by config and/or command
+    line parameters, or of all hosts behind 'afp'. The first URL is the
+    one get_api_url() returns.
+
+    The hosts behind 'afp' are taken from `host_cache` unless `fresh`
+    lookups are asked for.
+    """
+    arguments = arguments or {}
+    config = config or {}
+    passed_api_urls = _split_names(
+        arguments.get('--api-url') or config.get('api_url'))
+    if passed_api_urls:
+        return passed_api_urls
+    server_names = _split_names(
+        arguments.get('--server') or config.get('server'))
+    if not server_names:
+        if fresh and host_cache is not None:
+            host_cache.invalidate("afp")
+        server_names = sanitize_hosts("afp", host_cache)
+    return ['https://{fqdn}/afp-api/latest'.format(fqdn=server_name)
+            for server_name in server_names]
+
+
+def get_last_api_url(arguments=None, config=None):
+    """
+    Return the API URL get_api_urls() returned first, without any DNS
+    lookups: the hosts behind 'afp' are taken from the host cache,
+    however old. Return None if they were never looked up.
+    """
+    arguments = arguments or {}
+    config = config or {}
+    passed_api_urls = _split_names(
+        arguments.get('--api-url') or config.get('api_url'))
+    if passed_api_urls:
+        return passed_api_urls[0]
+    server_names = _split_names(
+        arguments.get('--server') or config.get('server'))
+    if not server_names and caching_enabled(arguments, config):
+        server_names = HostCache().get_last("afp") or []
+    if not server_names:
+        return None
+    return 'https://{fqdn}/afp-api/latest'.format(fqdn=server_names[0])
+
+
+def caching_enabled(arguments=None, config=None):
+    arguments = arguments or {}
+    config = config or {}
+    return not arguments.get('--no-cache') and \
+        config.get('credentials-cache', True)
+
+
+def get_host_cache(arguments=None, config=None):
+    """
+    Return the cache for DNS lookups configured by config and/or command
+    line parameters, or None if caching is disabled.
+    """
+    config = config or {}
+    if not caching_enabled(arguments, config):
+        return None
+    ttl = config.get('dns-ttl', DEFAULT_HOST_TTL)
+    try:
+        return HostCache(ttl=int(ttl))
+    except ValueError:
+        raise CMDLineExit("'{0}' is not a valid dns ttl.".format(ttl))
+
+
+def get_credentials_cache(arguments=None, config=None):
+    """
+    Return the credentials cache configured by config and/or command
+    line parameters, or None if caching is disabled.
+    """
+    config = config or {}
+    if not caching_enabled(arguments, config):
+        return None
+    margin = config.get('cache-margin', DEFAULT_MARGIN)
+    try:
+        return CredentialsCache(margin=int(margin))
+    except ValueError:
+        raise CMDLineExit("'{0}' is not a valid cache margin.".format(margin))
+
+
+def get_default_role_index(arguments=None, config=None, api_url=None,
+                           username=None):
+    """
+    Return the index of default roles configured by config and/or
+    command line parameters, or None if caching is disabled.
+    """
+    config = config or {}
+    if not caching_enabled(arguments, config):
+        return None
+    ttl = config.get('default-role-ttl', DEFAULT_ROLE_TTL)
+    try:
+        return DefaultRoleIndex(api_url, username, ttl=int(ttl))
+    except ValueError:
+        raise CMDLineExit("'{0}' is not a valid default role ttl.".format(ttl))
+
+
+def get_account_list_cache(arguments=None, config=None, api_url=None,
+                           username=None):
+    """
+    Return the account list cache configured by config and/or command
+    line parameters, or None if caching is disabled.
+    """
+    config = config or {}
+    if not caching_enabled(arguments, config):
+        return None
+    ttl = config.get('account-list-ttl', DEFAULT_ACCOUNT_LIST_TTL)
+    try:
+        return AccountListCache(api_url, username, ttl=int(ttl))
+    except ValueError:
+        raise CMDLineExit("'{0}' is not a valid account list ttl.".format(ttl))
+
+
+def _parse_number(value, key, type_, allow_zero=False):
+    try:
+        number = type_(value)
+        if number < 0 or (number == 0 and not allow_zero):
+            raise ValueError()
+    except (ValueError, TypeError):
+        raise CMDLineExit("'{0}' is not a valid {1}.".format(
+            value, key.replace('-', ' ')))
+    return number
+
+
+def get_connection_settings(arguments=None, config=None):
+    """
+    Return the timeouts, pool size, keep-alive, TLS and hedging settings
+    configured by config and/or command line parameters, as keyword
+    arguments for AWSFederationClientCmd. Settings which are not
+    configured are left out, so that the client uses its defaults.
+    """
+    arguments = arguments or {}
+    config = config or {}
+    settings = {}
+    for key, type_ in [('connect-timeout', float),
+                       ('read-timeout', float),
+                       ('pool-size', int),
+                       ('hedge-after', float)]:
+        value = arguments.get('--' + key) or config.get(key)
+        if value is not None:
+            settings[key.replace('-', '_')] = _parse_number(value, key, type_)
+    if arguments.get('--no-keep-alive'):
+        settings['keep_alive'] = False
+    elif 'keep-alive' in config:
+        settings['keep_alive'] = bool(config['keep-alive'])
+    if 'tls-resumption' in config:
+        settings['tls_resumption'] = bool(config['tls-resumption'])
+    return settings
+
+
+def get_retry_policy(arguments=None, config=None):
+    """
+    Return the policy for retrying failed requests configured by config
+    and/or command line parameters.
+    """
+    config = config or {}
+    return RetryPolicy(
+        retries=_parse_number(config.get('retries', DEFAULT_RETRIES),
+                              'retries', int, allow_zero=True),
+        backoff=_parse_number(config.get('retry-backoff', DEFAULT_BACKOFF),
+                              'retry-backoff', float, allow_zero=True),
+        max_backoff=_parse_number(
+            config.get('retry-max-backoff', DEFAULT_MAX_BACKOFF),
+            'retry-max-backoff', float, allow_zero=True))
+
+
+def get_circuit_breakers(arguments=None, config=None):
+    """
+    Return the per-server circuit breakers configured by config and/or
+    command line parameters, or None if they are disabled.
+    """
+    config = config or {}
+    threshold = _parse_number(
+        config.get('circuit-breaker-threshold',
+                   DEFAULT_CIRCUIT_BREAKER_THRESHOLD),
+        'circuit-breaker-threshold', int, allow_zero=True)
+    cooldown = _parse_number(
+        config.get('circuit-breaker-cooldown',
+                   DEFAULT_CIRCUIT_BREAKER_COOLDOWN),
+        'circuit-breaker-cooldown', float)
+    if not threshold:
+        return None
+    return CircuitBreakers(threshold=threshold, cooldown=cooldown)
+
+
+def get_server_ranking(arguments=None, config=None, api_urls=None):
+    """
+    Return the ranking for the servers to use, or None if there is only
+    one server.
+    """
+    if not api_urls or len(api_urls) < 2:
+        return None
+    return ServerRanking(get_ranking_filename(api_urls[0]))
+
+
+def get_bench_settings(arguments=None):
+    """
+    Return the load 'afp bench' is to generate, as keyword arguments for
+    run_load(). Limits which are not given are left out.
+    """
+    arguments = arguments or {}
+    settings = {'workers': _parse_number(
+        arguments.get('--workers'), 'number-of-workers', int)}
+    for key, name, type_ in [('requests', 'number-of-requests', int),
+                             ('duration', 'duration', float),
+                             ('rate', 'request-rate', float)]:
+        if arguments.get('--' + key) is not None:
+            settings[key] = _parse_number(arguments['--' + key], name, type_)
+    return settings
+
+
+def get_find_limit(arguments=None):
+    """Return how many matches 'afp find' is to show"""
+    return _parse_number((arguments or {}).get('--limit'),
+                         'number-of-matches', int)
+
+
+def get_name_filter(pattern, key='filter'):
+    """
+    Return a function telling whether a name matches `pattern`, a glob
+    pattern like 'prod-*' or a regular expression between slashes like
+    '/^prod-(eu|us)/'. Return None without a pattern.
+    """
+    if not pattern:
+        return None
+    if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+        try:
+            return re.compile(pattern[1:-1]).search
+        except re.error as exc:
+            raise CMDLineExit("'{0}' is not a valid {1}: {2}".format(
+                pattern, key, exc))
+    # Like fnmatch.fnmatchcase(), without looking up the pattern every time
+    return re.compile(translate(pattern)).match
+
+
+def filter_account_and_role_list(accounts_and_roles, account_filter=None,
+                                 role_filter=None):
+    """
+    Return the accounts matching account_filter with their roles matching
+    role_filter, filters being None to match everything. Accounts without
+    any matching role are left out.
+    """
+    if account_filter is None and role_filter is None:
+        return accounts_and_roles
+    filtered = {}
+    for account, roles in accounts_and_roles.items():
+        if account_filter is not None and not account_filter(account):
+            continue
+        if role_filter is not None:
+            roles = [role for role in roles if role_filter(role)]
+            if not roles:
+                continue
+        filtered[account] = roles
+    return filtered
+
+
+def get_first_role(federation_client, account, role_index=None):
+    if role_index is not None:
+        role, is_fresh = role_index.get(account)
+        if role is not None:
+            debug("Default role of {0} is {1}".format(account, role))
+            if not is_fresh:
+                role_index.refresh_in_background(federation_client)
+            return role
     try:
         accounts_and_roles = federation_client.get_account_and_role_list()
+        if role_index is not None:
+            role_index.update(accounts_and_roles)
         return sorted(accounts_and_roles[account])[0]
     except APICallError as exc:
         raise CMDLineExit("Failed to get account list from AWS: %s" % exc)
@@ -87,17 +435,37 @@ def get_first_role(federation_client, account):
         raise CMDLineExit("Could not find any role for account %s" % account)
 
 
+def add_credentials_details(aws_credentials, account, role):
+    aws_credentials['AWS_VALID_SECONDS'] = get_valid_seconds(
+        aws_credentials['AWS_EXPIRATION_DATE'], datetime.utcnow())
+    aws_credentials['AWS_ACCOUNT_NAME'] = account
+    aws_credentials['AWS_ASSUMED_ROLE'] = role
+    return aws_credentials
+
+
 def get_aws_credentials(federation_client, account, role):
     try:
         aws_credentials = federation_client.get_aws_credentials(account, role)
     except APICallError as exc:
         raise CMDLineExit("Failed to get credentials from AWS: %s" % repr(exc))
     else:
-        aws_credentials['AWS_VALID_SECONDS'] = get_valid_seconds(
-            aws_credentials['AWS_EXPIRATION_DATE'], datetime.utcnow())
-        aws_credentials['AWS_ACCOUNT_NAME'] = account
-        aws_credentials['AWS_ASSUMED_ROLE'] = role
-        return aws_credentials
+        return add_credentials_details(aws_credentials, account, role)
+
+
+def get_cached_aws_credentials(credentials_cache, api_url, username,
+                               account, role):
+    """
+    Return still valid credentials from the cache or None.
+
+    This does not need a password or a federation client, so callers
+    can skip both when the credentials are already cached.
+    """
+    if credentials_cache is None:
+        return None
+    aws_credentials = credentials_cache.get(api_url, username, account, role)
+    if aws_credentials is None:
+        return None
+    return add_credentials_details(aws_credentials, account, role)
 
 
 def sanitize_credentials(username, password):
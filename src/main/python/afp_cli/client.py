@@ -2,80 +2,297 @@
 from __future__ import absolute_import, division, print_function
 
 import json
-import pickle
-import os
+import threading
+import time
+from functools import partial
 
 import requests
 from requests.auth import HTTPBasicAuth
 from six.moves.urllib.parse import quote
-from six import PY3
 
+from . import log
+from .cookies import CookieStore, get_default_filename
+from .exceptions import APICallError, CircuitOpenError
+from .log import debug
+from .retry import RETRYABLE_STATUS_CODES, RetryPolicy
+from .servers import race
+from .timing import phase
+from .transport import (DEFAULT_CONNECT_TIMEOUT,
+                        DEFAULT_POOL_SIZE,
+                        DEFAULT_READ_TIMEOUT,
+                        RequestTimer,
+                        configure_session,
+                        create_resuming_ssl_context)
 
-class APICallError(Exception):
-    def __str__(self, *args, **kwargs):
-        if PY3:
-            return super(APICallError, self).__str__(*args, **kwargs)
-        return self.message
+__all__ = ['APICallError', 'AWSFederationClientCmd']
+
+USER_AGENT = 'afp-cli/1.0.6'
+
+
+def get_api_call_error(url, status_code, reason, text):
+    """Return the APICallError for a failed request to url"""
+    if status_code == 401:
+        # Need to treat 401 specially since it is directly send
+        # from webserver and body has different format.
+        return APICallError("API call to AWS url (%s) failed: %s %s" % (
+            url, status_code, reason), status_code=status_code)
+    try:
+        message = json.loads(text)['message']
+    except (ValueError, KeyError, TypeError):
+        message = text
+    return APICallError("API call to AWS (%s) failed: %s" % (url, message),
+                        status_code=status_code)
+
+
+def is_retryable(exc):
+    """Return whether a request failing with exc may succeed next time"""
+    if isinstance(exc, APICallError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout,
+                            requests.exceptions.ChunkedEncodingError))
+
+
+def can_fail_over(exc):
+    """Return whether another server may succeed where one failed"""
+    return is_retryable(exc) or isinstance(exc, CircuitOpenError)
+
+
+def parse_aws_credentials(text):
+    """Turn the credentials returned by the AFP server into our format"""
+    aws_credentials = json.loads(text)
+    return {
+        'AWS_ACCESS_KEY_ID': aws_credentials['AccessKeyId'],
+        'AWS_SECRET_ACCESS_KEY': aws_credentials['SecretAccessKey'],
+        'AWS_SESSION_TOKEN': aws_credentials['Token'],
+        'AWS_SECURITY_TOKEN': aws_credentials['Token'],
+        'AWS_EXPIRATION_DATE': aws_credentials['Expiration']}
 
 
 class AWSFederationClientCmd(object):
-    """Class for a command line client which uses the afp api"""
+    """Class for a command line client which uses the afp api
+
+    Requests give up after `connect_timeout` seconds without a connection
+    or `read_timeout` seconds without an answer. Up to `pool_size`
+    connections are kept open and reused between requests, unless
+    `keep_alive` is False. New connections resume the TLS session of
+    earlier ones, unless `tls_resumption` is False.
+
+    Failed requests are repeated according to `retry_policy`.
+    `circuit_breakers` hands out a circuit breaker for every server,
+    which is told about timeouts and overload and stops requests to
+    that server while it is open.
+
+    If `api_urls` lists several servers, `api_url` is only used to name
+    the caches. Requests go to the servers in the order of
+    `server_ranking`, failing over to the next one on errors. With
+    `hedge_after`, a second server is asked as well if the first has
+    not answered within that many seconds. If no server can be
+    connected to, `resolve_api_urls()` is called once for servers to try
+    instead, e.g. after looking up hosts whose addresses were cached."""
 
     def __init__(self, *args, **kwargs):
         self.username = kwargs.get('username', '')
         self.password = kwargs.get('password', '')
 
         self.api_url = kwargs.get('api_url', None)
+        self.api_urls = kwargs.get('api_urls') or [self.api_url]
+        self.server_ranking = kwargs.get('server_ranking', None)
+        self.hedge_after = kwargs.get('hedge_after', None)
+        self.resolve_api_urls = kwargs.get('resolve_api_urls', None)
+        self.resolve_lock = threading.Lock()
         self.ssl_verify = kwargs.get('ssl_verify', True)
+        self.credentials_cache = kwargs.get('credentials_cache', None)
+        self.account_list_cache = kwargs.get('account_list_cache', None)
+
+        self.timeout = (
+            kwargs.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            kwargs.get('read_timeout', DEFAULT_READ_TIMEOUT))
+        self.pool_size = kwargs.get('pool_size', DEFAULT_POOL_SIZE)
+        self.keep_alive = kwargs.get('keep_alive', True)
+        self.ssl_context = None
+        if kwargs.get('tls_resumption', True):
+            self.ssl_context = create_resuming_ssl_context()
+        self.retry_policy = kwargs.get('retry_policy') or RetryPolicy()
+        self.circuit_breakers = kwargs.get('circuit_breakers', None)
 
         self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'afp-cli/1.0.6'})
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        configure_session(self.session, self.pool_size, self.keep_alive,
+                          self.ssl_context)
 
-        self.user_config_dir = os.path.expanduser("~/.afp-cli")
-        self.cookie_filepath = os.path.join(self.user_config_dir, 'cookies')
-        if os.path.exists(self.cookie_filepath):
-            cookies = pickle.load(open(self.cookie_filepath, 'rb'))
-            self.session.cookies = cookies
+        self.cookie_store = CookieStore(
+            kwargs.get('cookie_filename') or get_default_filename())
+        self.cookie_lock = threading.Lock()
+        self.session.cookies = self.cookie_store.load()
 
-    def call_api(self, url_suffix):
-        """Send a request to the aws federation proxy"""
-        url_orig = '{0}{1}'.format(self.api_url, url_suffix)
+    def request_api(self, url_suffix, headers=None, timeout=None,
+                    retries=None):
+        """Send a request to the aws federation proxy, return the response
+
+        A '304 Not Modified' response to a conditional request is
+        returned as well, all other non-200 responses raise an
+        APICallError. `timeout` overrides the timeout and `retries` the
+        retries of the client."""
+        api_result = self.retry_policy.call(
+            lambda: self.send_to_servers(url_suffix, headers, timeout),
+            is_retryable, "GET {0}{1}".format(self.api_url, url_suffix),
+            retries)
+
+        with self.cookie_lock:
+            self.cookie_store.save(self.session.cookies)
+        return api_result
+
+    def send_to_servers(self, url_suffix, headers=None, timeout=None):
+        """Send a request to the best server, failing over to the others"""
+        api_urls = self.api_urls
+        if self.server_ranking is not None:
+            api_urls = self.server_ranking.rank(api_urls)
+        tried_all = []
+        while True:
+            count = 2 if self.hedge_after is not None else 1
+            tried, api_urls = api_urls[:count], api_urls[count:]
+            tried_all.extend(tried)
+            try:
+                return race([partial(self.send_and_rank, api_url,
+                                     url_suffix, headers, timeout)
+                             for api_url in tried],
+                            self.hedge_after, can_fail_over)
+            except Exception as exc:
+                if not can_fail_over(exc):
+                    raise
+                if not api_urls and \
+                        isinstance(exc, requests.ConnectionError):
+                    api_urls = [api_url for api_url in self.reresolve()
+                                if api_url not in tried_all]
+                if not api_urls:
+                    raise
+                debug("Request to {0} failed: {1}, trying {2}".format(
+                    ' and '.join(tried), exc, api_urls[0]))
+
+    def reresolve(self):
+        """Return the servers of resolve_api_urls(), at most once"""
+        with self.resolve_lock:
+            resolve_api_urls = self.resolve_api_urls
+            self.resolve_api_urls = None
+        if resolve_api_urls is None:
+            return []
+        try:
+            self.api_urls = resolve_api_urls()
+        except Exception as exc:
+            debug("Failed to look up servers again: {0}".format(exc))
+            return []
+        return self.api_urls
+
+    def send_and_rank(self, api_url, url_suffix, headers=None, timeout=None):
+        """Send a request to api_url, keeping the server ranking posted"""
+        start = time.time()
+        try:
+            api_result = self.send_request(api_url, url_suffix, headers,
+                                           timeout)
+        except Exception as exc:
+            if self.server_ranking is not None and is_retryable(exc):
+                self.server_ranking.record_failure(api_url)
+            raise
+        if self.server_ranking is not None:
+            self.server_ranking.record(api_url, time.time() - start)
+        return api_result
+
+    def send_request(self, api_url, url_suffix, headers=None, timeout=None):
+        """Send a single request, keeping the server's breaker posted"""
+        circuit_breaker = None
+        if self.circuit_breakers is not None:
+            circuit_breaker = self.circuit_breakers.get(api_url)
+            circuit_breaker.check()
+        url_orig = '{0}{1}'.format(api_url, url_suffix)
         url = requests.utils.requote_uri(url_orig)
         # TODO: Automatic versioning instead of the static below
-        api_result = self.session.get(
-            url, verify=self.ssl_verify,
-            auth=HTTPBasicAuth(self.username, self.password))
-        if api_result.status_code != 200:
-            if api_result.status_code == 401:
-                # Need to treat 401 specially since it is directly send
-                # from webserver and body has different format.
-                raise APICallError("API call to AWS url (%s) failed: %s %s" % (
-                    url_orig, api_result.status_code, api_result.reason))
+        try:
+            with RequestTimer() as timer, phase('http'):
+                api_result = self.session.get(
+                    url, verify=self.ssl_verify, headers=headers,
+                    timeout=self.timeout if timeout is None else timeout,
+                    auth=HTTPBasicAuth(self.username, self.password))
+        except requests.Timeout:
+            # Refused or reset connections are retried as well, but do
+            # not count as failures: they cost the server nothing.
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure()
+            raise
+        if log.DEBUG:
+            debug("GET {0}: {1} in {2}".format(
+                url_orig, api_result.status_code,
+                timer.format(api_result.elapsed.total_seconds())))
+        if circuit_breaker is not None:
+            if api_result.status_code in RETRYABLE_STATUS_CODES:
+                circuit_breaker.record_failure()
             else:
-                try:
-                    raise APICallError("API call to AWS (%s) failed: %s" % (
-                        url_orig, api_result.json()['message']))
-                except ValueError:
-                    raise APICallError("API call to AWS (%s) failed: %s" % (
-                        url_orig, api_result.text))
-
-        if not os.path.exists(self.user_config_dir):
-            os.mkdir(self.user_config_dir)
-        pickle.dump(self.session.cookies, open(self.cookie_filepath, 'wb'))
-        return api_result.text
+                circuit_breaker.record_success()
+        if api_result.status_code not in (200, 304):
+            raise get_api_call_error(url_orig, api_result.status_code,
+                                     api_result.reason, api_result.text)
+        return api_result
+
+    def call_api(self, url_suffix):
+        """Send a request to the aws federation proxy"""
+        return self.request_api(url_suffix).text
+
+    def resize_connection_pool(self, maxsize):
+        """Keep up to maxsize connections open for concurrent requests"""
+        self.pool_size = max(self.pool_size, maxsize)
+        configure_session(self.session, self.pool_size, self.keep_alive,
+                          self.ssl_context)
 
     def get_account_and_role_list(self):
         """Create an aws federation proxy request and return the result"""
-        accounts_and_roles = self.call_api("/account")
-        return json.loads(accounts_and_roles)
+        if self.account_list_cache is None:
+            accounts_and_roles = self.call_api("/account")
+            return json.loads(accounts_and_roles)
+
+        cached, is_fresh = self.account_list_cache.get()
+        if is_fresh:
+            return json.loads(cached['body'])
+
+        headers, timeout, retries = {}, None, None
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+            # Rather use the stale copy than wait for a slow server
+            timeout, retries = self.account_list_cache.timeout, 0
+        try:
+            api_result = self.request_api("/account", headers=headers,
+                                          timeout=timeout, retries=retries)
+        except (APICallError, requests.RequestException) as exc:
+            status_code = getattr(exc, 'status_code', None)
+            server_failed = status_code is None or status_code >= 500
+            if cached is None or not server_failed:
+                raise
+            debug("Using stale account list: {0}".format(exc))
+            return json.loads(cached['body'])
+
+        etag = api_result.headers.get('ETag')
+        last_modified = api_result.headers.get('Last-Modified')
+        if api_result.status_code == 304:
+            debug("Cached account list is still valid")
+            body = cached['body']
+            etag = etag or cached.get('etag')
+            last_modified = last_modified or cached.get('last_modified')
+        else:
+            body = api_result.text
+        self.account_list_cache.put(
+            body, etag=etag, last_modified=last_modified)
+        return json.loads(body)
 
     def get_aws_credentials(self, account, role):
         """Return AWS credentials for a specified user and account"""
-        aws_credentials = self.call_api(
-            "/account/{0}/{1}".format(quote(account), quote(role)))
-        aws_credentials = json.loads(aws_credentials)
-        return {'AWS_ACCESS_KEY_ID': aws_credentials['AccessKeyId'],
-                'AWS_SECRET_ACCESS_KEY': aws_credentials['SecretAccessKey'],
-                'AWS_SESSION_TOKEN': aws_credentials['Token'],
-                'AWS_SECURITY_TOKEN': aws_credentials['Token'],
-                'AWS_EXPIRATION_DATE': aws_credentials['Expiration']}
+        if self.credentials_cache is None:
+            return self.fetch_aws_credentials(account, role)
+        return self.credentials_cache.get_or_fetch(
+            self.api_url, self.username, account, role,
+            lambda: self.fetch_aws_credentials(account, role))
+
+    def fetch_aws_credentials(self, account, role):
+        """Request AWS credentials from the server, bypassing the cache"""
+        return parse_aws_credentials(self.call_api(
+            "/account/{0}/{1}".format(quote(account), quote(role))))
@@ -5,24 +5,54 @@ Command line client for the AFP V2 (AWS Federation Proxy)
 Usage:
     afp [options] help
     afp [options] version
-    afp [options] list [--output <output_format>]
-    afp [options] (show | export | shell) <accountname> [<rolename>]
+    afp [options] list [--output <output_format>] [--filter <pattern>] [--role <pattern>]
+    afp [options] (show | export | shell | credential-process) <accountname> [<rolename>]
     afp [options] write [--profile <profile_name>] <accountname> [<rolename>]
+    afp [options] agent [--foreground]
+    afp [options] serve-metadata [--port <port>]
+    afp [options] fetch [--output <output_format>] [--workers <count>] [--write] [--from-file <pairs_file>] [<pair>...]
+    afp [options] stream [--workers <count>]
+    afp [options] bench [--output <output_format>] [--workers <count>] [--requests <count>] [--duration <seconds>] [--rate <per_second>] [<pair>...]
+    afp [options] find [--limit <count>] [--assume] <query>...
+    afp [options] complete accounts [<prefix>]
+    afp [options] complete roles <accountname> [<prefix>]
     afp [options] <accountname> [<rolename>]
 
 Options:
   -h, --help                          Show this.
   -d, --debug                         Activate debug output.
+  --timing                            Show on stderr how long each phase of afp took, e.g. DNS, password and HTTP.
   -u, --user <username>               The user you want to use.
-  -s, --server <servername>           The AFP server to use.
-  -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest). Takes precedence over --server.
+  -s, --server <servername>           The AFP server to use, or several separated by commas.
+  -a, --api-url <api-url>             The URL of the AFP server (e.g. https://afp/afp-api/latest), or several separated by commas. Takes precedence over --server.
   -p, --password-provider <provider>  Password provider. Valid values are: 'prompt', 'keyring' and 'testing'.
-  -o, --output <output_format>        Output format for 'list'. Valid values are: 'human', 'json' and 'csv'
+  -o, --output <output_format>        Output format for 'list', 'fetch' and 'bench'. Valid values are: 'human', 'json' and 'csv'
+  --filter <pattern>                  Only list accounts matching this glob pattern, e.g. 'prod-*', or regular expression between slashes, e.g. '/^prod-(eu|us)/'.
+  --role <pattern>                    Only list roles matching this glob pattern or regular expression between slashes, and the accounts having them.
   --profile <profile_name>            Which profile to use in the aws credentials file.
+  --no-cache                          Always fetch fresh credentials instead of using cached ones.
+  --connect-timeout <seconds>         Seconds to wait for a connection to the AFP server. Defaults to 10.
+  --read-timeout <seconds>            Seconds to wait for an answer of the AFP server. Defaults to 30.
+  --pool-size <count>                 How many connections to the AFP server to keep open. Defaults to 10.
+  --no-keep-alive                     Open a new connection for every request to the AFP server.
+  --refresh                           Fetch new credentials for the subshell before the current ones expire.
+  --foreground                        Do not detach the agent from the terminal.
+  --workers <count>                   How many credentials to fetch or requests to send concurrently [default: 10].
+  --requests <count>                  How many requests to send. Defaults to 100, unless --duration is given.
+  --duration <seconds>                For how many seconds to send requests.
+  --rate <per_second>                 How many requests to start per second. Defaults to as many as the workers can send.
+  --port <port>                       The local port on which to serve credentials [default: 8123].
+  --limit <count>                     How many matches to show [default: 10].
+  --assume                            Use the best match like <accountname> and <rolename>, e.g. to open a subshell for it.
+  --from-file <pairs_file>            Read <account>/<role> pairs from a file, one per line. Use '-' for stdin.
+  --write                             Also write fetched credentials to the aws credentials file, as profiles named '<account>-<role>'.
 
 Arguments:
   <accountname>                       The AWS account id you want to login to.
   <rolename>                          The AWS role you want to use for login. Defaults to the first role.
+  <pair>                              An AWS account id and role separated by a slash, e.g. 'myaccount/myrole'.
+  <prefix>                            Only complete names starting with this.
+  <query>                             Words to look for in account and role names, typos are allowed.
 
 Subcommands:
   help                                Show help.
@@ -32,41 +62,91 @@ Subcommands:
   export                              Show credentials in an export suitable format.
   write                               Write credentials to aws credentials file.
   shell                               Open a subshell with exported credentials.
+  credential-process                  Show credentials in the format of the AWS SDK 'credential_process' setting.
+  agent                               Start a background process which answers requests of other afp invocations.
+  fetch                               Fetch credentials for many accounts and roles concurrently.
+  serve-metadata                      Serve credentials to AWS SDKs like the ECS container credentials endpoint.
+  stream                              Read <account> <role> lines from stdin and write the credentials for each as a line of JSON as soon as they are fetched.
+  bench                               Send many requests to the AFP server, for the account list and the credentials of every <pair>, and report latency, throughput and errors.
+  find                                Search accounts and roles in the cached account list and show the best matches as <account>/<role>.
+  complete                            Complete accounts or roles from the cached account list, for shell completion.
 """  # NOQA, docopt stuff is allowed to be longcat, and longcat is loooong
 
 from __future__ import absolute_import, division, print_function
 
 import getpass
+import sys
 
 from docopt import docopt
+from six.moves.urllib.parse import quote
 
-from . import __version__, log
-from .aws_credentials_file import write
-from .cli_functions import (get_api_url,
+from . import __version__, log, timing
+from .aws_credentials_file import write, write_profiles
+from .bulk import fetch_all, parse_pair, read_pairs, stream_credentials
+from .cli_functions import (filter_account_and_role_list,
+                            get_account_list_cache,
+                            get_api_urls,
                             get_aws_credentials,
+                            get_bench_settings,
+                            get_cached_aws_credentials,
+                            get_circuit_breakers,
+                            get_connection_settings,
+                            get_credentials_cache,
+                            get_default_role_index,
+                            get_find_limit,
                             get_first_role,
+                            get_name_filter,
+                            get_host_cache,
+                            get_last_api_url,
+                            get_retry_policy,
+                            get_server_ranking,
                             sanitize_credentials)
-from .client import AWSFederationClientCmd
+from .compat import OrderedDict
+from .completion import complete
 from .config import load_config
 from .exporters import (enter_subx,
-                        format_account_and_role_list,
                         format_aws_credentials,
-                        print_export)
+                        format_bench_results,
+                        format_credential_process,
+                        format_fetch_results,
+                        format_stream_result,
+                        iter_account_and_role_list,
+                        print_export,
+                        print_lines)
 from .log import CMDLineExit, debug, error, info
-from .password_providers import get_password
+from .refresh import REFRESH_MARGIN
 
 HELP, VERSION, LIST, SHOW, EXPORT, WRITE, SHELL, SIMPLE = \
     'help', 'version', 'list', 'show', 'export', 'write', 'shell', 'simple'
+CREDENTIAL_PROCESS, AGENT, FETCH, COMPLETE, SERVE_METADATA, BENCH = \
+    'credential-process', 'agent', 'fetch', 'complete', 'serve-metadata', \
+    'bench'
+STREAM, FIND = 'stream', 'find'
 
-SUBCOMMANDS = [HELP, VERSION, LIST, SHOW, EXPORT, WRITE, SHELL]
-ASSUME_SUBCOMMANDS = [SHOW, EXPORT, WRITE, SHELL, SIMPLE]
+SUBCOMMANDS = [HELP, VERSION, LIST, SHOW, EXPORT, WRITE, SHELL,
+               CREDENTIAL_PROCESS, AGENT, FETCH, COMPLETE, SERVE_METADATA,
+               BENCH, STREAM, FIND]
+ASSUME_SUBCOMMANDS = [SHOW, EXPORT, WRITE, SHELL, SIMPLE, CREDENTIAL_PROCESS]
+
+# The AWS SDKs refresh credentials 15 minutes before they expire, so
+# handing out cached credentials any closer to their expiration would
+# make them call us again right away.
+CREDENTIAL_PROCESS_CACHE_MARGIN = 15 * 60
+SDK_SUBCOMMANDS = [CREDENTIAL_PROCESS, SERVE_METADATA]
 
 
 def main():
+    # Shell completion runs on every TAB press, skip docopt if there are
+    # no options.
+    if sys.argv[1:2] == [COMPLETE]:
+        sys.exit(_complete(sys.argv[2:]))
+    timing.start()
     try:
         unprotected_main()
     except CMDLineExit as e:
         error(e)
+    finally:
+        timing.report()
 
 
 def _get_first(list_, default=None):
@@ -74,16 +154,99 @@ def _get_first(list_, default=None):
     return list_[0] if list_ else default
 
 
+def _get_federation_client(subcommand, api_url, username, password_provider,
+                           credentials_cache, account_list_cache=None,
+                           connection_settings=None):
+    """ Return a client for a running agent or the AFP server itself. """
+    # Imported here since they pull in requests and keyring, which take
+    # longer to load than everything else afp needs.
+    with timing.phase('imports'):
+        from .client import AWSFederationClientCmd
+        from .password_providers import get_password
+
+    # Benchmarks measure the server, not the agent
+    if subcommand not in (AGENT, BENCH):
+        from .agent import get_agent_client
+        # Without a cache of our own, the agent's is not to be used either
+        agent_client = get_agent_client(api_url, username,
+                                        no_cache=credentials_cache is None)
+        if agent_client is not None:
+            return agent_client
+
+    password = get_password(password_provider, username)
+
+    # Do the sanitize dance
+    sanitize_credentials(username, password)
+
+    return AWSFederationClientCmd(
+        api_url=api_url, username=username, password=password,
+        credentials_cache=credentials_cache,
+        account_list_cache=account_list_cache,
+        **(connection_settings or {}))
+
+
+def _get_workers(arguments):
+    """ Return how many credentials to fetch concurrently. """
+    try:
+        workers = int(arguments['--workers'])
+        if workers < 1:
+            raise ValueError()
+    except ValueError:
+        raise CMDLineExit("'{0}' is not a valid number of workers.".format(
+            arguments['--workers']))
+    return workers
+
+
+def _complete(argv, arguments=None):
+    """
+    Complete argv for the configured server and user.
+
+    This runs on every TAB press, so only files on disk are read: the
+    server is the one looked up last. Without it, there is nothing to
+    complete, which is not worth a message either.
+    """
+    arguments = arguments or {}
+    try:
+        config = load_config()
+    except Exception:
+        return 0
+    api_url = get_last_api_url(arguments, config)
+    if api_url is None:
+        return 0
+    username = arguments.get('--user') or config.get("user") or \
+        getpass.getuser()
+    return complete(argv, api_url, username)
+
+
+def _get_pairs(arguments):
+    """ Return the (account, role) pairs given on the command line. """
+    pairs = [parse_pair(pair) for pair in arguments['<pair>']]
+    pairs_file = arguments['--from-file']
+    if pairs_file == '-':
+        pairs.extend(read_pairs(sys.stdin))
+    elif pairs_file:
+        try:
+            with open(pairs_file) as lines:
+                pairs.extend(read_pairs(lines))
+        except (IOError, OSError) as exc:
+            raise CMDLineExit("Failed to read pairs file: %s" % exc)
+    return pairs
+
+
 def unprotected_main():
     """Main function for script execution"""
     arguments = docopt(__doc__)
     if arguments['--debug']:
         log.DEBUG = True
+    if arguments['--timing']:
+        timing.report_to_stderr()
     debug(arguments)
 
     # parse the subcommand, use SIMPLE mode if no subcommand
     subcommand = _get_first([s for s in SUBCOMMANDS if arguments[s]], SIMPLE)
     debug("Subcommand is '{0}'".format(subcommand))
+    timing.set_detail('version', __version__)
+    timing.set_detail('subcommand', subcommand)
 
     if subcommand == VERSION:
         info('afp-cli version {0}'.format(__version__))
@@ -91,35 +254,193 @@ def unprotected_main():
     elif subcommand == HELP:
         # exit early with help message
         docopt(__doc__, argv=['--help'])
+    elif subcommand == COMPLETE:
+        sys.exit(_complete(
+            [s for s in ['accounts', 'roles'] if arguments[s]] +
+            [a for a in [arguments['<accountname>'], arguments['<prefix>']]
+             if a],
+            arguments))
+    elif subcommand == AGENT:
+        from .agent import is_supported as agent_is_supported
+        if not agent_is_supported():
+            error("The afp agent needs Unix domain sockets.")
 
     try:
         config = load_config()
     except Exception as exc:
         error("Failed to load configuration: %s" % exc)
 
-    api_url = get_api_url(arguments, config)
+    host_cache = get_host_cache(arguments, config)
+    api_urls = get_api_urls(arguments, config, host_cache)
+    # The first server names the caches, whichever server answers
+    api_url = api_urls[0]
     debug("'api-url' is '{0}'".format(api_url))
     username = arguments['--user'] or config.get("user") or getpass.getuser()
     debug("'username' is '{0}'".format(username))
+
+    # Cached account lists are kept for every server and user
+    if subcommand == FIND:
+        from .search import load_index as load_search_index
+        from .search import search
+        index = load_search_index(api_url, username)
+        if index is None:
+            raise CMDLineExit("No cached account list, run 'afp list' "
+                              "first.")
+        query = " ".join(arguments['<query>'])
+        matches = search(index, query, get_find_limit(arguments))
+        if not matches:
+            raise CMDLineExit("No account or role matches '{0}'.".format(
+                query))
+        if not arguments['--assume']:
+            info("\n".join("{0}/{1}".format(account, role)
+                           for account, role in matches))
+            return 0
+        debug("Best match of '{0}' is {1}/{2}".format(query, *matches[0]))
+        arguments['<accountname>'], arguments['<rolename>'] = matches[0]
+        subcommand = SIMPLE
     password_provider = (arguments['--password-provider'] or
                          config.get("password-provider") or
                          'prompt')
     debug("'password-provider' is '{0}'".format(password_provider))
 
-    password = get_password(password_provider, username)
+    connection_settings = get_connection_settings(arguments, config)
+    connection_settings.update(
+        retry_policy=get_retry_policy(arguments, config),
+        circuit_breakers=get_circuit_breakers(arguments, config),
+        api_urls=api_urls,
+        server_ranking=get_server_ranking(arguments, config, api_urls))
+    if host_cache is not None:
+        # Cached hosts may be gone or have new certificates by now
+        connection_settings['resolve_api_urls'] = lambda: get_api_urls(
+            arguments, config, host_cache, fresh=True)
 
-    # Do the sanitize dance
-    sanitize_credentials(username, password)
+    refresh = arguments['--refresh'] and subcommand in (SHELL, SIMPLE)
 
-    federation_client = AWSFederationClientCmd(
-        api_url=api_url, username=username, password=password)
+    credentials_cache = get_credentials_cache(arguments, config)
+    if credentials_cache is not None and subcommand in SDK_SUBCOMMANDS:
+        credentials_cache.margin = max(credentials_cache.margin,
+                                       CREDENTIAL_PROCESS_CACHE_MARGIN)
+    if credentials_cache is not None and refresh:
+        # Otherwise refreshing would just return the cached credentials
+        credentials_cache.margin = max(credentials_cache.margin,
+                                       REFRESH_MARGIN)
+
+    role_index = get_default_role_index(arguments, config, api_url, username)
 
     aws_credentials = None
     if subcommand in ASSUME_SUBCOMMANDS:
         account = arguments['<accountname>']
-        role = arguments.get('<rolename>') or \
-            get_first_role(federation_client, account)
-        aws_credentials = get_aws_credentials(federation_client, account, role)
+        role = arguments.get('<rolename>')
+        cached_role = role
+        if cached_role is None and role_index is not None:
+            cached_role = role_index.get(account)[0]
+        if cached_role:
+            # Cached credentials need neither a password nor the server
+            aws_credentials = get_cached_aws_credentials(
+                credentials_cache, api_url, username, account, cached_role)
+            if aws_credentials is not None:
+                role = cached_role
+
+    if subcommand == FETCH:
+        pairs = _get_pairs(arguments)
+        workers = _get_workers(arguments)
+        fetch_results = fetch_all(
+            lambda: _get_federation_client(
+                subcommand, api_url, username, password_provider,
+                credentials_cache, connection_settings=connection_settings),
+            pairs, workers, credentials_cache, api_url, username)
+        output_format = (arguments['--output'] or
+                         config.get("output") or
+                         'human')
+        info(format_fetch_results(fetch_results, output_format))
+        profiles = OrderedDict(
+            ("{0}-{1}".format(result.account, result.role),
+             result.aws_credentials)
+            for result in fetch_results if not result.error)
+        if arguments['--write'] and profiles:
+            write_profiles(profiles)
+        failed = len([r for r in fetch_results if r.error])
+        if failed:
+            raise CMDLineExit("Failed to fetch credentials for {0} of {1} "
+                              "pairs.".format(failed, len(fetch_results)))
+        return 0
+
+    if subcommand == STREAM:
+        invalid_lines = []
+
+        def skip_line(exc):
+            invalid_lines.append(exc)
+            print("Skipping invalid line: {0}".format(exc), file=sys.stderr)
+
+        failed = 0
+        for result in stream_credentials(
+                lambda: _get_federation_client(
+                    subcommand, api_url, username, password_provider,
+                    credentials_cache,
+                    connection_settings=connection_settings),
+                read_pairs(sys.stdin, skip_line), _get_workers(arguments),
+                credentials_cache, api_url, username):
+            failed += bool(result.error)
+            info(format_stream_result(result))
+            # Consumers are waiting for every single line
+            sys.stdout.flush()
+        problems = []
+        if failed:
+            problems.append("Failed to fetch credentials for {0} "
+                            "pairs.".format(failed))
+        if invalid_lines:
+            problems.append("Skipped {0} invalid lines.".format(
+                len(invalid_lines)))
+        if problems:
+            raise CMDLineExit(" ".join(problems))
+        return 0
+
+    if subcommand == BENCH:
+        from .bench import run_load, summarize
+        bench_settings = get_bench_settings(arguments)
+        targets = ['/account'] + [
+            '/account/{0}/{1}'.format(quote(account), quote(role))
+            for account, role in _get_pairs(arguments)]
+        # Every request is to reach the server, however often it fails
+        connection_settings['circuit_breakers'] = None
+        federation_client = _get_federation_client(
+            subcommand, api_url, username, password_provider, None,
+            connection_settings=connection_settings)
+        federation_client.resize_connection_pool(bench_settings['workers'])
+        # Neither retries, nor failover, nor hedging: the numbers are to
+        # be those of this one server
+        debug("Benchmarking '{0}'".format(api_url))
+        samples, elapsed = run_load(
+            lambda target: federation_client.send_request(api_url, target),
+            targets, **bench_settings)
+        output_format = (arguments['--output'] or
+                         config.get("output") or
+                         'human')
+        summaries = summarize(samples, elapsed, targets)
+        info(format_bench_results(summaries, output_format))
+        if samples and summaries['total']['errors'] == len(samples):
+            raise CMDLineExit("All {0} requests failed.".format(
+                len(samples)))
+        return 0
+
+    if subcommand == LIST:
+        # Invalid patterns are to fail before a password is asked for
+        account_filter = get_name_filter(arguments['--filter'])
+        role_filter = get_name_filter(arguments['--role'], 'role filter')
+
+    if aws_credentials is None or refresh:
+        # Refreshing needs a client even if the credentials were cached,
+        # so that a password is asked for now and not in the subshell.
+        federation_client = _get_federation_client(
+            subcommand, api_url, username, password_provider,
+            credentials_cache,
+            get_account_list_cache(arguments, config, api_url, username),
+            connection_settings)
+        if subcommand in ASSUME_SUBCOMMANDS and aws_credentials is None:
+            role = role or get_first_role(
+                federation_client, account, role_index)
+            aws_credentials = get_aws_credentials(
+                federation_client, account, role)
 
     if subcommand == LIST:
 
@@ -128,17 +449,71 @@ def unprotected_main():
                          'human')
         debug("'output' is '{0}'".format(output_format))
         try:
-            info(format_account_and_role_list(
-                 federation_client.get_account_and_role_list(), output_format))
+            accounts_and_roles = federation_client.get_account_and_role_list()
         except Exception as exc:
             error("Failed to get account list from AWS: %s" % exc)
+        if role_index is not None:
+            role_index.update(accounts_and_roles)
+        accounts_and_roles = filter_account_and_role_list(
+            accounts_and_roles, account_filter, role_filter)
+        print_lines(iter_account_and_role_list(accounts_and_roles,
+                                               output_format))
     elif subcommand == SHOW:
         info(format_aws_credentials(aws_credentials))
     elif subcommand == EXPORT:
         print_export(aws_credentials)
+    elif subcommand == CREDENTIAL_PROCESS:
+        info(format_credential_process(aws_credentials))
     elif subcommand == WRITE:
         write(aws_credentials)
-    elif subcommand == SHELL:
-        enter_subx(aws_credentials, account, role)
-    elif subcommand == SIMPLE:
-        enter_subx(aws_credentials, account, role)
+    elif subcommand in (SHELL, SIMPLE):
+        # Time spent in the subshell is the user's, not afp's
+        timing.report()
+        enter_subx(aws_credentials, account, role,
+                   fetch=(lambda: get_aws_credentials(
+                       federation_client, account, role)) if refresh else None)
+    elif subcommand == SERVE_METADATA:
+        # http.server and ssl take as long to import as all of the rest
+        from .metadata import MetadataServer, generate_token
+        try:
+            port = int(arguments['--port'])
+        except ValueError:
+            raise CMDLineExit("'{0}' is not a valid port.".format(
+                arguments['--port']))
+        try:
+            # Fail early on wrong passwords
+            federation_client.get_account_and_role_list()
+        except Exception as exc:
+            error("Failed to get account list from AWS: %s" % exc)
+        try:
+            server = MetadataServer(('127.0.0.1', port), federation_client,
+                                    generate_token(),
+                                    CREDENTIAL_PROCESS_CACHE_MARGIN)
+        except (IOError, OSError) as exc:
+            raise CMDLineExit("Failed to serve credentials: %s" % exc)
+        info("Serving credentials on '{0}', use them with:".format(
+            server.get_url()))
+        info("export AWS_CONTAINER_CREDENTIALS_FULL_URI='{0}'".format(
+            server.get_url()))
+        info("export AWS_CONTAINER_AUTHORIZATION_TOKEN='{0}'".format(
+            server.token))
+        sys.stdout.flush()
+        timing.report()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif subcommand == AGENT:
+        from .agent import AgentServer, get_socket_path, run_agent
+        try:
+            # Fail early on wrong passwords, before detaching
+            federation_client.get_account_and_role_list()
+        except Exception as exc:
+            error("Failed to get account list from AWS: %s" % exc)
+        socket_path = get_socket_path(api_url, username)
+        server = AgentServer(socket_path, federation_client)
+        info("afp agent listening on '{0}'".format(socket_path))
+        timing.report()
+        run_agent(server, foreground=arguments['--foreground'])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Shell completion for accounts and roles.
+
+Candidates come from the index written whenever the account list is
+cached, one for every server and user. Neither the server nor a password
+is needed, so answering is about as fast as starting Python. Nothing is
+printed but the candidates, to keep the shell clean.
+
+Usage:
+    afp [options] complete accounts [<prefix>]
+    afp [options] complete roles <accountname> [<prefix>]
+"""
+from __future__ import print_function, absolute_import, division
+
+import bisect
+import json
+
+from .cache import get_completion_index_filename
+
+ACCOUNTS, ROLES = 'accounts', 'roles'
+
+
+def load_index(filename):
+    """Return the completion index or None if there is none (yet)"""
+    try:
+        with open(filename) as index_file:
+            return json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def complete_accounts(index, prefix=''):
+    accounts = index['accounts']
+    start = bisect.bisect_left(accounts, prefix)
+    candidates = []
+    for account in accounts[start:]:
+        if not account.startswith(prefix):
+            break
+        candidates.append(account)
+    return candidates
+
+
+def complete_roles(index, account, prefix=''):
+    return [role for role in index['roles'].get(account, [])
+            if role.startswith(prefix)]
+
+
+def complete(argv, api_url, username, cache_dir=None):
+    """
+    Print the candidates for argv from the index of username on
+    api_url, return the exit code
+    """
+    if argv[:1] == [ACCOUNTS] and len(argv) <= 2:
+        what, arguments = complete_accounts, argv[1:]
+    elif argv[:1] == [ROLES] and 2 <= len(argv) <= 3:
+        what, arguments = complete_roles, argv[1:]
+    else:
+        return 2
+
+    index = load_index(
+        get_completion_index_filename(api_url, username, cache_dir))
+    if index is None:
+        return 0
+    candidates = what(index, *arguments)
+    if candidates:
+        print('\n'.join(candidates))
+    return 0
@@ -4,13 +4,16 @@ from __future__ import print_function, absolute_import, division
 
 import os
 
-import yamlreader
-
+from .timing import timed
 
 CFGDIR = '/etc/afp-cli'
 
 
+@timed('config')
 def load_config(global_config_dir=CFGDIR):
+    # yamlreader pulls in PyYAML, which is only needed from here on
+    import yamlreader
+
     global_config = {}
     if os.path.isdir(global_config_dir):
         global_config = yamlreader.yaml_load(global_config_dir, {})
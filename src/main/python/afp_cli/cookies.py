@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import errno
+import json
+import os
+
+from requests.cookies import RequestsCookieJar, create_cookie
+
+from .fileutils import file_lock, write_atomic
+from .log import debug
+from .timing import timed
+
+# Everything create_cookie() needs to recreate a cookie
+COOKIE_ATTRIBUTES = ['version', 'name', 'value', 'port', 'domain', 'path',
+                     'secure', 'expires', 'discard', 'comment', 'comment_url',
+                     'rfc2109']
+
+
+def cookie_to_dict(cookie):
+    fields = dict((name, getattr(cookie, name)) for name in COOKIE_ATTRIBUTES)
+    fields['rest'] = cookie._rest
+    return fields
+
+
+def get_cookie_key(fields):
+    return fields['domain'], fields['path'], fields['name']
+
+
+class CookieStore(object):
+    """
+    Keep the session cookies of the AFP server in a JSON file.
+
+    The file is only rewritten when the cookies actually changed. Changes
+    are merged with those of concurrent afp processes under a file lock,
+    and a store that is corrupt or locked by another process is treated
+    like a missing one, i.e. the session just starts out cold.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock_filename = filename + '.lock'
+        self.saved = {}
+
+    def _read(self):
+        try:
+            with open(self.filename) as store_file:
+                cookies = json.load(store_file)
+            return dict((get_cookie_key(fields), fields)
+                        for fields in cookies)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                debug("Failed to read cookies from '{0}': {1}".format(
+                    self.filename, exc))
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            debug("Ignoring corrupt cookie store '{0}': {1}".format(
+                self.filename, exc))
+        return {}
+
+    @timed('cookies')
+    def load(self):
+        """Return a cookie jar with all unexpired cookies of the store"""
+        self.saved = self._read()
+        cookie_jar = RequestsCookieJar()
+        for fields in self.saved.values():
+            try:
+                cookie = create_cookie(**fields)
+            except TypeError:
+                continue
+            if not cookie.is_expired():
+                cookie_jar.set_cookie(cookie)
+        return cookie_jar
+
+    @timed('cookies')
+    def save(self, cookie_jar):
+        """Write the cookies to the store, unless nothing has changed"""
+        current = dict((get_cookie_key(fields), fields) for fields in
+                       (cookie_to_dict(cookie) for cookie in cookie_jar))
+        if current == self.saved:
+            return
+        try:
+            with file_lock(self.lock_filename, timeout=0):
+                # Keep what other processes saved in the meantime, except
+                # for cookies that were removed from this jar
+                cookies = self._read()
+                for key in set(self.saved) - set(current):
+                    cookies.pop(key, None)
+                cookies.update(current)
+                write_atomic(self.filename,
+                             json.dumps(list(cookies.values())))
+        except (IOError, OSError) as exc:
+            debug("Failed to save cookies to '{0}': {1}".format(
+                self.filename, exc))
+            return
+        self.saved = current
+
+
+def get_default_filename():
+    return os.path.join(os.path.expanduser("~/.afp-cli"), 'cookies.json')
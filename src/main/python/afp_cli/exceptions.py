@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Exceptions shared by the client and the modules around it.
+
+They live here and not in client.py, so that raising or catching them
+does not import requests.
+"""
+from __future__ import absolute_import, division, print_function
+
+from six import PY3
+
+
+class APICallError(Exception):
+    def __init__(self, *args, **kwargs):
+        self.status_code = kwargs.pop('status_code', None)
+        super(APICallError, self).__init__(*args, **kwargs)
+
+    def __str__(self, *args, **kwargs):
+        if PY3:
+            return super(APICallError, self).__str__(*args, **kwargs)
+        return self.message
+
+
+class CircuitOpenError(APICallError):
+    """Raised instead of sending requests to a server which keeps failing"""
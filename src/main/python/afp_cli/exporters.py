@@ -2,13 +2,21 @@
 
 from __future__ import print_function, absolute_import, division
 
+import itertools
 import json
 import os
+import shutil
 import subprocess
 import sys
 import tempfile
+# What json.dumps() uses for strings, without its overhead per call
+from json.encoder import encode_basestring_ascii as encode_json_string
 
 from .log import CMDLineExit, info
+from .refresh import CredentialsRefresher
+
+# How many lines print_lines() prints at once
+PRINT_CHUNK_SIZE = 500
 
 HUMAN = 'human'
 JSON = 'json'
@@ -32,6 +40,34 @@ function afp_minutes_left {{
 PS1="(AWS {account}/{role} \\$(afp_minutes_left)) $PS1"
 """
 
+# Set by an outer 'afp shell' or 'afp export', and read by the AWS SDKs
+# before the credentials file which has the refreshed credentials
+STATIC_CREDENTIALS_VARIABLES = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY',
+                                'AWS_SESSION_TOKEN', 'AWS_SECURITY_TOKEN']
+
+# Used instead of RC_SCRIPT_TEMPLATE if the credentials are refreshed
+REFRESH_RC_SCRIPT_TEMPLATE = """
+# Pretend to be an interactive, non-login shell
+for file in /etc/bash.bashrc ~/.bashrc; do
+    [ -f "$file" ] && . "$file"
+done
+
+function afp_minutes_left {{
+    local now expiration
+    # printf '%(%s)T' would need bash 4.2, macOS still has bash 3.2
+    now=$(date +%s)
+    read expiration < '{expiration_filename}'
+    if ((now >= expiration)) ; then
+        echo EXPIRED
+    else
+        echo $(((expiration-now)/60)) Min
+    fi
+}}
+
+PS1="(AWS {account}/{role} \\$(afp_minutes_left)) $PS1"
+unset AWS_PROFILE AWS_DEFAULT_PROFILE {static_variables}
+"""
+
 BATCH_FILE_TEMPLATE = """
 @echo off
 set PROMPT=$C AWS {account}/{role} $F
@@ -45,26 +81,163 @@ def format_aws_credentials(credentials, prefix=''):
 
 
 def format_account_and_role_list(account_and_role_list, output_formt=HUMAN):
-    if output_formt == HUMAN:
-        padding = max([len(account) for account in account_and_role_list]) + 3
+    separator = "\n" if output_formt == JSON else os.linesep
+    return separator.join(
+        iter_account_and_role_list(account_and_role_list, output_formt))
+
+
+def iter_account_and_role_list(account_and_role_list, output_format=HUMAN):
+    """
+    Yield the output of format_account_and_role_list() account by account,
+    so that the first accounts can be printed before the last ones are
+    formatted. JSON is pretty-printed just like json.dumps() would.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise CMDLineExit("'{0}' is not a valid output format.\n".
+                          format(output_format) +
+                          "Valid options are: {0}".
+                          format(OUTPUT_FORMATS))
+    accounts = sorted(account_and_role_list)
+    if output_format == HUMAN:
+        padding = max([len(account) for account in accounts] + [0]) + 3
+        for account in accounts:
+            yield "{0:<{2}} {1}".format(
+                account, ",".join(sorted(account_and_role_list[account])),
+                padding)
+    elif output_format == JSON:
+        if not accounts:
+            yield "{}"
+            return
+        yield "{"
+        last = len(accounts) - 1
+        for number, account in enumerate(accounts):
+            roles = account_and_role_list[account]
+            yield '    {0}: {1}{2}'.format(
+                encode_json_string(account),
+                '[\n        {0}\n    ]'.format(',\n        '.join(
+                    map(encode_json_string, roles))) if roles else '[]',
+                ',' if number < last else '')
+        yield "}"
+    else:
+        for account in accounts:
+            yield ",".join([account] + account_and_role_list[account])
+
+
+def print_lines(lines, chunk_size=PRINT_CHUNK_SIZE):
+    """
+    Print lines as they come, chunk by chunk. This is faster than
+    printing them one by one, without waiting for all of them.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        info("\n".join(chunk))
+
+
+def format_fetch_results(fetch_results, output_format=HUMAN):
+    """Format the FetchResults of a bulk fetch, one line per pair"""
+    if output_format == HUMAN:
+        names = ["{0}/{1}".format(result.account, result.role)
+                 for result in fetch_results]
+        padding = max([len(name) for name in names] + [0]) + 3
+        return os.linesep.join(
+            ["{0:<{2}} {1}".format(
+                name, "FAILED: " + result.error if result.error else "OK",
+                padding)
+             for name, result in zip(names, fetch_results)])
+    elif output_format == JSON:
+        return json.dumps(
+            dict(("{0}/{1}".format(result.account, result.role),
+                  result.aws_credentials or {'error': result.error})
+                 for result in fetch_results),
+            sort_keys=True,
+            indent=4,
+            separators=(',', ': '))
+    elif output_format == CSV:
         return os.linesep.join(
-            ["{0:<{2}} {1}".format(account, ",".join(sorted(roles)), padding)
-             for account, roles in sorted(account_and_role_list.items())])
-    elif output_formt == JSON:
-        return json.dumps(account_and_role_list,
+            [",".join([result.account, result.role] +
+                      (["FAILED", result.error] if result.error else ["OK"]))
+             for result in fetch_results])
+    else:
+        raise CMDLineExit("'{0}' is not a valid output format.\n".
+                          format(output_format) +
+                          "Valid options are: {0}".
+                          format(OUTPUT_FORMATS))
+
+
+def format_stream_result(result):
+    """Format a FetchResult of 'afp stream' as a single line of JSON"""
+    record = {'account': result.account, 'role': result.role}
+    if result.error:
+        record['error'] = result.error
+    else:
+        record['credentials'] = result.aws_credentials
+    return json.dumps(record, sort_keys=True)
+
+
+def _format_milliseconds(seconds):
+    return '-' if seconds is None else '{0:.0f} ms'.format(seconds * 1000)
+
+
+def format_bench_results(summaries, output_format=HUMAN):
+    """Format the summaries of 'afp bench', one line per target"""
+    columns = ['requests', 'errors', 'throughput', 'p50', 'p90', 'p99',
+               'max', 'mean']
+    if output_format == HUMAN:
+        padding = max([len(target) for target in summaries]) + 3
+        lines = ["{0:<{1}}{2:>9}{3:>8}{4:>9}{5:>9}{6:>9}{7:>9}{8:>9}".format(
+            'target', padding, 'requests', 'errors', 'req/s', 'p50', 'p90',
+            'p99', 'max')]
+        for target, summary in summaries.items():
+            latency = summary['latency']
+            lines.append(
+                "{0:<{1}}{2:>9}{3:>8}{4:>9}{5:>9}{6:>9}{7:>9}{8:>9}".format(
+                    target, padding, summary['requests'], summary['errors'],
+                    '-' if summary['throughput'] is None
+                    else '{0:.1f}'.format(summary['throughput']),
+                    *[_format_milliseconds(latency[key])
+                      for key in ['p50', 'p90', 'p99', 'max']]))
+        errors = summaries['total']['error_breakdown']
+        if errors:
+            lines.append("errors: " + ", ".join(
+                "{0} ({1})".format(error, count)
+                for error, count in errors.items()))
+        return os.linesep.join(lines)
+    elif output_format == JSON:
+        return json.dumps(summaries,
                           sort_keys=True,
                           indent=4,
                           separators=(',', ': '))
-    elif output_formt == CSV:
-        return (os.linesep.join([",".join([account] + roles) for account, roles
-                                in sorted(account_and_role_list.items())]))
+    elif output_format == CSV:
+        return os.linesep.join(
+            [",".join(['target'] + columns)] +
+            [",".join([target] + [
+                '' if value is None else str(value) for value in
+                [summary['requests'], summary['errors'],
+                 summary['throughput']] +
+                [summary['latency'][key] for key in columns[3:]]])
+             for target, summary in summaries.items()])
     else:
         raise CMDLineExit("'{0}' is not a valid output format.\n".
-                          format(output_formt) +
+                          format(output_format) +
                           "Valid options are: {0}".
                           format(OUTPUT_FORMATS))
 
 
+def format_credential_process(aws_credentials):
+    """Format aws credentials as expected by the 'credential_process' hook
+    of the AWS SDKs"""
+    return json.dumps({
+        'Version': 1,
+        'AccessKeyId': aws_credentials['AWS_ACCESS_KEY_ID'],
+        'SecretAccessKey': aws_credentials['AWS_SECRET_ACCESS_KEY'],
+        'SessionToken': aws_credentials['AWS_SESSION_TOKEN'],
+        'Expiration': aws_credentials['AWS_EXPIRATION_DATE'],
+    }, sort_keys=True)
+
+
 def print_export(aws_credentials):
     if os.name == "nt":
         info(format_aws_credentials(aws_credentials, prefix='set '))
@@ -72,12 +245,34 @@ def print_export(aws_credentials):
         info(format_aws_credentials(aws_credentials, prefix='export '))
 
 
-def start_subshell(aws_credentials, account, role):
+def format_refreshed_environment(refresher, account, role, prefix=''):
+    """Format the environment variables for refreshed credentials
+
+    The static credentials are left out and the subshell unsets those
+    inherited from its parent, so that AWS tools read the credentials
+    file kept up to date by the refresher."""
+    return format_aws_credentials({
+        'AWS_SHARED_CREDENTIALS_FILE': refresher.credentials_filename,
+        'AWS_ACCOUNT_NAME': account,
+        'AWS_ASSUMED_ROLE': role}, prefix=prefix)
+
+
+def start_subshell(aws_credentials, account, role, refresher=None):
     info("Press CTRL+D to exit.")
     rc_script = tempfile.NamedTemporaryFile(mode='w')
-    rc_script.write(RC_SCRIPT_TEMPLATE.format(role=role, account=account,
-                                              valid_seconds=aws_credentials['AWS_VALID_SECONDS']))
-    rc_script.write(format_aws_credentials(aws_credentials, prefix='export '))
+    if refresher is None:
+        rc_script.write(RC_SCRIPT_TEMPLATE.format(
+            role=role, account=account,
+            valid_seconds=aws_credentials['AWS_VALID_SECONDS']))
+        rc_script.write(format_aws_credentials(
+            aws_credentials, prefix='export '))
+    else:
+        rc_script.write(REFRESH_RC_SCRIPT_TEMPLATE.format(
+            role=role, account=account,
+            expiration_filename=refresher.expiration_filename,
+            static_variables=" ".join(STATIC_CREDENTIALS_VARIABLES)))
+        rc_script.write(format_refreshed_environment(
+            refresher, account, role, prefix='export '))
     rc_script.flush()
     subprocess.call(
         ["bash", "--rcfile", rc_script.name],
@@ -85,10 +280,17 @@ def start_subshell(aws_credentials, account, role):
     info("Left AFP subshell.")
 
 
-def start_subcmd(aws_credentials, account, role):
+def start_subcmd(aws_credentials, account, role, refresher=None):
     batch_file = tempfile.NamedTemporaryFile(suffix=".bat", delete=False)
     batch_file.write(BATCH_FILE_TEMPLATE.format(role=role, account=account))
-    batch_file.write(format_aws_credentials(aws_credentials, prefix='set '))
+    if refresher is None:
+        batch_file.write(format_aws_credentials(
+            aws_credentials, prefix='set '))
+    else:
+        batch_file.write("".join("set {0}=\n".format(variable)
+                                 for variable in STATIC_CREDENTIALS_VARIABLES))
+        batch_file.write(format_refreshed_environment(
+            refresher, account, role, prefix='set '))
     batch_file.flush()
     batch_file.close()
     subprocess.call(
@@ -97,12 +299,27 @@ def start_subcmd(aws_credentials, account, role):
     os.unlink(batch_file.name)
 
 
-def enter_subx(aws_credentials, account, role):
+def enter_subx(aws_credentials, account, role, fetch=None):
+    """Start a subshell with the credentials
+
+    If fetch is given, it is called to get new credentials shortly before
+    the current ones expire, for as long as the subshell runs."""
     info("Entering AFP subshell for account {0}, role {1}.".format(account, role))
+    refresher, refresh_dir = None, None
     try:
+        if fetch is not None:
+            refresh_dir = tempfile.mkdtemp(prefix='afp-')
+            refresher = CredentialsRefresher(fetch, aws_credentials,
+                                             refresh_dir)
+            refresher.start()
         if os.name == "nt":
-            start_subcmd(aws_credentials, account, role)
+            start_subcmd(aws_credentials, account, role, refresher)
         else:
-            start_subshell(aws_credentials, account, role)
+            start_subshell(aws_credentials, account, role, refresher)
     except Exception as exc:
         raise CMDLineExit("Failed to start subshell: %s" % exc)
+    finally:
+        if refresher is not None:
+            refresher.stop()
+        if refresh_dir is not None:
+            shutil.rmtree(refresh_dir, ignore_errors=True)
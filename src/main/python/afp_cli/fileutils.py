@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import errno
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# Seconds between attempts to take a lock held by another process
+LOCK_POLL_INTERVAL = 0.05
+
+
+class LockError(IOError):
+    """Raised if a lock can not be acquired"""
+
+
+def ensure_dir(dirname):
+    """Create dirname (and parents) unless it already exists"""
+    try:
+        os.makedirs(dirname)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def _replace(source, destination):
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:  # pragma: no cover
+        # Python 2 has no atomic replace on Windows
+        if os.name == 'nt' and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def write_atomic(filename, content, mode=None):
+    """
+    Write content to filename so that readers never see a partial file.
+
+    The content is written to a temporary file in the same directory
+    which is then renamed to filename. The file is only readable by the
+    current user, unless another `mode` is given.
+    """
+    dirname = os.path.dirname(filename)
+    ensure_dir(dirname)
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=dirname, prefix='.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(content)
+        if mode is not None:
+            os.chmod(tmp_filename, mode)
+        _replace(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+
+
+def _acquire(lock_file, timeout):
+    if timeout is None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except (IOError, OSError) as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        if time.time() >= deadline:
+            raise LockError(errno.EAGAIN, "Timed out waiting for lock",
+                            lock_file.name)
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+@contextmanager
+def file_lock(filename, timeout=None):
+    """
+    Hold an exclusive advisory lock on filename while in the block.
+
+    Use a dedicated lock file, since files replaced by write_atomic()
+    get a new inode and would lose any lock held on them. Where fcntl
+    is not available (Windows), no locking takes place.
+    Wait at most `timeout` seconds for the lock (forever if None, not at
+    all if 0), then raise a LockError.
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    ensure_dir(os.path.dirname(filename))
+    with open(filename, 'a') as lock_file:
+        _acquire(lock_file, timeout)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def try_file_lock(filename, timeout=None):
+    """
+    Like file_lock(), but go on without the lock if it can not be taken,
+    be it for the timeout or since the lock file can not be created.
+
+    Yield None while holding the lock, otherwise the error.
+    """
+    try:
+        lock = file_lock(filename, timeout)
+        lock.__enter__()
+    except (IOError, OSError) as exc:
+        yield exc
+        return
+    try:
+        yield None
+    finally:
+        lock.__exit__(None, None, None)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Serve credentials like the ECS container credentials endpoint.
+
+AWS SDKs and the AWS CLI fetch credentials from the URL in the
+environment variable AWS_CONTAINER_CREDENTIALS_FULL_URI, sending the
+value of AWS_CONTAINER_AUTHORIZATION_TOKEN as 'Authorization' header.
+They refresh them on their own before they expire. The server answers
+GET /<account>/<role> with the credentials for that account and role.
+"""
+from __future__ import print_function, absolute_import, division
+
+import binascii
+import hmac
+import json
+import os
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote
+
+from .cache import DEFAULT_MARGIN, expires_within
+from .log import debug
+
+DEFAULT_PORT = 8123
+# Plenty of SDK clients may connect at the same time
+REQUEST_QUEUE_SIZE = 256
+
+
+def generate_token():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+class MemoryCredentialsCache(object):
+    """
+    Keep credentials in memory until `margin` seconds before they expire.
+
+    Concurrent requests for the same account and role wait for a single
+    call to the federation client, requests for other accounts and roles
+    are not held up by it.
+    """
+
+    def __init__(self, federation_client, margin=DEFAULT_MARGIN):
+        self.federation_client = federation_client
+        self.margin = margin
+        self.credentials = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def _get_cached(self, key, utcnow=None):
+        aws_credentials = self.credentials.get(key)
+        if aws_credentials is None or \
+                expires_within(aws_credentials, self.margin, utcnow):
+            return None
+        return aws_credentials
+
+    def get(self, account, role, utcnow=None):
+        key = (account, role)
+        aws_credentials = self._get_cached(key, utcnow)
+        if aws_credentials is not None:
+            return aws_credentials
+        with self.locks_lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            # Another thread may have fetched them in the meantime
+            aws_credentials = self._get_cached(key, utcnow)
+            if aws_credentials is None:
+                aws_credentials = self.federation_client.get_aws_credentials(
+                    account, role)
+                self.credentials[key] = aws_credentials
+            return aws_credentials
+
+
+def format_container_credentials(aws_credentials):
+    """Format aws credentials as returned by the ECS credentials endpoint"""
+    return json.dumps({
+        'AccessKeyId': aws_credentials['AWS_ACCESS_KEY_ID'],
+        'SecretAccessKey': aws_credentials['AWS_SECRET_ACCESS_KEY'],
+        'Token': aws_credentials['AWS_SESSION_TOKEN'],
+        'Expiration': aws_credentials['AWS_EXPIRATION_DATE'],
+    }, sort_keys=True)
+
+
+class MetadataRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def send_json(self, status_code, body):
+        body = body.encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status_code, message):
+        self.send_json(status_code, json.dumps(
+            {'code': self.responses[status_code][0], 'message': message}))
+
+    def do_GET(self):
+        token = self.headers.get('Authorization') or ''
+        if not hmac.compare_digest(token.encode('utf-8'),
+                                   self.server.token.encode('utf-8')):
+            self.send_error_json(401, 'Invalid authorization token')
+            return
+        path = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(path) != 2 or not all(path):
+            self.send_error_json(404, 'Use /<account>/<role>')
+            return
+        account, role = [unquote(part) for part in path]
+        try:
+            aws_credentials = self.server.credentials.get(account, role)
+        except Exception as exc:
+            self.send_error_json(502, str(exc))
+            return
+        self.send_json(200, format_container_credentials(aws_credentials))
+
+    def log_message(self, format, *args):
+        debug("{0} - {1}".format(self.address_string(), format % args))
+
+
+class MetadataServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, server_address, federation_client, token,
+                 margin=DEFAULT_MARGIN):
+        self.credentials = MemoryCredentialsCache(federation_client, margin)
+        self.token = token
+        BaseHTTPServer.HTTPServer.__init__(
+            self, server_address, MetadataRequestHandler)
+
+    def get_url(self, account='<account>', role='<role>'):
+        host, port = self.server_address[:2]
+        return 'http://{0}:{1}/{2}/{3}'.format(host, port, account, role)
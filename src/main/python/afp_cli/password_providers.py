@@ -3,6 +3,7 @@ from __future__ import print_function, absolute_import, division
 
 import getpass
 from .log import info, debug, CMDLineExit
+from .timing import timed
 
 try:
     import keyring
@@ -55,6 +56,7 @@ def keyring_get_password(username):
     return password
 
 
+@timed('password')
 def get_password(password_provider, username):
     if password_provider == PROMPT:
         password = prompt_get_password(username)
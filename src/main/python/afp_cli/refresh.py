@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Keep the credentials of an 'afp shell' session fresh.
+
+Instead of exporting static credentials, the subshell is pointed at a
+private aws credentials file. A watcher thread in the afp process that
+started the subshell fetches new credentials shortly before the current
+ones expire and replaces that file. So there is exactly one call to the
+AFP server per refresh, however many commands run in the subshell.
+"""
+from __future__ import print_function, absolute_import, division
+
+import calendar
+import os
+import threading
+import time
+from datetime import datetime
+
+from .aws_credentials_file import write_profiles
+from .cache import EXPIRATION_FORMAT
+from .fileutils import write_atomic
+from .log import debug
+
+# Seconds before their expiration at which credentials are refreshed
+REFRESH_MARGIN = 10 * 60
+# Seconds to wait before trying again after a failed refresh
+RETRY_DELAY = 60
+
+
+def get_expiration_timestamp(aws_credentials):
+    valid_until = datetime.strptime(aws_credentials['AWS_EXPIRATION_DATE'],
+                                    EXPIRATION_FORMAT)
+    return calendar.timegm(valid_until.timetuple())
+
+
+class CredentialsRefresher(object):
+    """
+    Publish credentials returned by fetch() in `directory` and fetch new
+    ones `margin` seconds before they expire.
+
+    The directory gets an aws credentials file named 'credentials' with
+    a 'default' profile and a file named 'expiration' with the Unix time
+    at which the credentials expire, e.g. for the shell prompt.
+    """
+
+    def __init__(self, fetch, aws_credentials, directory,
+                 margin=REFRESH_MARGIN, retry_delay=RETRY_DELAY):
+        self.fetch = fetch
+        self.credentials_filename = os.path.join(directory, 'credentials')
+        self.expiration_filename = os.path.join(directory, 'expiration')
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self.stopped = threading.Event()
+        self.thread = None
+        self.publish(aws_credentials)
+
+    def publish(self, aws_credentials):
+        self.expiration = get_expiration_timestamp(aws_credentials)
+        write_profiles({'default': aws_credentials},
+                       self.credentials_filename, quiet=True)
+        write_atomic(self.expiration_filename, str(self.expiration))
+
+    def get_delay(self, now=None):
+        """Return the seconds until the next refresh is due"""
+        now = now or time.time()
+        return max(0, self.expiration - self.margin - now)
+
+    def refresh(self):
+        """Fetch and publish new credentials, return whether that worked"""
+        try:
+            aws_credentials = self.fetch()
+            expiration = get_expiration_timestamp(aws_credentials)
+        except Exception as exc:
+            debug("Failed to refresh credentials: {0}".format(exc))
+            return False
+        if expiration <= self.expiration:
+            debug("Got no newer credentials, the old ones expire at "
+                  "{0}".format(self.expiration))
+            return False
+        self.publish(aws_credentials)
+        debug("Refreshed credentials, they expire at {0}".format(expiration))
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.get_delay()):
+            if not self.refresh():
+                self.stopped.wait(self.retry_delay)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Retrying failed requests to the AFP server without overwhelming it.
+
+RetryPolicy spaces retries with capped exponential backoff and random
+jitter, so that clients failing at the same moment do not all come back
+at the same moment. CircuitBreaker keeps its state in a file, so that
+all afp processes using a server stop sending it requests together
+while it recovers. CircuitBreakers hands out one of them per server.
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import random
+import time
+
+from .cache import get_cache_dir, get_key_digest
+from .exceptions import CircuitOpenError
+from .fileutils import LockError, file_lock, write_atomic
+from .log import debug
+
+# How often a failed request is repeated
+DEFAULT_RETRIES = 3
+# Seconds before the first retry, doubled for every further retry
+DEFAULT_BACKOFF = 0.5
+# Seconds no retry waits longer than
+DEFAULT_MAX_BACKOFF = 10
+# Statuses of a server which is overloaded or restarting
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+# Consecutive failures after which no more requests are sent ...
+DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 5
+# ... for this number of seconds
+DEFAULT_CIRCUIT_BREAKER_COOLDOWN = 30
+# Seconds to wait for another process updating the circuit breaker
+CIRCUIT_BREAKER_LOCK_TIMEOUT = 1
+
+
+class RetryPolicy(object):
+    """
+    Call a function again if it raised an exception worth retrying.
+
+    The n-th retry waits a random time between 0 and
+    min(max_backoff, backoff * 2 ** (n - 1)) seconds.
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, sleep=None, random_=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep or time.sleep
+        self.random = random_ or random.random
+
+    def get_delay(self, attempt):
+        """Return the seconds to wait after the given failed attempt"""
+        return self.random() * min(self.max_backoff,
+                                   self.backoff * 2 ** (attempt - 1))
+
+    def call(self, function, is_retryable, description='request',
+             retries=None):
+        """
+        Return function(), retrying up to `retries` times (by default
+        the retries of the policy) while is_retryable(exception).
+        """
+        retries = self.retries if retries is None else retries
+        attempt = 1
+        while True:
+            try:
+                result = function()
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                if attempt > retries:
+                    debug("Giving up on {0} after {1} attempts".format(
+                        description, attempt))
+                    raise
+                delay = self.get_delay(attempt)
+                debug("Attempt {0} of {1} to {2} failed: {3}, retrying in "
+                      "{4:.1f} seconds".format(attempt, retries + 1,
+                                               description, exc, delay))
+                self.sleep(delay)
+                attempt += 1
+            else:
+                if attempt > 1:
+                    debug("{0} succeeded after {1} attempts".format(
+                        description, attempt))
+                return result
+
+
+def get_circuit_breaker_filename(api_url, cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(),
+                        'circuit-' + get_key_digest(api_url))
+
+
+class CircuitBreaker(object):
+    """
+    Stop sending requests to a server which keeps failing.
+
+    After `threshold` consecutive failures, check() raises a
+    CircuitOpenError for `cooldown` seconds. Then a single process gets
+    to probe the server, which either closes the circuit again or
+    keeps it open for another `cooldown` seconds. The state lives in
+    `filename`, so it is shared by all processes using the server.
+    """
+
+    def __init__(self, filename, threshold=DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown=DEFAULT_CIRCUIT_BREAKER_COOLDOWN):
+        self.filename = filename
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def get_state(self):
+        try:
+            with open(self.filename) as state_file:
+                state = json.load(state_file)
+            return {'failures': int(state['failures']),
+                    'opened': state['opened'] and float(state['opened'])}
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return {'failures': 0, 'opened': None}
+
+    def update(self, change):
+        """
+        Replace the state by change(state) while holding the lock.
+
+        change() returns None to leave the state alone. Return the new
+        state, or None if the state was not changed.
+        """
+        try:
+            with file_lock(self.filename + '.lock',
+                           timeout=CIRCUIT_BREAKER_LOCK_TIMEOUT):
+                state = change(self.get_state())
+                if state is not None:
+                    write_atomic(self.filename, json.dumps(state))
+                return state
+        except (LockError, IOError, OSError) as exc:
+            debug("Failed to update circuit breaker '{0}': {1}".format(
+                self.filename, exc))
+            return None
+
+    def raise_if_open(self, state, now):
+        if state['opened'] is not None and \
+                now - state['opened'] < self.cooldown:
+            raise CircuitOpenError(
+                "The AFP server failed {0} times in a row, not sending "
+                "requests for another {1:.0f} seconds".format(
+                    state['failures'], state['opened'] + self.cooldown - now))
+
+    def check(self, now=None):
+        """Raise a CircuitOpenError unless requests may be sent"""
+        now = now or time.time()
+        state = self.get_state()
+        if state['opened'] is None:
+            return
+        self.raise_if_open(state, now)
+
+        def claim_probe(state):
+            if state['opened'] is None:
+                return None
+            # Another process may have claimed the probe in the meantime
+            self.raise_if_open(state, now)
+            debug("Probing the AFP server after a cooldown")
+            return dict(state, opened=now)
+
+        self.update(claim_probe)
+
+    def record_failure(self, now=None):
+        now = now or time.time()
+
+        def count_failure(state):
+            failures = state['failures'] + 1
+            opened = state['opened']
+            if failures >= self.threshold:
+                opened = now
+                debug("Opening circuit breaker after {0} failures".format(
+                    failures))
+            return {'failures': failures, 'opened': opened}
+
+        self.update(count_failure)
+
+    def record_success(self):
+        if self.get_state()['failures']:
+            self.update(lambda state: {'failures': 0, 'opened': None})
+
+
+class CircuitBreakers(object):
+    """
+    Hand out a separate CircuitBreaker for every server, so that a
+    failing server does not stop requests to the healthy ones.
+    """
+
+    def __init__(self, threshold=DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown=DEFAULT_CIRCUIT_BREAKER_COOLDOWN, cache_dir=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.cache_dir = cache_dir
+
+    def get(self, api_url):
+        return CircuitBreaker(
+            get_circuit_breaker_filename(api_url, self.cache_dir),
+            threshold=self.threshold, cooldown=self.cooldown)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy search over account and role names, see 'afp find'.
+
+Names are split into words and the words into trigrams, like
+PostgreSQL's pg_trgm does. The index maps every trigram to the accounts
+and roles having it. It is built from the completion index, and kept on
+disk until the completion index changes, so that searching neither needs
+the server nor a password. Like the completion index, there is one for
+every server and user.
+
+Every word of a query has to be found in either the account or the role
+of a pair. Pairs are ranked by how many trigrams of the query words they
+contain, and then by how few other trigrams their names have.
+
+A typo changes most trigrams of a short word, so short query words also
+find the words of names that are a single Damerau-Levenshtein edit
+away, e.g. 'tset' finds 'test'.
+"""
+from __future__ import absolute_import, division, print_function
+
+import heapq
+import json
+import os
+import re
+
+from .cache import get_completion_index_filename, get_search_index_filename
+from .completion import load_index as load_completion_index
+from .fileutils import write_atomic
+from .log import debug
+from .timing import timed
+
+# Changed whenever the index is built differently, to rebuild old ones
+INDEX_VERSION = 1
+# Share of the trigrams of a query word a name needs to have to match
+MIN_SIMILARITY = 0.3
+# Query words shorter than this also match words a single edit away
+SHORT_WORD = 6
+DEFAULT_LIMIT = 10
+
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def get_words(text):
+    return WORD.findall(text.lower())
+
+
+def get_trigrams(text):
+    """Return the trigrams of all words in text, padded like pg_trgm"""
+    trigrams = set()
+    for word in get_words(text):
+        padded = '  ' + word + ' '
+        trigrams.update(padded[start:start + 3]
+                        for start in range(len(padded) - 2))
+    return trigrams
+
+
+def is_one_edit_apart(word, other):
+    """
+    Return whether word turns into other by at most one insertion,
+    deletion, substitution or swap of adjacent letters
+    """
+    if abs(len(word) - len(other)) > 1:
+        return False
+    if len(word) > len(other):
+        word, other = other, word
+    for position, (letter, other_letter) in enumerate(zip(word, other)):
+        if letter != other_letter:
+            break
+    else:
+        return True
+    if len(word) < len(other):
+        return word[position:] == other[position + 1:]
+    rest = position + 1
+    if word[rest:] == other[rest:]:
+        return True
+    return (word[rest:rest + 1] == other[position] and
+            other[rest:rest + 1] == word[position] and
+            word[rest + 1:] == other[rest + 1:])
+
+
+def _index_names(names):
+    sizes, postings = [], {}
+    for number, name in enumerate(names):
+        trigrams = get_trigrams(name)
+        sizes.append(len(trigrams))
+        for trigram in trigrams:
+            postings.setdefault(trigram, []).append(number)
+    return sizes, postings
+
+
+def build_index(accounts_and_roles, source=None):
+    """
+    Return the index of accounts_and_roles as a dict which can be
+    serialized as JSON. `source` identifies the data it was built from.
+    """
+    accounts = sorted(account for account, roles in accounts_and_roles.items()
+                      if roles)
+    roles = sorted(set(role for account in accounts
+                       for role in accounts_and_roles[account]))
+    role_numbers = dict((role, number) for number, role in enumerate(roles))
+    account_sizes, account_trigrams = _index_names(accounts)
+    role_sizes, role_trigrams = _index_names(roles)
+    return {'version': INDEX_VERSION,
+            'source': source,
+            'accounts': accounts,
+            'account_sizes': account_sizes,
+            'account_trigrams': account_trigrams,
+            'account_roles': [sorted(role_numbers[role]
+                                     for role in accounts_and_roles[account])
+                              for account in accounts],
+            'roles': roles,
+            'role_sizes': role_sizes,
+            'role_trigrams': role_trigrams}
+
+
+def _get_similarities(word, names, postings, sizes):
+    """
+    Return {number: (share of trigrams found, Jaccard similarity)} of
+    all names which have at least MIN_SIMILARITY of the trigrams of word.
+    Names with a word a single edit away from a short word count as
+    having all but one of its letters.
+    """
+    trigrams = get_trigrams(word)
+    shared = {}
+    for trigram in trigrams:
+        for number in postings.get(trigram, ()):
+            shared[number] = shared.get(number, 0) + 1
+    similarities = {}
+    for number, count in shared.items():
+        similarity = count / len(trigrams)
+        if similarity >= MIN_SIMILARITY:
+            similarities[number] = (
+                similarity, count / (len(trigrams) + sizes[number] - count))
+    # A single letter is a single edit away from every other
+    if 1 < len(word) < SHORT_WORD:
+        similarity = (len(word) - 1) / len(word)
+        for number, name in enumerate(names):
+            if similarities.get(number, (0, 0))[0] >= similarity or \
+                    not any(is_one_edit_apart(word, other)
+                            for other in get_words(name)):
+                continue
+            count = shared.get(number, 0)
+            similarities[number] = (
+                similarity, count / (len(trigrams) + sizes[number] - count))
+    return similarities
+
+
+def search(index, query, limit=DEFAULT_LIMIT):
+    """Return up to `limit` (account, role) pairs matching query, best first"""
+    account_roles = index['account_roles']
+    matches = []
+    for word in get_words(query):
+        accounts = _get_similarities(word, index['accounts'],
+                                     index['account_trigrams'],
+                                     index['account_sizes'])
+        roles = _get_similarities(word, index['roles'], index['role_trigrams'],
+                                  index['role_sizes'])
+        matches.append((accounts, roles))
+    if not matches:
+        return []
+
+    candidates = None
+    for accounts, roles in matches:
+        found = set(accounts)
+        if roles:
+            role_numbers = set(roles)
+            found.update(account for account, numbers in
+                         enumerate(account_roles)
+                         if not role_numbers.isdisjoint(numbers))
+        candidates = found if candidates is None else candidates & found
+
+    no_match = (0, 0)
+    scored = []
+    for account in candidates:
+        account_scores = [accounts.get(account, no_match)
+                          for accounts, _ in matches]
+        role_numbers = account_roles[account]
+        # Words the account does not match have to match the role
+        missing = [roles for score, (_, roles)
+                   in zip(account_scores, matches) if not score[0]]
+        if missing:
+            role_numbers = set(role_numbers).intersection(*missing)
+        for role in role_numbers:
+            similarity = jaccard = 0
+            for account_score, (_, roles) in zip(account_scores, matches):
+                score = max(account_score, roles.get(role, no_match))
+                similarity += score[0]
+                jaccard += score[1]
+            scored.append((-similarity, -jaccard, account, role))
+    # Names are sorted, so their numbers break ties alphabetically
+    return [(index['accounts'][account], index['roles'][role])
+            for _, _, account, role in heapq.nsmallest(limit, scored)]
+
+
+@timed('search-index')
+def load_index(api_url, username, cache_dir=None):
+    """
+    Return the search index of username on api_url, rebuilt if the
+    completion index changed, or None if no account list was cached yet.
+    """
+    completion_filename = get_completion_index_filename(
+        api_url, username, cache_dir)
+    try:
+        source = os.path.getmtime(completion_filename)
+    except OSError:
+        return None
+    filename = get_search_index_filename(api_url, username, cache_dir)
+    try:
+        with open(filename) as index_file:
+            index = json.load(index_file)
+        if index.get('version') == INDEX_VERSION and \
+                index.get('source') == source:
+            return index
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+
+    completion_index = load_completion_index(completion_filename)
+    if completion_index is None:
+        return None
+    debug("Building search index from '{0}'".format(completion_filename))
+    index = build_index(completion_index['roles'], source)
+    try:
+        write_atomic(filename, json.dumps(index))
+    except (IOError, OSError) as exc:
+        debug("Failed to write search index to '{0}': {1}".format(
+            filename, exc))
+    return index
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Choosing between several AFP servers.
+
+ServerRanking remembers how fast each server answered in earlier runs,
+so that the fastest healthy server is asked first. race() sends a
+hedged request to a second server when the first one is slow.
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+import time
+
+from six.moves import queue
+
+from .cache import get_cache_dir, get_key_digest
+from .fileutils import LockError, file_lock, write_atomic
+from .log import debug
+
+# Weight of the latest measurement in the average latency of a server
+DEFAULT_SMOOTHING = 0.3
+# Seconds for which a failed server is only tried after all others
+DEFAULT_FAILURE_PENALTY = 60
+# Seconds to wait for another process updating the ranking
+RANKING_LOCK_TIMEOUT = 1
+
+
+def get_ranking_filename(api_url, cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(),
+                        'servers-' + get_key_digest(api_url))
+
+
+class ServerRanking(object):
+    """
+    Order servers by their average latency, measured over many runs.
+
+    Servers that have not been measured yet come first, so that every
+    server gets measured. Servers that failed within the last
+    `failure_penalty` seconds come last.
+    """
+
+    def __init__(self, filename, smoothing=DEFAULT_SMOOTHING,
+                 failure_penalty=DEFAULT_FAILURE_PENALTY):
+        self.filename = filename
+        self.smoothing = smoothing
+        self.failure_penalty = failure_penalty
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.filename) as ranking_file:
+                servers = json.load(ranking_file)
+            if not isinstance(servers, dict):
+                raise ValueError()
+            return servers
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def rank(self, api_urls, now=None):
+        """Return api_urls, best server first"""
+        now = now or time.time()
+        servers = self.load()
+
+        def get_key(api_url):
+            server = servers.get(api_url)
+            if not isinstance(server, dict):
+                return False, 0
+            failed = server.get('failed') or 0
+            return (now - failed < self.failure_penalty,
+                    server.get('latency') or 0)
+
+        return sorted(api_urls, key=get_key)
+
+    def update(self, api_url, change):
+        with self.lock:
+            try:
+                with file_lock(self.filename + '.lock',
+                               timeout=RANKING_LOCK_TIMEOUT):
+                    servers = self.load()
+                    server = servers.get(api_url)
+                    servers[api_url] = change(
+                        server if isinstance(server, dict) else {})
+                    write_atomic(self.filename, json.dumps(servers))
+            except (LockError, IOError, OSError) as exc:
+                debug("Failed to update server ranking '{0}': {1}".format(
+                    self.filename, exc))
+
+    def record(self, api_url, latency):
+        """Add a successful request which took latency seconds"""
+        def add_latency(server):
+            average = server.get('latency')
+            if average is None:
+                average = latency
+            return {'latency': average + self.smoothing * (latency - average),
+                    'failed': None}
+
+        self.update(api_url, add_latency)
+
+    def record_failure(self, api_url, now=None):
+        now = now or time.time()
+        self.update(api_url, lambda server: dict(server, failed=now))
+
+
+def race(functions, hedge_after=None, is_retryable=None):
+    """
+    Return the result of the first of `functions` that succeeds.
+
+    functions[0] is called right away. functions[1] is only called if
+    functions[0] has not returned after `hedge_after` seconds, or
+    failed with an exception for which is_retryable(exception) is true.
+    Other exceptions and the exception of the last failing function are
+    raised. Calls which lose the race are left running in the
+    background.
+    """
+    if len(functions) == 1:
+        return functions[0]()
+    results = queue.Queue()
+
+    def run(function):
+        try:
+            results.put((function(), None))
+        except Exception as exc:
+            results.put((None, exc))
+
+    def start(function):
+        thread = threading.Thread(target=run, args=(function,))
+        thread.daemon = True
+        thread.start()
+
+    pending = list(functions)
+    start(pending.pop(0))
+    running = 1
+    while True:
+        try:
+            result, exc = results.get(timeout=hedge_after if pending else None)
+        except queue.Empty:
+            debug("No answer after {0} seconds, sending a hedged "
+                  "request".format(hedge_after))
+            start(pending.pop(0))
+            running += 1
+            continue
+        running -= 1
+        if exc is None:
+            return result
+        if is_retryable is not None and not is_retryable(exc):
+            raise exc
+        if pending:
+            start(pending.pop(0))
+            running += 1
+        elif not running:
+            raise exc
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Measuring where an afp invocation spends its time.
+
+Functions decorated with timed() and blocks wrapped in phase() add up
+their time per phase, e.g. 'config', 'dns' or 'http', once start() was
+called. report() prints the phases to stderr and/or appends them as a
+JSON line to a file, depending on --timing and the AFP_TIMING
+environment variable.
+"""
+from __future__ import absolute_import, division, print_function
+
+import functools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .compat import OrderedDict
+from .log import debug
+
+# '1' to print the phases to stderr, or a file to append JSON lines to
+TIMING_ENV = 'AFP_TIMING'
+STDERR = '-'
+STDERR_VALUES = ('1', 'true', 'yes', '-', 'stderr')
+
+# time.monotonic() is not there in Python 2
+_clock = getattr(time, 'monotonic', time.time)
+
+_timer = None
+
+
+class PhaseTimer(object):
+    """
+    Add up the seconds spent in each phase of an invocation.
+
+    Phases of concurrent threads add up as well, so with concurrent
+    requests the phases can take longer than the whole invocation.
+    """
+
+    def __init__(self, targets=None, clock=None):
+        self.targets = list(targets or [])
+        self.clock = clock or _clock
+        self.start = self.clock()
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.counts = {}
+        self.details = OrderedDict()
+        self.lock = threading.Lock()
+        self.reported = False
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start)
+
+    def get_record(self):
+        """Return the phases of the invocation so far as a dict"""
+        total = self.clock() - self.start
+        with self.lock:
+            phases = OrderedDict(
+                (name, {'seconds': round(seconds, 6),
+                        'count': self.counts[name]})
+                for name, seconds in self.phases.items())
+            other = total - sum(self.phases.values())
+        record = OrderedDict([('time', round(self.started, 3)),
+                              ('host', socket.gethostname()),
+                              ('pid', os.getpid())])
+        record.update(self.details)
+        record['total'] = round(total, 6)
+        record['other'] = round(max(other, 0), 6)
+        record['phases'] = phases
+        return record
+
+    def format(self, record):
+        lines = ["afp timing: {0:.0f} ms in total".format(
+            record['total'] * 1000)]
+        items = list(record['phases'].items()) + [
+            ('other', {'seconds': record['other'], 'count': None})]
+        for name, phase in items:
+            lines.append("  {0:<18}{1:>8.0f} ms{2}".format(
+                name, phase['seconds'] * 1000,
+                " ({0}x)".format(phase['count'])
+                if phase['count'] and phase['count'] > 1 else ""))
+        return "\n".join(lines)
+
+    def report(self):
+        """Write the record to all targets, only the first time"""
+        if self.reported or not self.targets:
+            return
+        self.reported = True
+        record = self.get_record()
+        for target in self.targets:
+            if target == STDERR:
+                print(self.format(record), file=sys.stderr)
+                continue
+            try:
+                with open(target, 'a') as timing_file:
+                    timing_file.write(json.dumps(record) + "\n")
+            except (IOError, OSError) as exc:
+                debug("Failed to write timing to '{0}': {1}".format(
+                    target, exc))
+
+
+def get_targets(environ=None):
+    """Return where AFP_TIMING asks to report to"""
+    value = (environ if environ is not None else os.environ).get(
+        TIMING_ENV, '').strip()
+    if not value or value.lower() in ('0', 'false', 'no'):
+        return []
+    if value.lower() in STDERR_VALUES:
+        return [STDERR]
+    return [os.path.expanduser(value)]
+
+
+def start(environ=None, clock=None):
+    """Start timing the invocation, return the timer"""
+    global _timer
+    _timer = PhaseTimer(get_targets(environ), clock)
+    return _timer
+
+
+def stop():
+    global _timer
+    _timer = None
+
+
+def get_timer():
+    return _timer
+
+
+def report_to_stderr():
+    """Also report to stderr, as asked for by --timing"""
+    if _timer is not None and STDERR not in _timer.targets:
+        _timer.targets.append(STDERR)
+
+
+def set_detail(name, value):
+    """Add e.g. the subcommand to the record of the invocation"""
+    if _timer is not None:
+        _timer.details[name] = value
+
+
+def report():
+    if _timer is not None:
+        _timer.report()
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the phase `name`"""
+    timer = _timer
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+
+def timed(name):
+    """Add the time spent in the decorated function to the phase `name`"""
+    def decorate(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
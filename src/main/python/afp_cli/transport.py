@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Connection settings of the requests session used to talk to AFP.
+
+The adapter mounted by configure_session() keeps track of how long
+setting up connections takes, so that the time of every request can be
+split into connect, TLS handshake and server processing. It can also
+resume TLS sessions, so that only the first connection of a process to
+a server pays for a full handshake.
+"""
+from __future__ import absolute_import, division, print_function
+
+import ssl
+import threading
+import time
+import weakref
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import (HTTPConnection,
+                                                  HTTPSConnection)
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from requests.packages.urllib3.util.ssl_ import create_urllib3_context
+
+from .log import debug
+
+# Seconds to wait for a connection to the AFP server
+DEFAULT_CONNECT_TIMEOUT = 10
+# Seconds to wait for the AFP server to answer, it may have to ask AWS
+DEFAULT_READ_TIMEOUT = 30
+# Connections kept open per server, matches the default number of workers
+DEFAULT_POOL_SIZE = 10
+
+_timings = threading.local()
+
+
+def _record(phase, seconds):
+    timings = getattr(_timings, 'current', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + seconds
+
+
+class _TimingConnectionMixin(object):
+    """Record how long connecting and the TLS handshake take"""
+
+    def _new_conn(self):
+        start = time.time()
+        try:
+            return super(_TimingConnectionMixin, self)._new_conn()
+        finally:
+            _record('connect', time.time() - start)
+
+    def connect(self):
+        start = time.time()
+        try:
+            return super(_TimingConnectionMixin, self).connect()
+        finally:
+            _record('established', time.time() - start)
+
+
+class _TimingHTTPConnection(_TimingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimingHTTPSConnection(_TimingConnectionMixin, HTTPSConnection):
+    def connect(self):
+        contexts = getattr(self.ssl_context, 'resuming_contexts', None)
+        if contexts is not None:
+            self.ssl_context = contexts.get(self)
+        super(_TimingHTTPSConnection, self).connect()
+
+    def close(self):
+        session_cache = getattr(self.ssl_context, 'tls_session_cache', None)
+        if session_cache is not None and self.sock is not None:
+            # The session is gone with the socket, and with TLS 1.3 it
+            # only becomes resumable some time after the handshake.
+            session_cache.remember(self.sock)
+        super(_TimingHTTPSConnection, self).close()
+
+
+class _TimingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimingHTTPConnection
+
+
+class _TimingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimingHTTPSConnection
+
+
+class TLSSessionCache(object):
+    """
+    Hand the TLS session of the latest connection to a host to the
+    next connection to the same host.
+
+    Sessions are taken from the connection as late as possible, since
+    with TLS 1.3 the server sends them only after the handshake.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+
+    def get(self, host):
+        with self.lock:
+            ssl_socket_ref, session = self.latest.get(host, (None, None))
+        ssl_socket = ssl_socket_ref and ssl_socket_ref()
+        try:
+            return (ssl_socket and ssl_socket.session) or session
+        except (ValueError, ssl.SSLError):
+            return session
+
+    def remember(self, ssl_socket):
+        try:
+            host, session = ssl_socket.server_hostname, ssl_socket.session
+        except (AttributeError, ValueError, ssl.SSLError):
+            return
+        with self.lock:
+            session = session or self.latest.get(host, (None, None))[1]
+            self.latest[host] = (weakref.ref(ssl_socket), session)
+
+    def wrap_socket(self, wrap_socket, sock, *args, **kwargs):
+        host = kwargs.get('server_hostname')
+        session = self.get(host)
+        if session is not None:
+            kwargs['session'] = session
+        ssl_socket = wrap_socket(sock, *args, **kwargs)
+        debug("TLS connection to {0}: {1}".format(
+            host, 'resumed session' if ssl_socket.session_reused
+            else 'full handshake'))
+        self.remember(ssl_socket)
+        return ssl_socket
+
+
+def is_tls_resumption_supported():
+    return hasattr(ssl, 'SSLSession')
+
+
+def _create_session_caching_context():
+    context = create_urllib3_context()
+    # urllib3 checks hostnames itself, also for resumed sessions
+    context.check_hostname = False
+    context.tls_session_cache = session_cache = TLSSessionCache()
+    wrap_socket = context.wrap_socket
+
+    def resuming_wrap_socket(sock, *args, **kwargs):
+        return session_cache.wrap_socket(wrap_socket, sock, *args, **kwargs)
+
+    context.wrap_socket = resuming_wrap_socket
+    return context
+
+
+class ResumingSSLContexts(object):
+    """
+    One session caching SSL context per way of verifying certificates.
+
+    urllib3 sets the verify mode and loads the CA certificates of a
+    connection into its SSL context, and a resumed session is not
+    verified again. So connections which verify differently share
+    neither contexts nor sessions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contexts = {}
+
+    def get(self, connection):
+        key = tuple(getattr(connection, name, None) for name in
+                    ['cert_reqs', 'ca_certs', 'ca_cert_dir', 'ca_cert_data'])
+        with self.lock:
+            if key not in self.contexts:
+                self.contexts[key] = _create_session_caching_context()
+            return self.contexts[key]
+
+
+def create_resuming_ssl_context():
+    """
+    Return an SSL context for connection pools whose connections resume
+    TLS sessions of earlier connections which verified certificates the
+    same way, or None if the ssl module can not do that.
+    """
+    if not is_tls_resumption_supported():
+        return None
+    context = create_urllib3_context()
+    context.resuming_contexts = ResumingSSLContexts()
+    return context
+
+
+class TimingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections report to RequestTimer and share
+    `ssl_context`, if given.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.ssl_context = kwargs.pop('ssl_context', None)
+        super(TimingHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        super(TimingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimingHTTPConnectionPool,
+            'https': _TimingHTTPSConnectionPool}
+
+
+class RequestTimer(object):
+    """
+    Measure the phases of the requests sent in the with block.
+
+    Only requests sent by the current thread through a TimingHTTPAdapter
+    are measured. Requests on a kept-alive connection spend no time on
+    connect and TLS.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.start = self.end = None
+
+    def __enter__(self):
+        _timings.current = self.timings
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.time()
+        _timings.current = None
+
+    def get_phases(self, elapsed=None):
+        """
+        Return (connect, tls, server, transfer) in seconds.
+
+        `elapsed` is the time until the response headers arrived, as in
+        requests' Response.elapsed. Without it, everything after the
+        connection is set up counts as server processing.
+        """
+        total = self.end - self.start
+        connect = self.timings.get('connect', 0)
+        tls = max(self.timings.get('established', connect) - connect, 0)
+        if elapsed is None:
+            elapsed = total
+        server = max(elapsed - connect - tls, 0)
+        transfer = max(total - elapsed, 0)
+        return connect, tls, server, transfer
+
+    def format(self, elapsed=None):
+        total = self.end - self.start
+        return "{0:.0f} ms (connect {1:.0f} ms, tls {2:.0f} ms, " \
+            "server {3:.0f} ms, transfer {4:.0f} ms)".format(
+                total * 1000,
+                *[seconds * 1000 for seconds in self.get_phases(elapsed)])
+
+
+def configure_session(session, pool_size=DEFAULT_POOL_SIZE, keep_alive=True,
+                      ssl_context=None):
+    """Mount adapters with pool_size connections per server on session"""
+    adapter = TimingHTTPAdapter(pool_maxsize=pool_size,
+                                ssl_context=ssl_context)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
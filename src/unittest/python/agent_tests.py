@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import Mock, patch
+from unittest2 import TestCase, skipUnless
+
+from afp_cli import agent
+from afp_cli.agent import AgentClient, AgentServer, get_agent_client
+from afp_cli.client import APICallError
+
+
+@skipUnless(agent.is_supported(), 'Unix domain sockets only')
+class AgentTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tempdir, 'agent.sock')
+        self.federation_client = Mock()
+        self.server = AgentServer(self.socket_path, self.federation_client)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.agent_client = AgentClient(self.socket_path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tempdir)
+
+    def test_get_account_and_role_list(self):
+        self.federation_client.get_account_and_role_list.return_value = \
+            {'testaccount': ['testrole']}
+        self.assertEqual(self.agent_client.get_account_and_role_list(),
+                         {'testaccount': ['testrole']})
+
+    def test_get_aws_credentials(self):
+        self.federation_client.get_aws_credentials.return_value = \
+            {'AWS_ACCESS_KEY_ID': 'testAccessKey'}
+        self.assertEqual(
+            self.agent_client.get_aws_credentials('testaccount', 'testrole'),
+            {'AWS_ACCESS_KEY_ID': 'testAccessKey'})
+        self.federation_client.get_aws_credentials.assert_called_once_with(
+            'testaccount', 'testrole')
+
+    def test_get_aws_credentials_without_cache(self):
+        self.federation_client.fetch_aws_credentials.return_value = \
+            {'AWS_ACCESS_KEY_ID': 'freshAccessKey'}
+        agent_client = AgentClient(self.socket_path, no_cache=True)
+        self.assertEqual(
+            agent_client.get_aws_credentials('testaccount', 'testrole'),
+            {'AWS_ACCESS_KEY_ID': 'freshAccessKey'})
+        self.federation_client.fetch_aws_credentials.assert_called_once_with(
+            'testaccount', 'testrole')
+        self.assertFalse(self.federation_client.get_aws_credentials.called)
+
+    def test_errors_are_raised_as_api_call_errors(self):
+        self.federation_client.get_aws_credentials.side_effect = \
+            APICallError('Access denied')
+        with self.assertRaises(APICallError) as cm:
+            self.agent_client.get_aws_credentials('testaccount', 'testrole')
+        self.assertEqual(str(cm.exception), 'Access denied')
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+
+    def test_get_agent_client_finds_running_agent(self):
+        with patch('afp_cli.agent.get_socket_path',
+                   return_value=self.socket_path):
+            agent_client = get_agent_client('url', 'user', no_cache=True)
+        self.assertEqual(agent_client.socket_path, self.socket_path)
+        self.assertTrue(agent_client.no_cache)
+
+
+@skipUnless(agent.is_supported(), 'Unix domain sockets only')
+class GetAgentClientTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tempdir, 'agent.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_returns_none_without_socket(self):
+        with patch('afp_cli.agent.get_socket_path',
+                   return_value=self.socket_path):
+            self.assertIsNone(get_agent_client('url', 'user'))
+
+    def test_returns_none_for_stale_socket(self):
+        # A socket file without a listening process behind it
+        AgentServer(self.socket_path, Mock()).socket.close()
+        with patch('afp_cli.agent.get_socket_path',
+                   return_value=self.socket_path):
+            self.assertIsNone(get_agent_client('url', 'user'))
+
+    def test_socket_path_depends_on_url_and_user(self):
+        self.assertNotEqual(agent.get_socket_path('url', 'user'),
+                            agent.get_socket_path('url', 'other_user'))
+        self.assertNotEqual(agent.get_socket_path('url', 'user'),
+                            agent.get_socket_path('other_url', 'user'))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import sys
+
+from mock import Mock, patch
+from unittest2 import TestCase, skipUnless
+
+from afp_cli.client import USER_AGENT, APICallError
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from afp_cli.async_client import AsyncAWSFederationClient
+
+
+class ClientError(Exception):
+    """Stands in for aiohttp.ClientError"""
+
+
+CREDENTIALS_RESPONSE = ('{"Code": "Success", '
+                        '"AccessKeyId": "testAccessKey", '
+                        '"SecretAccessKey": "testSecretAccessKey", '
+                        '"Token": "testToken", '
+                        '"Expiration": "2015-01-01T12:34:56Z"}')
+
+
+@skipUnless(sys.version_info >= (3, 5), 'async/await needs Python 3.5')
+class AsyncAWSFederationClientTest(TestCase):
+    def setUp(self):
+        self.patch_aiohttp = patch('afp_cli.async_client.aiohttp')
+        self.mock_aiohttp = self.patch_aiohttp.start()
+        self.mock_aiohttp.ClientError = ClientError
+        self.mock_aiohttp.BasicAuth.return_value.encode.return_value = \
+            'Basic dXNlcjpzZWNyZXQ='
+        self.loop = asyncio.new_event_loop()
+        self.session = Mock()
+        self.running = 0
+        self.max_running = 0
+        self.respond(200, CREDENTIALS_RESPONSE)
+        self.client = AsyncAWSFederationClient(
+            api_url='http://afp', session=self.session)
+
+    def tearDown(self):
+        self.loop.close()
+        self.patch_aiohttp.stop()
+
+    def resolved(self, value, delay=None):
+        future = self.loop.create_future()
+        if delay is None:
+            future.set_result(value)
+        else:
+            self.loop.call_later(delay, future.set_result, value)
+        return future
+
+    def respond(self, status, text, reason='Ok', delay=None):
+        def get(url, **kwargs):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+            def text_():
+                self.running -= 1
+                return self.resolved(text)
+            response = Mock(status=status, reason=reason, text=text_)
+            return self.resolved(response, delay)
+        self.session.get.side_effect = get
+
+    def wait_for(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def fail(self, exc):
+        def get(url, **kwargs):
+            future = self.loop.create_future()
+            future.set_exception(exc)
+            return future
+        self.session.get.side_effect = get
+
+    def assert_requested(self, url):
+        self.session.get.assert_called_once_with(
+            url, headers={'User-Agent': USER_AGENT,
+                          'Authorization': 'Basic dXNlcjpzZWNyZXQ='},
+            timeout=self.mock_aiohttp.ClientTimeout.return_value)
+
+    def test_get_account_and_role_list(self):
+        self.respond(200, '{"testaccount": ["testrole"]}')
+        result = self.wait_for(self.client.get_account_and_role_list())
+        self.assertEqual(result, {"testaccount": ["testrole"]})
+        self.assert_requested('http://afp/account')
+
+    def test_get_aws_credentials(self):
+        result = self.wait_for(self.client.get_aws_credentials(
+            'test account', 'testrole'))
+        self.assertEqual(result['AWS_ACCESS_KEY_ID'], 'testAccessKey')
+        self.assertEqual(result['AWS_SECURITY_TOKEN'], 'testToken')
+        self.assert_requested('http://afp/account/test%20account/testrole')
+
+    def test_aiohttp_is_needed_even_with_given_session(self):
+        with patch('afp_cli.async_client.aiohttp', None):
+            self.assertRaises(ImportError, AsyncAWSFederationClient,
+                              api_url='http://afp', session=self.session)
+
+    def test_given_session_gets_credentials_and_timeouts(self):
+        client = AsyncAWSFederationClient(
+            api_url='http://afp', username='user', password='secret',
+            session=self.session, connect_timeout=2, read_timeout=5)
+        self.wait_for(client.get_account_and_role_list())
+        self.mock_aiohttp.BasicAuth.assert_called_with('user', 'secret')
+        self.mock_aiohttp.ClientTimeout.assert_called_once_with(
+            sock_connect=2, sock_read=5)
+
+    def test_errors_are_api_call_errors(self):
+        self.respond(403, '{"message": "Access denied"}', reason='Forbidden')
+        with self.assertRaises(APICallError) as cm:
+            self.wait_for(self.client.get_aws_credentials('account', 'role'))
+        self.assertEqual(cm.exception.status_code, 403)
+        self.assertIn('Access denied', str(cm.exception))
+
+    def test_timeouts_are_api_call_errors(self):
+        self.fail(asyncio.TimeoutError())
+        with self.assertRaises(APICallError) as cm:
+            self.wait_for(self.client.get_account_and_role_list())
+        self.assertEqual(str(cm.exception),
+                         'API call to AWS (http://afp/account) failed: '
+                         'timed out')
+        self.assertIsNone(cm.exception.status_code)
+
+    def test_connection_errors_are_api_call_errors(self):
+        self.fail(ClientError('Connection refused'))
+        with self.assertRaises(APICallError) as cm:
+            self.wait_for(self.client.get_account_and_role_list())
+        self.assertEqual(str(cm.exception),
+                         'API call to AWS (http://afp/account) failed: '
+                         'Connection refused')
+
+    def test_unauthorized_is_reported_with_reason(self):
+        self.respond(401, '<html>', reason='Unauthorized')
+        with self.assertRaises(APICallError) as cm:
+            self.wait_for(self.client.get_account_and_role_list())
+        self.assertIn('401 Unauthorized', str(cm.exception))
+
+    def test_fetch_all_is_bounded_and_keeps_order(self):
+        self.respond(200, CREDENTIALS_RESPONSE, delay=0.01)
+        pairs = [('account%d' % i, 'role') for i in range(10)]
+        results = self.wait_for(
+            self.client.fetch_all(pairs + pairs[:2], workers=3))
+        self.assertEqual([(r.account, r.role) for r in results], pairs)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(self.session.get.call_count, 10)
+        self.assertGreater(self.max_running, 1)
+        self.assertLessEqual(self.max_running, 3)
+
+    def test_fetch_all_reports_failures(self):
+        self.respond(500, '{"message": "boom"}')
+        results = self.wait_for(self.client.fetch_all([('a', 'r')]))
+        self.assertIn('boom', results[0].error)
+
+    def test_given_session_is_not_closed(self):
+        self.wait_for(self.client.close())
+        self.session.close.assert_not_called()
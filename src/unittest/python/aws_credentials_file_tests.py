@@ -1,18 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from unittest2 import TestCase
+from mock import patch
+from unittest2 import TestCase, skipUnless
 from afp_cli import aws_credentials_file
+from afp_cli.compat import OrderedDict
 import tempfile
+import threading
 import shutil
+import stat
 import os
 
 
 class AwsCredentialsFileTest(TestCase):
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.patch_cache_dir = patch(
+            'afp_cli.aws_credentials_file.get_cache_dir',
+            return_value=self.cache_dir)
+        self.patch_cache_dir.start()
 
     def tearDown(self):
+        self.patch_cache_dir.stop()
         shutil.rmtree(self.tempdir)
 
     def test_write_default_profile_to_new_file(self):
@@ -174,3 +184,105 @@ class AwsCredentialsFileTest(TestCase):
             'aws_session_token = Token\n'
             'aws_security_token = Token\n\n'
         ))
+
+    def test_write_profiles(self):
+        credentials_filename = os.path.join(self.tempdir, 'credentials')
+        with open(credentials_filename, "w") as credentials_file:
+            credentials_file.write((
+                '[default]\n'
+                'aws_access_key_id = defaultAccessKeyId\n'
+                'aws_secret_access_key = defaultSecretAccessKey\n'
+                'aws_session_token = defaultToken\n'
+                'aws_security_token = defaultToken\n\n'
+            ))
+
+        aws_credentials_file.write_profiles(OrderedDict([
+            ('first', {
+                'AWS_ACCESS_KEY_ID': 'firstAccessKeyId',
+                'AWS_SECRET_ACCESS_KEY': 'firstSecretAccessKey',
+                'AWS_SESSION_TOKEN': 'firstToken',
+                'AWS_SECURITY_TOKEN': 'firstToken'}),
+            ('second', {
+                'AWS_ACCESS_KEY_ID': 'secondAccessKeyId',
+                'AWS_SECRET_ACCESS_KEY': 'secondSecretAccessKey',
+                'AWS_SESSION_TOKEN': 'secondToken',
+                'AWS_SECURITY_TOKEN': 'secondToken'}),
+        ]), credentials_filename)
+
+        self.assertEqual(open(credentials_filename).read(), (
+            '[default]\n'
+            'aws_access_key_id = defaultAccessKeyId\n'
+            'aws_secret_access_key = defaultSecretAccessKey\n'
+            'aws_session_token = defaultToken\n'
+            'aws_security_token = defaultToken\n\n'
+            '[first]\n'
+            'aws_access_key_id = firstAccessKeyId\n'
+            'aws_secret_access_key = firstSecretAccessKey\n'
+            'aws_session_token = firstToken\n'
+            'aws_security_token = firstToken\n\n'
+            '[second]\n'
+            'aws_access_key_id = secondAccessKeyId\n'
+            'aws_secret_access_key = secondSecretAccessKey\n'
+            'aws_session_token = secondToken\n'
+            'aws_security_token = secondToken\n\n'
+        ))
+
+    def test_concurrent_writers_keep_all_profiles(self):
+        credentials_filename = os.path.join(self.tempdir, 'credentials')
+
+        def write_profile(name):
+            aws_credentials_file.write({
+                'AWS_ACCESS_KEY_ID': name,
+                'AWS_SECRET_ACCESS_KEY': name,
+                'AWS_SESSION_TOKEN': name,
+                'AWS_SECURITY_TOKEN': name,
+            }, credentials_filename, name)
+
+        threads = [threading.Thread(target=write_profile,
+                                    args=('profile%d' % i,))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        content = open(credentials_filename).read()
+        for i in range(10):
+            self.assertIn('[profile%d]' % i, content)
+
+    def test_lock_file_is_kept_in_cache_dir(self):
+        credentials_filename = os.path.join(self.tempdir, 'aws', 'credentials')
+        aws_credentials_file.write({
+            'AWS_ACCESS_KEY_ID': 'AccessKeyId',
+            'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+            'AWS_SESSION_TOKEN': 'Token',
+            'AWS_SECURITY_TOKEN': 'Token',
+        }, credentials_filename)
+
+        self.assertEqual(os.listdir(os.path.dirname(credentials_filename)),
+                         ['credentials'])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    @skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_write_to_symlink_replaces_its_target(self):
+        target_filename = os.path.join(self.tempdir, 'shared', 'credentials')
+        os.makedirs(os.path.dirname(target_filename))
+        with open(target_filename, "w") as credentials_file:
+            credentials_file.write('[other]\naws_access_key_id = other\n\n')
+        os.chmod(target_filename, 0o640)
+        credentials_filename = os.path.join(self.tempdir, 'credentials')
+        os.symlink(target_filename, credentials_filename)
+
+        aws_credentials_file.write({
+            'AWS_ACCESS_KEY_ID': 'AccessKeyId',
+            'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+            'AWS_SESSION_TOKEN': 'Token',
+            'AWS_SECURITY_TOKEN': 'Token',
+        }, credentials_filename)
+
+        self.assertTrue(os.path.islink(credentials_filename))
+        content = open(target_filename).read()
+        self.assertIn('[other]', content)
+        self.assertIn('aws_access_key_id = AccessKeyId', content)
+        self.assertEqual(stat.S_IMODE(os.stat(target_filename).st_mode),
+                         0o640)
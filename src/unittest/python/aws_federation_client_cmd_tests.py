@@ -2,14 +2,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import, division
 
+import shutil
+import tempfile
+
+import requests
 from mock import patch, Mock
 from unittest2 import TestCase
 from afp_cli import AWSFederationClientCmd
+from afp_cli.cache import AccountListCache, CredentialsCache
+from afp_cli.client import APICallError
+from afp_cli.exceptions import CircuitOpenError
+from afp_cli.retry import RetryPolicy
 
 
 class AWSFederationClientCmdTest(TestCase):
     def setUp(self):
-        self.api_client = AWSFederationClientCmd()
+        self.api_client = AWSFederationClientCmd(
+            retry_policy=RetryPolicy(sleep=Mock()))
 
     def test_get_correct_account_and_role_list(self):
         expected_result = Mock(text='{"testaccount": ["testrole"]}',
@@ -38,3 +47,219 @@ class AWSFederationClientCmdTest(TestCase):
                 "AWS_SECURITY_TOKEN": "testToken",
                 "AWS_EXPIRATION_DATE": "2015-01-01T12:34:56Z"},
                 msg='Should be the same')
+
+    def test_get_aws_credentials_uses_cache(self):
+        cached_credentials = {'AWS_ACCESS_KEY_ID': 'cachedAccessKey',
+                              'AWS_EXPIRATION_DATE': '2099-01-01T00:00:00Z'}
+        self.api_client.credentials_cache = self.make_credentials_cache()
+        self.api_client.credentials_cache.put(
+            None, '', "testaccount", "testrole", cached_credentials)
+        with patch.object(self.api_client.session, 'get') as mock_get:
+            result = self.api_client.get_aws_credentials("testaccount", "testrole")
+        self.assertEqual(result, cached_credentials)
+        mock_get.assert_not_called()
+
+    def test_get_aws_credentials_populates_cache_on_miss(self):
+        expected_result = Mock(
+            text='{"Code": "Success", '
+            '"AccessKeyId": "testAccessKey", '
+            '"SecretAccessKey": "testSecretAccessKey", '
+            '"Token": "testToken", '
+            '"Expiration": "2099-01-01T12:34:56Z"}',
+            status_code=200,
+            reason="Ok")
+        self.api_client.credentials_cache = self.make_credentials_cache()
+        with patch.object(self.api_client.session, 'get', return_value=expected_result):
+            result = self.api_client.get_aws_credentials("testaccount", "testrole")
+        self.assertEqual(
+            self.api_client.credentials_cache.get(
+                None, '', "testaccount", "testrole"),
+            result)
+
+    def test_requests_use_timeouts(self):
+        response = Mock(text='{}', status_code=200)
+        with patch.object(self.api_client.session, 'get',
+                          return_value=response) as mock_get:
+            self.api_client.get_account_and_role_list()
+        self.assertEqual(mock_get.call_args[1]['timeout'], (10, 30))
+
+    def test_connection_settings_are_configurable(self):
+        api_client = AWSFederationClientCmd(
+            connect_timeout=1, read_timeout=2, pool_size=3, keep_alive=False)
+        self.assertEqual(api_client.timeout, (1, 2))
+        self.assertEqual(
+            api_client.session.get_adapter('https://afp')._pool_maxsize, 3)
+        self.assertEqual(api_client.session.headers['Connection'], 'close')
+
+    def test_resizing_never_shrinks_connection_pool(self):
+        api_client = AWSFederationClientCmd(pool_size=20)
+        api_client.resize_connection_pool(5)
+        self.assertEqual(api_client.pool_size, 20)
+        api_client.resize_connection_pool(50)
+        self.assertEqual(
+            api_client.session.get_adapter('https://afp')._pool_maxsize, 50)
+
+    def test_overloaded_server_is_retried(self):
+        responses = [Mock(status_code=503, reason='Unavailable', text=''),
+                     Mock(text='{}', status_code=200)]
+        self.api_client.circuit_breakers = Mock()
+        breaker = self.api_client.circuit_breakers.get.return_value
+        with patch.object(self.api_client.session, 'get',
+                          side_effect=responses) as mock_get:
+            self.assertEqual(self.api_client.get_account_and_role_list(), {})
+        self.assertEqual(mock_get.call_count, 2)
+        breaker.record_failure.assert_called_once_with()
+        breaker.record_success.assert_called_once_with()
+
+    def test_client_errors_are_not_retried(self):
+        response = Mock(status_code=404, reason='Not Found', text='')
+        with patch.object(self.api_client.session, 'get',
+                          return_value=response) as mock_get:
+            self.assertRaises(APICallError,
+                              self.api_client.get_account_and_role_list)
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_timeouts_are_retried_and_counted(self):
+        self.api_client.circuit_breakers = Mock()
+        breaker = self.api_client.circuit_breakers.get.return_value
+        with patch.object(self.api_client.session, 'get',
+                          side_effect=requests.Timeout()) as mock_get:
+            self.assertRaises(requests.Timeout,
+                              self.api_client.get_account_and_role_list)
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertEqual(breaker.record_failure.call_count, 4)
+
+    def test_open_circuit_breaker_stops_requests(self):
+        self.api_client.circuit_breakers = Mock()
+        self.api_client.circuit_breakers.get.return_value.check.side_effect = \
+            CircuitOpenError('open')
+        with patch.object(self.api_client.session, 'get') as mock_get:
+            self.assertRaises(CircuitOpenError,
+                              self.api_client.get_account_and_role_list)
+        mock_get.assert_not_called()
+
+    def test_fails_over_to_next_server(self):
+        ranking = Mock()
+        ranking.rank.return_value = ['https://b', 'https://a']
+        api_client = AWSFederationClientCmd(
+            api_url='https://a', api_urls=['https://a', 'https://b'],
+            server_ranking=ranking,
+            retry_policy=RetryPolicy(retries=0))
+        responses = [Mock(status_code=503, reason='Unavailable', text=''),
+                     Mock(text='{}', status_code=200)]
+        with patch.object(api_client.session, 'get',
+                          side_effect=responses) as mock_get:
+            self.assertEqual(api_client.get_account_and_role_list(), {})
+        self.assertEqual([c[0][0] for c in mock_get.call_args_list],
+                         ['https://b/account', 'https://a/account'])
+        ranking.record_failure.assert_called_once_with('https://b')
+        self.assertEqual(ranking.record.call_args[0][0], 'https://a')
+
+    def test_every_server_has_its_own_circuit_breaker(self):
+        breakers = {'https://a': Mock(), 'https://b': Mock()}
+        breakers['https://a'].check.side_effect = CircuitOpenError('open')
+        circuit_breakers = Mock()
+        circuit_breakers.get.side_effect = breakers.get
+        api_client = AWSFederationClientCmd(
+            api_url='https://a', api_urls=['https://a', 'https://b'],
+            circuit_breakers=circuit_breakers,
+            retry_policy=RetryPolicy(retries=0))
+        responses = [Mock(text='{}', status_code=200)]
+        with patch.object(api_client.session, 'get',
+                          side_effect=responses) as mock_get:
+            self.assertEqual(api_client.get_account_and_role_list(), {})
+        self.assertEqual([c[0][0] for c in mock_get.call_args_list],
+                         ['https://b/account'])
+        breakers['https://b'].record_success.assert_called_once_with()
+        breakers['https://a'].record_success.assert_not_called()
+
+    def test_servers_are_looked_up_again_if_none_connects(self):
+        resolve_api_urls = Mock(return_value=['https://a', 'https://c'])
+        api_client = AWSFederationClientCmd(
+            api_url='https://a', resolve_api_urls=resolve_api_urls,
+            retry_policy=RetryPolicy(retries=0))
+        responses = [requests.ConnectionError('refused'),
+                     Mock(text='{}', status_code=200)]
+        with patch.object(api_client.session, 'get',
+                          side_effect=responses) as mock_get:
+            self.assertEqual(api_client.get_account_and_role_list(), {})
+        self.assertEqual([c[0][0] for c in mock_get.call_args_list],
+                         ['https://a/account', 'https://c/account'])
+        self.assertEqual(api_client.api_urls, ['https://a', 'https://c'])
+        resolve_api_urls.assert_called_once_with()
+
+    def make_credentials_cache(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        return CredentialsCache(cache_dir=tempdir)
+
+
+class AccountListCacheTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = AccountListCache('url', 'user', cache_dir=self.tempdir,
+                                      ttl=60)
+        self.api_client = AWSFederationClientCmd(
+            account_list_cache=self.cache,
+            retry_policy=RetryPolicy(sleep=Mock()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_fresh_list_is_used_without_request(self):
+        self.cache.put('{"cached": []}')
+        with patch.object(self.api_client.session, 'get') as mock_get:
+            result = self.api_client.get_account_and_role_list()
+        self.assertEqual(result, {"cached": []})
+        mock_get.assert_not_called()
+
+    def test_list_is_stored_with_validators(self):
+        response = Mock(text='{"testaccount": ["testrole"]}',
+                        status_code=200,
+                        headers={'ETag': '"v1"'})
+        with patch.object(self.api_client.session, 'get',
+                          return_value=response):
+            result = self.api_client.get_account_and_role_list()
+        self.assertEqual(result, {"testaccount": ["testrole"]})
+        entry, is_fresh = self.cache.get()
+        self.assertTrue(is_fresh)
+        self.assertEqual(entry['etag'], '"v1"')
+
+    def test_stale_list_is_revalidated(self):
+        self.cache.put('{"cached": []}', etag='"v1"',
+                       last_modified='Thu, 01 Jan 1970 00:00:00 GMT', now=1)
+        response = Mock(text='', status_code=304, headers={})
+        with patch.object(self.api_client.session, 'get',
+                          return_value=response) as mock_get:
+            result = self.api_client.get_account_and_role_list()
+        self.assertEqual(result, {"cached": []})
+        headers = mock_get.call_args[1]['headers']
+        self.assertEqual(headers, {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        entry, is_fresh = self.cache.get()
+        self.assertTrue(is_fresh)
+        self.assertEqual(entry['etag'], '"v1"')
+
+    def test_stale_list_is_used_when_server_is_unreachable(self):
+        self.cache.put('{"cached": []}', now=1)
+        with patch.object(self.api_client.session, 'get',
+                          side_effect=requests.Timeout('too slow')) as mock_get:
+            result = self.api_client.get_account_and_role_list()
+        self.assertEqual(result, {"cached": []})
+        # No retries, the stale list is good enough
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_stale_list_is_not_used_when_access_is_denied(self):
+        self.cache.put('{"cached": []}', now=1)
+        response = Mock(status_code=401, reason='Unauthorized')
+        with patch.object(self.api_client.session, 'get',
+                          return_value=response):
+            self.assertRaises(APICallError,
+                              self.api_client.get_account_and_role_list)
+
+    def test_errors_are_raised_without_cached_list(self):
+        with patch.object(self.api_client.session, 'get',
+                          side_effect=requests.Timeout('too slow')):
+            self.assertRaises(requests.Timeout,
+                              self.api_client.get_account_and_role_list)
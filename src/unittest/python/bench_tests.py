@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+from unittest2 import TestCase
+
+from afp_cli.bench import (Sample, describe_error, get_percentile,
+                           get_schedule, run_load, summarize)
+from afp_cli.exceptions import APICallError
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class GetScheduleTest(TestCase):
+    def test_targets_are_round_robin(self):
+        self.assertEqual(list(get_schedule(['a', 'b'], requests=3)),
+                         [('a', None), ('b', None), ('a', None)])
+
+    def test_rate_spaces_requests(self):
+        schedule = get_schedule(['a'], requests=3, rate=4,
+                                clock=FakeClock())
+        self.assertEqual([due for _, due in schedule], [0, 0.25, 0.5])
+
+    def test_duration_ends_schedule(self):
+        clock = FakeClock()
+        schedule = get_schedule(['a'], duration=1, clock=clock)
+        next(schedule)
+        clock.now = 1
+        self.assertEqual(list(schedule), [])
+
+    def test_rate_and_duration(self):
+        schedule = get_schedule(['a'], duration=1, rate=10,
+                                clock=FakeClock())
+        self.assertEqual(len(list(schedule)), 10)
+
+
+class RunLoadTest(TestCase):
+    def test_errors_are_sampled(self):
+        def send(target):
+            if target == 'bad':
+                raise APICallError('overloaded', status_code=503)
+
+        samples, _ = run_load(send, ['good', 'bad'], workers=2, requests=4)
+        self.assertEqual(sorted((s.target, s.error) for s in samples),
+                         [('bad', 'HTTP 503'), ('bad', 'HTTP 503'),
+                          ('good', None), ('good', None)])
+
+    def test_latency_counts_from_due_time(self):
+        clock = FakeClock()
+
+        def send(target):
+            clock.now += 0.5
+
+        samples, elapsed = run_load(send, ['a'], workers=1, requests=2,
+                                    rate=10, clock=clock, sleep=clock.sleep)
+        # The second request was due after 0.1 seconds, but the only
+        # worker was busy until 0.5 seconds
+        self.assertEqual([s.latency for s in samples], [0.5, 0.9])
+        self.assertEqual(elapsed, 1.0)
+
+
+class SummarizeTest(TestCase):
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([1], 90), 1)
+        self.assertIsNone(get_percentile([], 50))
+
+    def test_summary(self):
+        samples = [Sample('a', 0.1, None), Sample('a', 0.3, None),
+                   Sample('b', 1, 'ReadTimeout'), Sample('b', 0.2, None)]
+        summaries = summarize(samples, 2, ['a', 'b'])
+        self.assertEqual(list(summaries), ['total', 'a', 'b'])
+        total = summaries['total']
+        self.assertEqual(total['requests'], 4)
+        self.assertEqual(total['errors'], 1)
+        self.assertEqual(total['throughput'], 1.5)
+        self.assertEqual(total['latency']['p50'], 0.2)
+        self.assertEqual(total['latency']['max'], 0.3)
+        self.assertEqual(total['error_breakdown'], {'ReadTimeout': 1})
+        self.assertEqual(summaries['b']['requests'], 2)
+
+    def test_describe_error(self):
+        self.assertEqual(describe_error(IOError()), 'IOError'
+                         if str is bytes else 'OSError')
+        self.assertEqual(describe_error(APICallError('x', status_code=429)),
+                         'HTTP 429')
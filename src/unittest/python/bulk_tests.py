@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import threading
+import time
+
+from mock import Mock
+from unittest2 import TestCase
+
+from afp_cli.bulk import (FetchResult,
+                          fetch_all,
+                          imap_unordered,
+                          parse_pair,
+                          read_pairs,
+                          stream_credentials)
+from afp_cli.client import APICallError
+from afp_cli.log import CMDLineExit
+
+
+class ParsePairTest(TestCase):
+
+    def test_slash_separated(self):
+        self.assertEqual(parse_pair('account/role'), ('account', 'role'))
+
+    def test_whitespace_separated(self):
+        self.assertEqual(parse_pair('account  role'), ('account', 'role'))
+
+    def test_invalid_pairs(self):
+        for text in ['account', 'account/', '/role', 'a b c']:
+            self.assertRaises(CMDLineExit, parse_pair, text)
+
+    def test_read_pairs_skips_blanks_and_comments(self):
+        lines = ['a/b\n', '\n', '# comment\n', '  c d  \n']
+        self.assertEqual(list(read_pairs(lines)), [('a', 'b'), ('c', 'd')])
+
+    def test_read_pairs_can_skip_invalid_lines(self):
+        errors = []
+        lines = ['a/b\n', 'invalid\n', 'c d\n']
+        self.assertEqual(list(read_pairs(lines, errors.append)),
+                         [('a', 'b'), ('c', 'd')])
+        self.assertEqual(len(errors), 1)
+        self.assertRaises(CMDLineExit, list, read_pairs(lines))
+
+    def test_read_pairs_fails_on_unreadable_lines(self):
+        def lines():
+            yield 'a/b\n'
+            raise IOError('Input/output error')
+
+        pairs = read_pairs(lines(), on_error=Mock())
+        self.assertEqual(next(pairs), ('a', 'b'))
+        with self.assertRaises(CMDLineExit) as cm:
+            next(pairs)
+        self.assertIn('Input/output error', str(cm.exception))
+
+
+class ImapUnorderedTest(TestCase):
+
+    def test_returns_all_results(self):
+        self.assertEqual(
+            sorted(imap_unordered(lambda x: x * 2, range(20), workers=3)),
+            [x * 2 for x in range(20)])
+
+    def test_runs_concurrently_but_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def function(item):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return item
+
+        list(imap_unordered(function, range(20), workers=4))
+        self.assertGreater(max_running[0], 1)
+        self.assertLessEqual(max_running[0], 4)
+
+    def test_consumes_items_lazily(self):
+        consumed = []
+
+        def items():
+            for item in range(100):
+                consumed.append(item)
+                yield item
+
+        results = imap_unordered(lambda x: x, items(), workers=2)
+        next(results)
+        self.assertLess(len(consumed), 100)
+
+    def test_raises_error_of_items_after_finishing_taken_ones(self):
+        def items():
+            for item in range(10):
+                yield item
+            raise ValueError('broken input')
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in imap_unordered(lambda x: x, items(), workers=3):
+                results.append(result)
+        self.assertEqual(sorted(results), list(range(10)))
+
+
+class FetchAllTest(TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.get_aws_credentials.side_effect = \
+            lambda account, role: {'AWS_EXPIRATION_DATE': 'DATE',
+                                   'AWS_ACCESS_KEY_ID': account + role}
+
+    def test_reports_failures_without_aborting(self):
+        def get_aws_credentials(account, role):
+            if account == 'bad':
+                raise APICallError('denied')
+            return {'AWS_EXPIRATION_DATE': 'DATE'}
+        self.client.get_aws_credentials.side_effect = get_aws_credentials
+
+        results = fetch_all(lambda: self.client,
+                            [('a', 'r'), ('bad', 'r'), ('b', 'r')])
+
+        self.assertEqual([(r.account, r.error is None) for r in results],
+                         [('a', True), ('bad', False), ('b', True)])
+        self.assertIn('denied', results[1].error)
+
+    def test_keeps_order_and_removes_duplicates(self):
+        pairs = [('b', 'r'), ('a', 'r'), ('b', 'r')]
+        results = fetch_all(lambda: self.client, pairs, workers=2)
+        self.assertEqual([(r.account, r.role) for r in results],
+                         [('b', 'r'), ('a', 'r')])
+        self.assertEqual(self.client.get_aws_credentials.call_count, 2)
+
+    def test_uses_cache_without_creating_client(self):
+        cache = Mock()
+        cache.get.return_value = {'AWS_EXPIRATION_DATE': 'DATE'}
+        get_client = Mock()
+
+        results = fetch_all(get_client, [('a', 'r')],
+                            credentials_cache=cache)
+
+        get_client.assert_not_called()
+        self.assertIsInstance(results[0], FetchResult)
+        self.assertEqual(results[0].aws_credentials['AWS_ACCOUNT_NAME'], 'a')
+
+    def test_resizes_connection_pool(self):
+        fetch_all(lambda: self.client, [('a', 'r')], workers=7)
+        self.client.resize_connection_pool.assert_called_once_with(7)
+
+
+class StreamCredentialsTest(TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.get_aws_credentials.side_effect = \
+            lambda account, role: {'AWS_EXPIRATION_DATE': 'DATE',
+                                   'AWS_ACCESS_KEY_ID': account + role}
+
+    def test_yields_results_while_reading_pairs(self):
+        read = []
+
+        def pairs():
+            for number in range(100):
+                read.append(number)
+                yield 'a{0}'.format(number), 'r'
+
+        results = stream_credentials(lambda: self.client, pairs(), workers=2)
+        self.assertEqual(next(results).role, 'r')
+        self.assertLess(len(read), 100)
+        self.assertEqual(len(list(results)), 99)
+
+    def test_creates_client_once_and_only_if_needed(self):
+        cache = Mock()
+        cache.get.side_effect = lambda api_url, username, account, role: \
+            {'AWS_EXPIRATION_DATE': 'DATE'} if account == 'cached' else None
+        get_client = Mock(return_value=self.client)
+
+        results = list(stream_credentials(get_client, [('cached', 'r')],
+                                          credentials_cache=cache))
+        self.assertEqual(results[0].error, None)
+        get_client.assert_not_called()
+
+        list(stream_credentials(get_client, [('a', 'r'), ('b', 'r')],
+                                workers=2, credentials_cache=cache))
+        get_client.assert_called_once_with()
+        self.client.resize_connection_pool.assert_called_once_with(2)
+
+    def test_failing_client_fails_every_pair(self):
+        get_client = Mock(side_effect=CMDLineExit('wrong password'))
+        results = list(stream_credentials(get_client,
+                                          [('a', 'r'), ('b', 'r')]))
+        self.assertEqual([r.error for r in results],
+                         ['wrong password', 'wrong password'])
+        get_client.assert_called_once_with()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from unittest2 import TestCase
+from mock import Mock
+
+from afp_cli.cache import CredentialsCache, DefaultRoleIndex, HostCache
+from afp_cli.fileutils import file_lock
+
+CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'AccessKeyId',
+               'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+               'AWS_SESSION_TOKEN': 'Token',
+               'AWS_SECURITY_TOKEN': 'Token',
+               'AWS_EXPIRATION_DATE': '1970-01-01T01:00:00Z'}
+FRESH_CREDENTIALS = dict(CREDENTIALS,
+                         AWS_EXPIRATION_DATE='2099-01-01T01:00:00Z')
+
+
+class CredentialsCacheTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = CredentialsCache(
+            cache_dir=os.path.join(self.tempdir, 'cache'), margin=300)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_returns_none_on_miss(self):
+        self.assertIsNone(self.cache.get('url', 'user', 'account', 'role'))
+
+    def test_returns_valid_credentials(self):
+        self.cache.put('url', 'user', 'account', 'role', CREDENTIALS)
+        self.assertEqual(
+            self.cache.get('url', 'user', 'account', 'role',
+                           utcnow=datetime(1970, 1, 1, 0, 54)),
+            CREDENTIALS)
+
+    def test_returns_none_within_margin(self):
+        self.cache.put('url', 'user', 'account', 'role', CREDENTIALS)
+        self.assertIsNone(
+            self.cache.get('url', 'user', 'account', 'role',
+                           utcnow=datetime(1970, 1, 1, 0, 56)))
+
+    def test_entries_are_keyed_by_url_user_account_and_role(self):
+        self.cache.put('url', 'user', 'account', 'role', CREDENTIALS)
+        utcnow = datetime(1970, 1, 1)
+        self.assertIsNone(self.cache.get(
+            'other_url', 'user', 'account', 'role', utcnow=utcnow))
+        self.assertIsNone(self.cache.get(
+            'url', 'other_user', 'account', 'role', utcnow=utcnow))
+        self.assertIsNone(self.cache.get(
+            'url', 'user', 'other_account', 'role', utcnow=utcnow))
+        self.assertIsNone(self.cache.get(
+            'url', 'user', 'account', 'other_role', utcnow=utcnow))
+
+    def test_returns_none_for_corrupt_entry(self):
+        filename = self.cache.get_filename('url', 'user', 'account', 'role')
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as cache_file:
+            cache_file.write('{"AWS_EXPIRATION_DATE": ')
+        self.assertIsNone(self.cache.get('url', 'user', 'account', 'role'))
+
+    def test_cache_files_are_private(self):
+        self.cache.put('url', 'user', 'account', 'role', CREDENTIALS)
+        filename = self.cache.get_filename('url', 'user', 'account', 'role')
+        self.assertEqual(os.stat(filename).st_mode & 0o077, 0)
+
+
+class GetOrFetchTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = CredentialsCache(cache_dir=self.tempdir, lock_timeout=5)
+        self.fetch = Mock(return_value=FRESH_CREDENTIALS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_or_fetch(self):
+        return self.cache.get_or_fetch('url', 'user', 'account', 'role',
+                                       self.fetch)
+
+    def test_fetches_and_caches_on_miss(self):
+        self.assertEqual(self.get_or_fetch(), FRESH_CREDENTIALS)
+        self.assertEqual(self.get_or_fetch(), FRESH_CREDENTIALS)
+        self.fetch.assert_called_once_with()
+
+    def test_concurrent_callers_share_one_fetch(self):
+        # flock() locks conflict between open files even within one
+        # process, so threads stand in for concurrent afp processes
+        def fetch():
+            time.sleep(0.05)
+            return FRESH_CREDENTIALS
+        self.fetch.side_effect = fetch
+        threads = [threading.Thread(target=self.get_or_fetch)
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.fetch.assert_called_once_with()
+
+    def test_fetches_anyway_if_lock_is_not_released(self):
+        self.cache.lock_timeout = 0.1
+        lock_filename = self.cache.get_lock_filename(
+            'url', 'user', 'account', 'role')
+        with file_lock(lock_filename):
+            self.assertEqual(self.get_or_fetch(), FRESH_CREDENTIALS)
+        self.fetch.assert_called_once_with()
+
+    def test_fetches_anyway_if_lock_file_can_not_be_created(self):
+        os.makedirs(self.cache.get_lock_filename(
+            'url', 'user', 'account', 'role'))
+        self.assertEqual(self.get_or_fetch(), FRESH_CREDENTIALS)
+        self.assertEqual(self.get_or_fetch(), FRESH_CREDENTIALS)
+        self.fetch.assert_called_once_with()
+
+    def test_lock_files_are_shared_by_entries(self):
+        lock_filenames = set(
+            self.cache.get_lock_filename('url', 'user', 'account', str(role))
+            for role in range(1000))
+        self.assertLessEqual(len(lock_filenames), 256)
+
+    def test_errors_of_fetch_are_raised(self):
+        self.fetch.side_effect = IOError('server down')
+        self.assertRaises(IOError, self.get_or_fetch)
+        self.fetch.assert_called_once_with()
+
+
+class DefaultRoleIndexTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DefaultRoleIndex('url', 'user', cache_dir=self.tempdir,
+                                      ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_unknown_without_index(self):
+        self.assertEqual(self.index.get('account'), (None, False))
+
+    def test_remembers_first_role_of_every_account(self):
+        self.index.update({'account1': ['role2', 'role1'],
+                           'account2': ['role3'],
+                           'account3': []}, now=1000)
+        self.assertEqual(self.index.get('account1', now=1010),
+                         ('role1', True))
+        self.assertEqual(self.index.get('account2', now=1010),
+                         ('role3', True))
+        self.assertEqual(self.index.get('account3', now=1010),
+                         (None, True))
+
+    def test_old_entries_are_stale(self):
+        self.index.update({'account': ['role']}, now=1000)
+        self.assertEqual(self.index.get('account', now=1061),
+                         ('role', False))
+
+    def test_index_is_per_url_and_user(self):
+        self.index.update({'account': ['role']})
+        other_index = DefaultRoleIndex('url', 'other_user',
+                                       cache_dir=self.tempdir)
+        self.assertEqual(other_index.get('account'), (None, False))
+
+    def test_refresh_in_background(self):
+        client = Mock()
+        client.get_account_and_role_list.return_value = {'account': ['new']}
+        self.index.update({'account': ['old']}, now=1000)
+
+        self.index.refresh_in_background(client)
+        self.index.refresh_thread.join()
+
+        self.assertEqual(self.index.get('account')[0], 'new')
+
+    def test_failing_refresh_keeps_index(self):
+        client = Mock()
+        client.get_account_and_role_list.side_effect = Exception('failed')
+        self.index.update({'account': ['role']}, now=1000)
+        self.index.refresh(client)
+        self.assertEqual(self.index.get('account')[0], 'role')
+
+
+class HostCacheTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = HostCache(cache_dir=self.tempdir, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_returns_none_on_miss(self):
+        self.assertIsNone(self.cache.get('afp'))
+
+    def test_returns_fresh_hosts(self):
+        self.cache.put('afp', ['afp1.example', 'afp2.example'], now=100)
+        self.assertEqual(self.cache.get('afp', now=159),
+                         ['afp1.example', 'afp2.example'])
+
+    def test_ignores_stale_hosts(self):
+        self.cache.put('afp', ['afp1.example'], now=100)
+        self.assertIsNone(self.cache.get('afp', now=160))
+
+    def test_invalidate_removes_only_given_name(self):
+        self.cache.put('afp', ['afp1.example'], now=100)
+        self.cache.put('other', ['other.example'], now=100)
+        self.cache.invalidate('afp')
+        self.assertIsNone(self.cache.get('afp', now=101))
+        self.assertEqual(self.cache.get('other', now=101), ['other.example'])
+
+    def test_last_hosts_are_returned_however_old(self):
+        self.assertIsNone(self.cache.get_last('afp'))
+        self.cache.put('afp', ['afp1.example', 'afp2.example'], now=100)
+        self.assertEqual(self.cache.get_last('afp'),
+                         ['afp1.example', 'afp2.example'])
+
+    def test_ignores_corrupt_cache(self):
+        with open(os.path.join(self.tempdir, 'hosts'), 'w') as cache_file:
+            cache_file.write('{"afp": "garbage"}')
+        self.assertIsNone(self.cache.get('afp'))
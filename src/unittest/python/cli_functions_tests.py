@@ -4,12 +4,27 @@
 import socket
 from datetime import datetime
 
-from afp_cli.cli_functions import (get_api_url,
+from afp_cli.cli_functions import (filter_account_and_role_list,
+                                   get_api_url,
+                                   get_api_urls,
                                    get_aws_credentials,
+                                   get_bench_settings,
+                                   get_cached_aws_credentials,
+                                   get_circuit_breakers,
+                                   get_connection_settings,
+                                   get_credentials_cache,
+                                   get_default_role_index,
+                                   get_find_limit,
                                    get_first_role,
+                                   get_host_cache,
+                                   get_last_api_url,
+                                   get_name_filter,
+                                   get_retry_policy,
+                                   get_server_ranking,
                                    get_valid_seconds,
                                    sanitize_credentials,
-                                   sanitize_host)
+                                   sanitize_host,
+                                   sanitize_hosts)
 from afp_cli.client import APICallError
 from afp_cli.log import CMDLineExit
 from mock import Mock, patch
@@ -69,6 +84,46 @@ class GetFirstRoleTests(TestCase):
             {'ACCOUNT1': []}
         self.assertRaises(CMDLineExit, get_first_role, client, 'ACCOUNT1')
 
+    def test_uses_fresh_role_index_without_request(self):
+        client = Mock()
+        role_index = Mock()
+        role_index.get.return_value = ('ROLE2', True)
+        self.assertEqual('ROLE2',
+                         get_first_role(client, 'ACCOUNT1', role_index))
+        client.get_account_and_role_list.assert_not_called()
+        role_index.refresh_in_background.assert_not_called()
+
+    def test_refreshes_stale_role_index_in_background(self):
+        client = Mock()
+        role_index = Mock()
+        role_index.get.return_value = ('ROLE2', False)
+        self.assertEqual('ROLE2',
+                         get_first_role(client, 'ACCOUNT1', role_index))
+        role_index.refresh_in_background.assert_called_once_with(client)
+
+    def test_updates_role_index_for_unknown_account(self):
+        client = Mock()
+        client.get_account_and_role_list.return_value = \
+            {'ACCOUNT1': ['ROLE1']}
+        role_index = Mock()
+        role_index.get.return_value = (None, False)
+        self.assertEqual('ROLE1',
+                         get_first_role(client, 'ACCOUNT1', role_index))
+        role_index.update.assert_called_once_with({'ACCOUNT1': ['ROLE1']})
+
+
+class GetDefaultRoleIndexTest(TestCase):
+
+    def test_index_ttl_is_configurable(self):
+        role_index = get_default_role_index(
+            {}, {'default-role-ttl': '60'}, 'URL', 'USER')
+        self.assertEqual(role_index.ttl, 60)
+
+    def test_index_is_disabled_with_cache(self):
+        self.assertIsNone(get_default_role_index({'--no-cache': True}, {}))
+        self.assertIsNone(
+            get_default_role_index({}, {'credentials-cache': False}))
+
 
 class GetAWSCredentialsTest(TestCase):
 
@@ -95,6 +150,193 @@ class GetAWSCredentialsTest(TestCase):
             CMDLineExit, get_aws_credentials, client, 'ACCOUNT1', 'ROLE1')
 
 
+class GetCachedAWSCredentialsTest(TestCase):
+
+    @patch('afp_cli.cli_functions.get_valid_seconds', Mock(return_value=600))
+    def test_returns_cached_credentials_with_details(self):
+        cache = Mock()
+        cache.get.return_value = {'AWS_EXPIRATION_DATE': 'DATE'}
+        received = get_cached_aws_credentials(
+            cache, 'URL', 'USER', 'ACCOUNT1', 'ROLE1')
+        cache.get.assert_called_once_with('URL', 'USER', 'ACCOUNT1', 'ROLE1')
+        self.assertEqual(received, {
+            'AWS_EXPIRATION_DATE': 'DATE',
+            'AWS_VALID_SECONDS': 600,
+            'AWS_ACCOUNT_NAME': 'ACCOUNT1',
+            'AWS_ASSUMED_ROLE': 'ROLE1'})
+
+    def test_returns_none_on_cache_miss(self):
+        cache = Mock()
+        cache.get.return_value = None
+        self.assertIsNone(get_cached_aws_credentials(
+            cache, 'URL', 'USER', 'ACCOUNT1', 'ROLE1'))
+
+    def test_returns_none_without_cache(self):
+        self.assertIsNone(get_cached_aws_credentials(
+            None, 'URL', 'USER', 'ACCOUNT1', 'ROLE1'))
+
+
+class GetCredentialsCacheTest(TestCase):
+
+    def test_cache_is_enabled_by_default(self):
+        cache = get_credentials_cache()
+        self.assertEqual(cache.margin, 300)
+
+    def test_cache_margin_is_configurable(self):
+        cache = get_credentials_cache({}, {'cache-margin': '60'})
+        self.assertEqual(cache.margin, 60)
+
+    def test_invalid_cache_margin(self):
+        self.assertRaises(CMDLineExit, get_credentials_cache,
+                          {}, {'cache-margin': 'soon'})
+
+    def test_cache_can_be_disabled_by_config(self):
+        self.assertIsNone(
+            get_credentials_cache({}, {'credentials-cache': False}))
+
+    def test_cache_can_be_disabled_by_argument(self):
+        self.assertIsNone(get_credentials_cache({'--no-cache': True}, {}))
+
+
+class GetConnectionSettingsTest(TestCase):
+
+    def test_nothing_is_set_by_default(self):
+        self.assertEqual(get_connection_settings(), {})
+
+    def test_settings_are_configurable(self):
+        settings = get_connection_settings({}, {'connect-timeout': '2.5',
+                                                'read-timeout': 60,
+                                                'pool-size': '20',
+                                                'keep-alive': False,
+                                                'tls-resumption': False})
+        self.assertEqual(settings, {'connect_timeout': 2.5,
+                                    'read_timeout': 60.0,
+                                    'pool_size': 20,
+                                    'keep_alive': False,
+                                    'tls_resumption': False})
+
+    def test_arguments_take_precedence_over_config(self):
+        settings = get_connection_settings(
+            {'--read-timeout': '5', '--no-keep-alive': True},
+            {'read-timeout': 60, 'keep-alive': True})
+        self.assertEqual(settings, {'read_timeout': 5.0, 'keep_alive': False})
+
+    def test_invalid_settings(self):
+        self.assertRaises(CMDLineExit, get_connection_settings,
+                          {'--connect-timeout': 'soon'}, {})
+        self.assertRaises(CMDLineExit, get_connection_settings,
+                          {}, {'pool-size': 0})
+
+
+class GetBenchSettingsTest(TestCase):
+
+    def test_only_workers_by_default(self):
+        self.assertEqual(get_bench_settings({'--workers': '10'}),
+                         {'workers': 10})
+
+    def test_limits(self):
+        self.assertEqual(get_bench_settings({'--workers': '5',
+                                             '--requests': '1000',
+                                             '--duration': '2.5',
+                                             '--rate': '100'}),
+                         {'workers': 5, 'requests': 1000, 'duration': 2.5,
+                          'rate': 100.0})
+
+    def test_invalid_limits(self):
+        self.assertRaises(CMDLineExit, get_bench_settings, {'--workers': '0'})
+        self.assertRaises(CMDLineExit, get_bench_settings,
+                          {'--workers': '1', '--rate': 'fast'})
+
+
+class GetFindLimitTest(TestCase):
+    def test_find_limit(self):
+        self.assertEqual(get_find_limit({'--limit': '3'}), 3)
+        self.assertRaises(CMDLineExit, get_find_limit, {'--limit': '0'})
+        self.assertRaises(CMDLineExit, get_find_limit, {'--limit': 'all'})
+
+
+class GetNameFilterTest(TestCase):
+    def test_no_pattern(self):
+        self.assertIsNone(get_name_filter(None))
+
+    def test_glob_pattern(self):
+        name_filter = get_name_filter('prod-*')
+        self.assertTrue(name_filter('prod-eu'))
+        self.assertFalse(name_filter('dev-prod-eu'))
+        self.assertFalse(name_filter('Prod-eu'))
+
+    def test_regular_expression(self):
+        name_filter = get_name_filter('/^prod-(eu|us)/')
+        self.assertTrue(name_filter('prod-eu-1'))
+        self.assertFalse(name_filter('prod-ap'))
+        self.assertTrue(get_name_filter('/eu/')('dev-eu-1'))
+
+    def test_invalid_regular_expression(self):
+        self.assertRaises(CMDLineExit, get_name_filter, '/prod-(/')
+
+
+class FilterAccountAndRoleListTest(TestCase):
+    accounts_and_roles = {'prod-eu': ['admin', 'reader'],
+                          'prod-us': ['reader'],
+                          'dev': ['admin']}
+
+    def test_no_filters(self):
+        self.assertIs(filter_account_and_role_list(self.accounts_and_roles),
+                      self.accounts_and_roles)
+
+    def test_account_filter(self):
+        self.assertEqual(filter_account_and_role_list(
+            self.accounts_and_roles, get_name_filter('prod-*')),
+            {'prod-eu': ['admin', 'reader'], 'prod-us': ['reader']})
+
+    def test_role_filter_drops_accounts_without_role(self):
+        self.assertEqual(filter_account_and_role_list(
+            self.accounts_and_roles, None, get_name_filter('admin')),
+            {'prod-eu': ['admin'], 'dev': ['admin']})
+
+    def test_both_filters(self):
+        self.assertEqual(filter_account_and_role_list(
+            self.accounts_and_roles, get_name_filter('/^prod/'),
+            get_name_filter('admin')),
+            {'prod-eu': ['admin']})
+
+
+class GetRetryPolicyTest(TestCase):
+
+    def test_retries_are_enabled_by_default(self):
+        self.assertEqual(get_retry_policy().retries, 3)
+
+    def test_policy_is_configurable(self):
+        policy = get_retry_policy({}, {'retries': 0,
+                                       'retry-backoff': '0.1',
+                                       'retry-max-backoff': 2})
+        self.assertEqual(policy.retries, 0)
+        self.assertEqual(policy.backoff, 0.1)
+        self.assertEqual(policy.max_backoff, 2)
+
+    def test_invalid_retries(self):
+        self.assertRaises(CMDLineExit, get_retry_policy, {}, {'retries': -1})
+
+
+class GetCircuitBreakersTest(TestCase):
+
+    def test_circuit_breaker_is_per_server(self):
+        breakers = get_circuit_breakers({}, {})
+        self.assertNotEqual(breakers.get('url1').filename,
+                            breakers.get('url2').filename)
+
+    def test_circuit_breaker_is_configurable(self):
+        breaker = get_circuit_breakers(
+            {}, {'circuit-breaker-threshold': 10,
+                 'circuit-breaker-cooldown': 60}).get('url')
+        self.assertEqual(breaker.threshold, 10)
+        self.assertEqual(breaker.cooldown, 60)
+
+    def test_circuit_breaker_can_be_disabled(self):
+        self.assertIsNone(get_circuit_breakers(
+            {}, {'circuit-breaker-threshold': 0}))
+
+
 class SanitizeCredentialsTest(TestCase):
 
     @skipIf(PY3, 'Python 2 only')
@@ -204,6 +446,137 @@ class GetApiUrlTest(TestCase):
         self.mock_sanitize_host.assert_called_once_with('afp')
 
 
+class GetHostCacheTest(TestCase):
+
+    def test_ttl_is_configurable(self):
+        self.assertEqual(get_host_cache({}, {'dns-ttl': '600'}).ttl, 600)
+
+    def test_invalid_ttl(self):
+        self.assertRaises(CMDLineExit, get_host_cache, {}, {'dns-ttl': 'x'})
+
+    def test_cache_can_be_disabled_by_argument(self):
+        self.assertIsNone(get_host_cache({'--no-cache': True}, {}))
+
+
+class GetApiUrlsTest(TestCase):
+    """
+    Tests for get_api_urls()
+    """
+
+    def test_first_url_is_the_api_url(self):
+        arguments = {'--server': 'afp1, afp2'}
+        self.assertEqual(get_api_urls(arguments, {}),
+                         ['https://afp1/afp-api/latest',
+                          'https://afp2/afp-api/latest'])
+        self.assertEqual(get_api_url(arguments, {}),
+                         'https://afp1/afp-api/latest')
+
+    def test_configured_lists_are_used(self):
+        config = {'api_url': ['http://afp1/api', 'http://afp2/api']}
+        self.assertEqual(get_api_urls({}, config),
+                         ['http://afp1/api', 'http://afp2/api'])
+        self.assertEqual(get_api_url({}, config), 'http://afp1/api')
+
+    @patch('afp_cli.cli_functions.sanitize_hosts')
+    def test_defaults_to_all_afp_hosts(self, mock_sanitize_hosts):
+        mock_sanitize_hosts.return_value = ['afp1.example', 'afp2.example']
+        self.assertEqual(get_api_urls(),
+                         ['https://afp1.example/afp-api/latest',
+                          'https://afp2.example/afp-api/latest'])
+        mock_sanitize_hosts.assert_called_once_with('afp', None)
+
+    @patch('afp_cli.cli_functions.sanitize_hosts')
+    def test_fresh_lookup_ignores_host_cache(self, mock_sanitize_hosts):
+        mock_sanitize_hosts.return_value = ['afp1.example']
+        host_cache = Mock()
+        get_api_urls({}, {}, host_cache, fresh=True)
+        host_cache.invalidate.assert_called_once_with('afp')
+        mock_sanitize_hosts.assert_called_once_with('afp', host_cache)
+
+    @patch('afp_cli.cli_functions.HostCache')
+    @patch('afp_cli.cli_functions.sanitize_hosts')
+    def test_last_api_url_needs_no_lookups(self, mock_sanitize_hosts,
+                                           mock_host_cache):
+        mock_host_cache.return_value.get_last.return_value = [
+            'afp1.example', 'afp2.example']
+        self.assertEqual(get_last_api_url(),
+                         'https://afp1.example/afp-api/latest')
+        self.assertEqual(get_last_api_url({'--server': 'afp2, afp3'}, {}),
+                         'https://afp2/afp-api/latest')
+        self.assertEqual(get_last_api_url({}, {'api_url': 'http://afp/api'}),
+                         'http://afp/api')
+        mock_sanitize_hosts.assert_not_called()
+
+    @patch('afp_cli.cli_functions.HostCache')
+    def test_no_last_api_url_without_cached_hosts(self, mock_host_cache):
+        mock_host_cache.return_value.get_last.return_value = None
+        self.assertIsNone(get_last_api_url())
+        self.assertIsNone(get_last_api_url({'--no-cache': True}, {}))
+
+    def test_ranking_is_only_needed_for_several_servers(self):
+        self.assertIsNone(get_server_ranking({}, {}, ['url']))
+        self.assertIsNotNone(get_server_ranking({}, {}, ['url1', 'url2']))
+
+
+class SanitizeHostsTest(TestCase):
+    """
+    Test cases for `sanitize_hosts()`.
+    """
+
+    def setUp(self):
+        self.patch_getaddrinfo = patch('socket.getaddrinfo')
+        self.mock_getaddrinfo = self.patch_getaddrinfo.start()
+        self.mock_getaddrinfo.return_value = (
+            [0, 1, 2, 3, ['10.0.0.1', 443]],
+            [0, 1, 2, 3, ['10.0.0.2', 443]],
+            [0, 1, 2, 3, ['10.0.0.3', 443]],
+            [0, 1, 2, 3, ['10.0.0.1', 443]])
+        self.patch_gethostbyaddr = patch('socket.gethostbyaddr')
+        self.mock_gethostbyaddr = self.patch_gethostbyaddr.start()
+
+    def tearDown(self):
+        self.patch_getaddrinfo.stop()
+        self.patch_gethostbyaddr.stop()
+
+    def test_returns_fqdns_of_all_ips(self):
+        self.mock_gethostbyaddr.side_effect = lambda ip: (
+            'host-' + ip, [], [ip])
+        self.assertEqual(sanitize_hosts('afp'), ['host-10.0.0.1',
+                                                 'host-10.0.0.2',
+                                                 'host-10.0.0.3'])
+
+    def test_skips_ips_without_reverse(self):
+        def gethostbyaddr(ip):
+            if ip == '10.0.0.2':
+                raise socket.herror('not found')
+            return 'host-' + ip, [], [ip]
+        self.mock_gethostbyaddr.side_effect = gethostbyaddr
+        self.assertEqual(sanitize_hosts('afp'),
+                         ['host-10.0.0.1', 'host-10.0.0.3'])
+
+    def test_uses_and_fills_host_cache(self):
+        self.mock_gethostbyaddr.side_effect = lambda ip: (
+            'host-' + ip, [], [ip])
+        host_cache = Mock()
+        host_cache.get.return_value = None
+        fqdns = sanitize_hosts('afp', host_cache)
+        host_cache.put.assert_called_once_with('afp', fqdns)
+
+        host_cache.get.return_value = ['cached.example']
+        self.mock_getaddrinfo.reset_mock()
+        self.assertEqual(sanitize_hosts('afp', host_cache),
+                         ['cached.example'])
+        self.mock_getaddrinfo.assert_not_called()
+
+    def test_raises_error_if_no_reverse_is_found(self):
+        self.mock_gethostbyaddr.side_effect = socket.herror('not found')
+        with self.assertRaises(CMDLineExit) as cm:
+            sanitize_hosts('afp')
+        self.assertEqual(
+            cm.exception.args[0],
+            'DNS reverse lookup failed for IP 10.0.0.1: not found')
+
+
 class SanitizeHostTest(TestCase):
     """
     Test cases for `sanitize_host()`.
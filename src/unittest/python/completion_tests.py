@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from unittest2 import TestCase
+
+from afp_cli.cache import (AccountListCache,
+                           get_completion_index_filename,
+                           write_completion_index)
+from afp_cli.completion import (complete,
+                                complete_accounts,
+                                complete_roles,
+                                load_index)
+
+ACCOUNTS_AND_ROLES = {'prod': ['admin', 'read'],
+                      'prod-eu': ['read'],
+                      'dev': ['admin'],
+                      'production': []}
+
+
+class CompletionTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        write_completion_index(ACCOUNTS_AND_ROLES, 'url', 'user',
+                               self.tempdir)
+        self.index = load_index(
+            get_completion_index_filename('url', 'user', self.tempdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_complete_accounts_by_prefix(self):
+        self.assertEqual(complete_accounts(self.index, 'prod'),
+                         ['prod', 'prod-eu', 'production'])
+        self.assertEqual(complete_accounts(self.index, 'prod-'), ['prod-eu'])
+        self.assertEqual(complete_accounts(self.index, 'x'), [])
+
+    def test_complete_all_accounts_without_prefix(self):
+        self.assertEqual(complete_accounts(self.index),
+                         ['dev', 'prod', 'prod-eu', 'production'])
+
+    def test_complete_roles(self):
+        self.assertEqual(complete_roles(self.index, 'prod'), ['admin', 'read'])
+        self.assertEqual(complete_roles(self.index, 'prod', 'r'), ['read'])
+        self.assertEqual(complete_roles(self.index, 'unknown'), [])
+
+    def test_missing_index(self):
+        self.assertIsNone(load_index(os.path.join(self.tempdir, 'missing')))
+
+    def test_account_list_cache_writes_index(self):
+        AccountListCache('url', 'other user', cache_dir=self.tempdir).put(
+            '{"other": ["role"]}')
+        index = load_index(
+            get_completion_index_filename('url', 'other user', self.tempdir))
+        self.assertEqual(complete_accounts(index), ['other'])
+        self.assertEqual(complete_accounts(self.index),
+                         ['dev', 'prod', 'prod-eu', 'production'])
+
+    @patch('afp_cli.completion.print')
+    def test_complete_prints_candidates(self, mock_print):
+        self.assertEqual(
+            complete(['roles', 'prod'], 'url', 'user', self.tempdir), 0)
+        mock_print.assert_called_once_with('admin\nread')
+
+    @patch('afp_cli.completion.print')
+    def test_complete_is_silent_without_index(self, mock_print):
+        self.assertEqual(complete(['accounts'], 'url', 'user',
+                                  os.path.join(self.tempdir, 'missing')), 0)
+        mock_print.assert_not_called()
+
+    @patch('afp_cli.completion.print')
+    def test_complete_uses_index_of_server_and_user(self, mock_print):
+        for api_url, username in [('other url', 'user'),
+                                  ('url', 'other user')]:
+            self.assertEqual(
+                complete(['accounts'], api_url, username, self.tempdir), 0)
+        mock_print.assert_not_called()
+
+    @patch('afp_cli.completion.print')
+    def test_complete_rejects_invalid_arguments(self, mock_print):
+        for argv in [[], ['roles'], ['accounts', 'a', 'b'], ['foo']]:
+            self.assertEqual(complete(argv, 'url', 'user', self.tempdir), 2)
+        mock_print.assert_not_called()
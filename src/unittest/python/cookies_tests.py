@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+from requests.cookies import RequestsCookieJar
+from unittest2 import TestCase
+
+from afp_cli.cookies import CookieStore
+from afp_cli.fileutils import file_lock
+
+
+def make_jar(**cookies):
+    cookie_jar = RequestsCookieJar()
+    for name, value in cookies.items():
+        cookie_jar.set(name, value, domain='afp.example.com', path='/')
+    return cookie_jar
+
+
+class CookieStoreTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'cookies.json')
+        self.store = CookieStore(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_missing_store_gives_empty_jar(self):
+        self.assertEqual(len(self.store.load()), 0)
+
+    def test_save_and_load(self):
+        self.store.save(make_jar(session='abc'))
+        cookie_jar = CookieStore(self.filename).load()
+        self.assertEqual(cookie_jar.get('session', domain='afp.example.com'),
+                         'abc')
+
+    def test_unchanged_cookies_are_not_written(self):
+        self.store.save(make_jar(session='abc'))
+        with patch('afp_cli.cookies.write_atomic') as write_atomic:
+            self.store.save(make_jar(session='abc'))
+            self.assertFalse(write_atomic.called)
+            self.store.save(make_jar(session='xyz'))
+            self.assertTrue(write_atomic.called)
+
+    def test_corrupt_store_gives_empty_jar(self):
+        with open(self.filename, 'w') as store_file:
+            store_file.write('\x80not json')
+        self.assertEqual(len(self.store.load()), 0)
+
+    def test_expired_cookies_are_not_loaded(self):
+        cookie_jar = make_jar()
+        cookie_jar.set('old', 'value', domain='afp.example.com', path='/',
+                       expires=int(time.time()) - 60)
+        self.store.save(cookie_jar)
+        self.assertEqual(len(CookieStore(self.filename).load()), 0)
+
+    def test_locked_store_is_not_written(self):
+        with file_lock(self.filename + '.lock'):
+            # flock() locks are per open file, so a second open conflicts
+            self.store.save(make_jar(session='abc'))
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_saves_of_concurrent_processes_are_merged(self):
+        other_store = CookieStore(self.filename)
+        self.store.load()
+        other_store.load()
+        self.store.save(make_jar(first='1'))
+        other_store.save(make_jar(second='2'))
+        cookie_jar = CookieStore(self.filename).load()
+        self.assertEqual(sorted(cookie.name for cookie in cookie_jar),
+                         ['first', 'second'])
+
+    def test_removed_cookies_are_removed_from_store(self):
+        self.store.save(make_jar(first='1', second='2'))
+        self.store.save(make_jar(first='1'))
+        cookie_jar = CookieStore(self.filename).load()
+        self.assertEqual([cookie.name for cookie in cookie_jar], ['first'])
+
+    def test_store_is_private(self):
+        self.store.save(make_jar(session='abc'))
+        self.assertEqual(os.stat(self.filename).st_mode & 0o077, 0)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
+import os
 import sys
 from unittest2 import TestCase
 from textwrap import dedent
@@ -9,13 +11,22 @@ from mock import patch, Mock
 
 from six import StringIO
 
+from afp_cli.bench import Sample, summarize
+from afp_cli.bulk import FetchResult
 from afp_cli.exporters import (format_aws_credentials,
                                format_account_and_role_list,
+                               format_credential_process,
+                               format_bench_results,
+                               format_fetch_results,
+                               format_stream_result,
+                               iter_account_and_role_list,
                                print_export,
+                               print_lines,
                                start_subshell,
                                start_subcmd,
                                enter_subx,
                                )
+from afp_cli.log import CMDLineExit
 
 
 class FormattingTest(TestCase):
@@ -58,6 +69,102 @@ class FormattingTest(TestCase):
             "testaccount_with_long_name    testrole2"
             )
 
+    def test_format_account_and_role_list_as_json(self):
+        accounts_and_roles = {"b": ["role2", "role1"], "a": [],
+                              "\u00fc": ["x"]}
+        self.assertEqual(
+            format_account_and_role_list(accounts_and_roles, 'json'),
+            json.dumps(accounts_and_roles, sort_keys=True, indent=4,
+                       separators=(',', ': ')))
+        self.assertEqual(format_account_and_role_list({}, 'json'), "{}")
+
+    def test_iter_account_and_role_list_yields_account_by_account(self):
+        accounts_and_roles = {"b": ["role"], "a": ["role1", "role2"]}
+        self.assertEqual(
+            list(iter_account_and_role_list(accounts_and_roles, 'csv')),
+            ["a,role1,role2", "b,role"])
+        self.assertEqual(
+            list(iter_account_and_role_list(accounts_and_roles, 'json')),
+            ['{',
+             '    "a": [\n        "role1",\n        "role2"\n    ],',
+             '    "b": [\n        "role"\n    ]',
+             '}'])
+        self.assertEqual(list(iter_account_and_role_list({})), [])
+
+    def test_iter_account_and_role_list_rejects_invalid_format(self):
+        self.assertRaises(CMDLineExit, list,
+                          iter_account_and_role_list({"a": ["r"]}, 'xml'))
+
+    @patch('afp_cli.exporters.info')
+    def test_print_lines_in_chunks(self, mock_info):
+        print_lines(iter(["1", "2", "3"]), chunk_size=2)
+        self.assertEqual(mock_info.call_args_list,
+                         [(("1\n2",),), (("3",),)])
+        mock_info.reset_mock()
+        print_lines([])
+        self.assertFalse(mock_info.called)
+
+    def test_format_fetch_results(self):
+        results = [FetchResult('account', 'role', {'KEY': 'VALUE'}, None),
+                   FetchResult('account', 'other_role', None, 'denied')]
+        self.assertEqual(format_fetch_results(results),
+                         "account/role          OK\n"
+                         "account/other_role    FAILED: denied")
+        self.assertEqual(format_fetch_results(results, 'csv'),
+                         "account,role,OK\n"
+                         "account,other_role,FAILED,denied")
+        self.assertEqual(json.loads(format_fetch_results(results, 'json')), {
+            'account/role': {'KEY': 'VALUE'},
+            'account/other_role': {'error': 'denied'}})
+
+    def test_format_stream_result(self):
+        self.assertEqual(
+            format_stream_result(
+                FetchResult('account', 'role', {'KEY': 'VALUE'}, None)),
+            '{"account": "account", "credentials": {"KEY": "VALUE"}, '
+            '"role": "role"}')
+        self.assertEqual(
+            json.loads(format_stream_result(
+                FetchResult('account', 'role', None, 'denied'))),
+            {'account': 'account', 'role': 'role', 'error': 'denied'})
+
+    def test_format_bench_results(self):
+        summaries = summarize([Sample('/account', 0.01, None),
+                               Sample('/account', 0.03, None),
+                               Sample('/account/a/r', 0.5, 'HTTP 503')],
+                              2, ['/account', '/account/a/r'])
+        self.assertEqual(
+            format_bench_results(summaries),
+            "target          requests  errors    req/s      p50      p90"
+            "      p99      max\n"
+            "total                  3       1      1.0    10 ms    30 ms"
+            "    30 ms    30 ms\n"
+            "/account               2       0      1.0    10 ms    30 ms"
+            "    30 ms    30 ms\n"
+            "/account/a/r           1       1      0.0        -        -"
+            "        -        -\n"
+            "errors: HTTP 503 (1)")
+        self.assertEqual(
+            format_bench_results(summaries, 'csv').splitlines()[:2],
+            ["target,requests,errors,throughput,p50,p90,p99,max,mean",
+             "total,3,1,1.0,0.01,0.03,0.03,0.03,0.02"])
+        self.assertEqual(json.loads(format_bench_results(
+            summaries, 'json'))['total']['error_breakdown'], {'HTTP 503': 1})
+
+    def test_format_credential_process(self):
+        credentials = {'AWS_ACCESS_KEY_ID': 'AccessKeyId',
+                       'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+                       'AWS_SESSION_TOKEN': 'Token',
+                       'AWS_SECURITY_TOKEN': 'Token',
+                       'AWS_EXPIRATION_DATE': '1970-01-01T01:00:00Z',
+                       'AWS_VALID_SECONDS': 600}
+        self.assertEqual(json.loads(format_credential_process(credentials)), {
+            'Version': 1,
+            'AccessKeyId': 'AccessKeyId',
+            'SecretAccessKey': 'SecretAccessKey',
+            'SessionToken': 'Token',
+            'Expiration': '1970-01-01T01:00:00Z'})
+
     @patch('os.name', 'unix')
     @patch('afp_cli.exporters.format_aws_credentials')
     def test_print_export_unix(self, format_mock):
@@ -137,3 +244,59 @@ class SubShellTests(TestCase):
     def test_start_subx_nt(self, format_mock):
         credentials = {'AWS_VALID_SECONDS': 600}
         enter_subx(credentials, 'ACCOUNT', 'ROLE')
+
+    @patch('tempfile.NamedTemporaryFile')
+    @patch('subprocess.call')
+    def test_start_subshell_with_refresher(self, call_mock, tempfile_mock):
+        memfile = StringIO()
+        memfile.name = 'FILENAME'
+        tempfile_mock.return_value = memfile
+        refresher = Mock(credentials_filename='/tmp/afp/credentials',
+                         expiration_filename='/tmp/afp/expiration')
+        credentials = {'AWS_ACCESS_KEY_ID': 'XXX', 'AWS_VALID_SECONDS': 600}
+        start_subshell(credentials, 'ACCOUNT', 'ROLE', refresher)
+        memfile.seek(0)
+        received = memfile.read()
+        self.assertIn("read expiration < '/tmp/afp/expiration'", received)
+        self.assertIn("unset AWS_PROFILE AWS_DEFAULT_PROFILE "
+                      "AWS_ACCESS_KEY_ID AWS_SECRET_ACCESS_KEY "
+                      "AWS_SESSION_TOKEN AWS_SECURITY_TOKEN", received)
+        self.assertIn(
+            "export AWS_SHARED_CREDENTIALS_FILE='/tmp/afp/credentials'",
+            received)
+        self.assertNotIn("AWS_ACCESS_KEY_ID='XXX'", received)
+
+    @patch('tempfile.NamedTemporaryFile')
+    @patch('subprocess.call')
+    @patch('os.unlink')
+    def test_start_subcmd_with_refresher(self, unlink_mock, call_mock,
+                                         tempfile_mock):
+        memfile = StringIO()
+        memfile.name = 'FILENAME'
+        memfile.close = Mock()
+        tempfile_mock.return_value = memfile
+        refresher = Mock(credentials_filename='C:\\afp\\credentials')
+        credentials = {'AWS_ACCESS_KEY_ID': 'XXX', 'AWS_VALID_SECONDS': 600}
+        start_subcmd(credentials, 'ACCOUNT', 'ROLE', refresher)
+        memfile.seek(0)
+        received = memfile.read()
+        self.assertIn("set AWS_ACCESS_KEY_ID=\n", received)
+        self.assertIn("set AWS_SECURITY_TOKEN=\n", received)
+        self.assertIn(
+            "set AWS_SHARED_CREDENTIALS_FILE='C:\\afp\\credentials'",
+            received)
+        self.assertNotIn("AWS_ACCESS_KEY_ID='XXX'", received)
+
+    @patch('os.name', 'unix')
+    @patch('afp_cli.exporters.start_subshell')
+    def test_start_subx_with_refresh(self, start_subshell_mock):
+        credentials = {'AWS_ACCESS_KEY_ID': 'XXX',
+                       'AWS_SECRET_ACCESS_KEY': 'XXX',
+                       'AWS_SESSION_TOKEN': 'XXX',
+                       'AWS_SECURITY_TOKEN': 'XXX',
+                       'AWS_EXPIRATION_DATE': '2030-01-01T01:00:00Z'}
+        enter_subx(credentials, 'ACCOUNT', 'ROLE', fetch=Mock())
+        refresher = start_subshell_mock.call_args[0][3]
+        self.assertTrue(refresher.stopped.is_set())
+        # The credentials are only needed while the subshell runs
+        self.assertFalse(os.path.exists(refresher.credentials_filename))
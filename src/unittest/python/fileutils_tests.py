@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from unittest2 import TestCase
+
+from afp_cli.fileutils import (LockError,
+                               ensure_dir,
+                               file_lock,
+                               try_file_lock,
+                               write_atomic)
+
+
+class WriteAtomicTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_creates_missing_directories(self):
+        filename = os.path.join(self.tempdir, 'a', 'b', 'file')
+        write_atomic(filename, 'content')
+        self.assertEqual(open(filename).read(), 'content')
+
+    def test_replaces_existing_file_without_leftovers(self):
+        filename = os.path.join(self.tempdir, 'file')
+        write_atomic(filename, 'old')
+        write_atomic(filename, 'new')
+        self.assertEqual(open(filename).read(), 'new')
+        self.assertEqual(os.listdir(self.tempdir), ['file'])
+
+    def test_sets_given_mode(self):
+        filename = os.path.join(self.tempdir, 'file')
+        write_atomic(filename, 'content')
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o600)
+        write_atomic(filename, 'content', mode=0o644)
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o644)
+
+    def test_ensure_dir_tolerates_existing_directory(self):
+        ensure_dir(self.tempdir)
+        self.assertTrue(os.path.isdir(self.tempdir))
+
+
+class FileLockTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_serializes_concurrent_holders(self):
+        lock_filename = os.path.join(self.tempdir, 'lock')
+        lock = threading.Lock()
+        holders = [0]
+        max_holders = [0]
+
+        def hold_lock():
+            with file_lock(lock_filename):
+                with lock:
+                    holders[0] += 1
+                    max_holders[0] = max(max_holders[0], holders[0])
+                time.sleep(0.01)
+                with lock:
+                    holders[0] -= 1
+
+        threads = [threading.Thread(target=hold_lock) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_holders[0], 1)
+
+    def test_gives_up_after_timeout(self):
+        lock_filename = os.path.join(self.tempdir, 'lock')
+        with file_lock(lock_filename):
+            with self.assertRaises(LockError):
+                with file_lock(lock_filename, timeout=0.1):
+                    pass
+        with file_lock(lock_filename, timeout=0):
+            pass
+
+    def test_try_file_lock_yields_error_instead_of_raising(self):
+        lock_filename = os.path.join(self.tempdir, 'lock')
+        with file_lock(lock_filename):
+            with try_file_lock(lock_filename, timeout=0) as error:
+                self.assertIsInstance(error, LockError)
+        with try_file_lock(lock_filename, timeout=0) as error:
+            self.assertIsNone(error)
+            with try_file_lock(lock_filename, timeout=0) as error:
+                self.assertIsInstance(error, LockError)
+        with try_file_lock(self.tempdir, timeout=0) as error:
+            self.assertIsInstance(error, (IOError, OSError))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import json
+import threading
+import time
+from datetime import datetime
+
+import requests
+from mock import Mock
+from unittest2 import TestCase
+
+from afp_cli.exceptions import APICallError
+from afp_cli.metadata import MemoryCredentialsCache, MetadataServer
+
+CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'AccessKeyId',
+               'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+               'AWS_SESSION_TOKEN': 'Token',
+               'AWS_SECURITY_TOKEN': 'Token',
+               'AWS_EXPIRATION_DATE': '2030-01-01T01:00:00Z'}
+
+
+class MemoryCredentialsCacheTest(TestCase):
+    def setUp(self):
+        self.federation_client = Mock()
+        self.federation_client.get_aws_credentials.return_value = CREDENTIALS
+        self.cache = MemoryCredentialsCache(self.federation_client, margin=300)
+
+    def test_caches_credentials(self):
+        self.assertEqual(self.cache.get('account', 'role'), CREDENTIALS)
+        self.assertEqual(self.cache.get('account', 'role'), CREDENTIALS)
+        self.federation_client.get_aws_credentials.assert_called_once_with(
+            'account', 'role')
+
+    def test_fetches_again_within_margin(self):
+        self.cache.get('account', 'role')
+        self.cache.get('account', 'role',
+                       utcnow=datetime(2030, 1, 1, 0, 56))
+        self.assertEqual(
+            self.federation_client.get_aws_credentials.call_count, 2)
+
+    def test_concurrent_requests_share_one_call(self):
+        def get_aws_credentials(account, role):
+            time.sleep(0.05)
+            return CREDENTIALS
+        self.federation_client.get_aws_credentials.side_effect = \
+            get_aws_credentials
+
+        threads = [threading.Thread(target=self.cache.get,
+                                    args=('account', 'role'))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            self.federation_client.get_aws_credentials.call_count, 1)
+
+    def test_other_roles_are_not_held_up(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def get_aws_credentials(account, role):
+            if role == 'slow':
+                started.set()
+                release.wait(5)
+            return CREDENTIALS
+        self.federation_client.get_aws_credentials.side_effect = \
+            get_aws_credentials
+
+        slow = threading.Thread(target=self.cache.get,
+                                args=('account', 'slow'))
+        slow.start()
+        started.wait(5)
+        try:
+            self.assertEqual(self.cache.get('account', 'fast'), CREDENTIALS)
+        finally:
+            release.set()
+            slow.join()
+
+
+class MetadataServerTest(TestCase):
+    def setUp(self):
+        self.federation_client = Mock()
+        self.federation_client.get_aws_credentials.return_value = CREDENTIALS
+        self.server = MetadataServer(('127.0.0.1', 0), self.federation_client,
+                                     'secret')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def get(self, account='my%20account', role='role', token='secret'):
+        return requests.get(self.server.get_url(account, role),
+                            headers={'Authorization': token})
+
+    def test_serves_credentials(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {'AccessKeyId': 'AccessKeyId',
+                          'SecretAccessKey': 'SecretAccessKey',
+                          'Token': 'Token',
+                          'Expiration': '2030-01-01T01:00:00Z'})
+        self.federation_client.get_aws_credentials.assert_called_once_with(
+            'my account', 'role')
+
+    def test_rejects_wrong_token(self):
+        self.assertEqual(self.get(token='wrong').status_code, 401)
+        self.federation_client.get_aws_credentials.assert_not_called()
+
+    def test_unknown_path(self):
+        response = requests.get(self.server.get_url('a', 'b') + '/c',
+                                headers={'Authorization': 'secret'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_upstream_errors(self):
+        self.federation_client.get_aws_credentials.side_effect = \
+            APICallError('Access denied')
+        response = self.get()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(json.loads(response.text)['message'],
+                         'Access denied')
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import Mock
+from six.moves import configparser
+from unittest2 import TestCase
+
+from afp_cli.refresh import CredentialsRefresher, get_expiration_timestamp
+
+
+def make_credentials(access_key_id, expiration):
+    return {'AWS_ACCESS_KEY_ID': access_key_id,
+            'AWS_SECRET_ACCESS_KEY': 'SecretAccessKey',
+            'AWS_SESSION_TOKEN': 'Token',
+            'AWS_SECURITY_TOKEN': 'Token',
+            'AWS_EXPIRATION_DATE': expiration}
+
+
+OLD = make_credentials('old', '2030-01-01T01:00:00Z')
+NEW = make_credentials('new', '2030-01-01T02:00:00Z')
+
+
+class CredentialsRefresherTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fetch = Mock(return_value=NEW)
+        self.refresher = CredentialsRefresher(
+            self.fetch, OLD, self.tempdir, margin=600, retry_delay=0.01)
+
+    def tearDown(self):
+        self.refresher.stop()
+        shutil.rmtree(self.tempdir)
+
+    def get_published_access_key_id(self):
+        config = configparser.RawConfigParser()
+        config.read(self.refresher.credentials_filename)
+        return config.get('default', 'aws_access_key_id')
+
+    def get_published_expiration(self):
+        with open(self.refresher.expiration_filename) as expiration_file:
+            return int(expiration_file.read())
+
+    def test_publishes_initial_credentials(self):
+        self.assertEqual(self.get_published_access_key_id(), 'old')
+        self.assertEqual(self.get_published_expiration(),
+                         get_expiration_timestamp(OLD))
+        self.fetch.assert_not_called()
+
+    def test_refresh_is_due_margin_seconds_before_expiration(self):
+        expiration = get_expiration_timestamp(OLD)
+        self.assertEqual(self.refresher.get_delay(now=expiration - 1000), 400)
+        self.assertEqual(self.refresher.get_delay(now=expiration), 0)
+
+    def test_refresh_publishes_new_credentials(self):
+        self.assertTrue(self.refresher.refresh())
+        self.assertEqual(self.get_published_access_key_id(), 'new')
+        self.assertEqual(self.get_published_expiration(),
+                         get_expiration_timestamp(NEW))
+
+    def test_refresh_keeps_credentials_on_failure(self):
+        self.fetch.side_effect = Exception('server down')
+        self.assertFalse(self.refresher.refresh())
+        self.assertEqual(self.get_published_access_key_id(), 'old')
+
+    def test_refresh_ignores_credentials_that_are_not_newer(self):
+        self.fetch.return_value = OLD
+        self.assertFalse(self.refresher.refresh())
+
+    def test_background_refresh_fetches_once_per_window(self):
+        fetched = threading.Event()
+
+        def fetch():
+            fetched.set()
+            return NEW
+        self.fetch.side_effect = fetch
+        self.refresher.get_delay = Mock(side_effect=[0, 3600])
+        self.refresher.start()
+        fetched.wait(5)
+        self.refresher.stop()
+        self.fetch.assert_called_once_with()
+        self.assertEqual(self.get_published_access_key_id(), 'new')
+
+    def test_files_are_private(self):
+        for filename in (self.refresher.credentials_filename,
+                         self.refresher.expiration_filename):
+            self.assertEqual(os.stat(filename).st_mode & 0o077, 0)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from unittest2 import TestCase
+
+from afp_cli.exceptions import CircuitOpenError
+from afp_cli.retry import CircuitBreaker, CircuitBreakers, RetryPolicy
+
+
+class RetryPolicyTest(TestCase):
+    def setUp(self):
+        self.sleep = Mock()
+        self.policy = RetryPolicy(retries=3, backoff=1, max_backoff=3,
+                                  sleep=self.sleep, random_=lambda: 1.0)
+
+    def test_retries_until_success(self):
+        function = Mock(side_effect=[IOError(), IOError(), 'result'])
+        self.assertEqual(self.policy.call(function, lambda exc: True),
+                         'result')
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual([c[0][0] for c in self.sleep.call_args_list],
+                         [1, 2])
+
+    def test_gives_up_after_retries(self):
+        function = Mock(side_effect=IOError())
+        self.assertRaises(IOError, self.policy.call, function,
+                          lambda exc: True)
+        self.assertEqual(function.call_count, 4)
+
+    def test_retries_can_be_overridden(self):
+        function = Mock(side_effect=IOError())
+        self.assertRaises(IOError, self.policy.call, function,
+                          lambda exc: True, retries=0)
+        self.assertEqual(function.call_count, 1)
+
+    def test_other_errors_are_not_retried(self):
+        function = Mock(side_effect=ValueError())
+        self.assertRaises(ValueError, self.policy.call, function,
+                          lambda exc: isinstance(exc, IOError))
+        self.assertEqual(function.call_count, 1)
+
+    def test_delay_is_capped_and_jittered(self):
+        self.assertEqual(self.policy.get_delay(1), 1)
+        self.assertEqual(self.policy.get_delay(2), 2)
+        self.assertEqual(self.policy.get_delay(10), 3)
+        self.policy.random = lambda: 0.5
+        self.assertEqual(self.policy.get_delay(10), 1.5)
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'circuit')
+        self.breaker = CircuitBreaker(self.filename, threshold=2, cooldown=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure(now=100)
+        self.breaker.check(now=101)
+        self.breaker.record_failure(now=102)
+        self.assertRaises(CircuitOpenError, self.breaker.check, now=103)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure(now=100)
+        self.breaker.record_success()
+        self.breaker.record_failure(now=102)
+        self.breaker.check(now=103)
+
+    def test_state_is_shared_between_processes(self):
+        self.breaker.record_failure(now=100)
+        self.breaker.record_failure(now=100)
+        other = CircuitBreaker(self.filename, threshold=2, cooldown=30)
+        self.assertRaises(CircuitOpenError, other.check, now=110)
+
+    def test_only_one_probe_after_cooldown(self):
+        self.breaker.record_failure(now=100)
+        self.breaker.record_failure(now=100)
+        self.breaker.check(now=131)
+        other = CircuitBreaker(self.filename, threshold=2, cooldown=30)
+        self.assertRaises(CircuitOpenError, other.check, now=132)
+
+    def test_successful_probe_closes_circuit(self):
+        self.breaker.record_failure(now=100)
+        self.breaker.record_failure(now=100)
+        self.breaker.check(now=131)
+        self.breaker.record_success()
+        self.breaker.check(now=132)
+
+    def test_corrupt_state_is_ignored(self):
+        with open(self.filename, 'w') as state_file:
+            state_file.write('garbage')
+        self.breaker.check(now=100)
+
+
+class CircuitBreakersTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.breakers = CircuitBreakers(threshold=1, cooldown=30,
+                                        cache_dir=self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_open_circuit_does_not_stop_other_servers(self):
+        self.breakers.get('https://a').record_failure(now=100)
+        self.assertRaises(CircuitOpenError,
+                          self.breakers.get('https://a').check, now=101)
+        self.breakers.get('https://b').check(now=101)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+import shutil
+import tempfile
+
+from unittest2 import TestCase
+
+from afp_cli.cache import (get_completion_index_filename,
+                           get_search_index_filename,
+                           write_completion_index)
+from afp_cli.search import (build_index, get_trigrams, is_one_edit_apart,
+                            load_index, search)
+
+ACCOUNTS_AND_ROLES = {'prod-eu-web': ['admin', 'deployer'],
+                      'prod-us-web': ['admin'],
+                      'dev-eu-web': ['admin', 'developer'],
+                      'production': []}
+
+
+class GetTrigramsTest(TestCase):
+    def test_words_are_padded(self):
+        self.assertEqual(get_trigrams('Ab'), set(['  a', ' ab', 'ab ']))
+        self.assertEqual(get_trigrams('a-b_c'),
+                         set(['  a', ' a ', '  b', ' b ', '  c', ' c ']))
+        self.assertEqual(get_trigrams('-'), set())
+
+
+class IsOneEditApartTest(TestCase):
+    def test_single_edits(self):
+        for other in ('test', 'tset', 'tst', 'tests', 'best', 'tesst'):
+            self.assertTrue(is_one_edit_apart('test', other), other)
+            self.assertTrue(is_one_edit_apart(other, 'test'), other)
+
+    def test_more_edits(self):
+        for other in ('ttse', 'st', 'testss', 'bust', 'estt'):
+            self.assertFalse(is_one_edit_apart('test', other), other)
+            self.assertFalse(is_one_edit_apart(other, 'test'), other)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.index = build_index(ACCOUNTS_AND_ROLES)
+
+    def test_accounts_without_roles_are_not_indexed(self):
+        self.assertNotIn('production', self.index['accounts'])
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(search(self.index, 'prod deploy'),
+                         [('prod-eu-web', 'deployer')])
+        self.assertEqual(search(self.index, 'eu admin'),
+                         [('dev-eu-web', 'admin'), ('prod-eu-web', 'admin')])
+
+    def test_closer_matches_first(self):
+        self.assertEqual(search(self.index, 'developer')[0],
+                         ('dev-eu-web', 'developer'))
+        self.assertEqual(search(self.index, 'dev')[0],
+                         ('dev-eu-web', 'admin'))
+
+    def test_typos(self):
+        self.assertEqual(search(self.index, 'prd us'),
+                         [('prod-us-web', 'admin')])
+        self.assertEqual(search(self.index, 'deplyoer')[0],
+                         ('prod-eu-web', 'deployer'))
+
+    def test_swapped_letters_in_short_words(self):
+        index = build_index({'test-long': ['name'], 'prod': ['admin']})
+        for query in ('tset', 'lnog', 'nmae'):
+            self.assertEqual(search(index, query),
+                             [('test-long', 'name')], query)
+        self.assertEqual(search(index, 'tset admni'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(search(self.index, 'web')), 5)
+        self.assertEqual(search(self.index, 'web', limit=1),
+                         [('dev-eu-web', 'admin')])
+
+    def test_no_match(self):
+        self.assertEqual(search(self.index, 'staging'), [])
+        self.assertEqual(search(self.index, '--'), [])
+
+    def test_index_survives_json(self):
+        index = json.loads(json.dumps(self.index))
+        self.assertEqual(search(index, 'prod deploy'),
+                         [('prod-eu-web', 'deployer')])
+
+
+class LoadIndexTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = get_search_index_filename('url', 'user', self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_no_account_list_cached(self):
+        self.assertIsNone(load_index('url', 'user', self.tempdir))
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_index_is_written_once(self):
+        write_completion_index(ACCOUNTS_AND_ROLES, 'url', 'user', self.tempdir)
+        index = load_index('url', 'user', self.tempdir)
+        self.assertEqual(index['accounts'],
+                         ['dev-eu-web', 'prod-eu-web', 'prod-us-web'])
+        os.utime(self.filename, (0, 0))
+        load_index('url', 'user', self.tempdir)
+        self.assertEqual(os.path.getmtime(self.filename), 0)
+
+    def test_index_is_rebuilt_for_new_account_list(self):
+        write_completion_index(ACCOUNTS_AND_ROLES, 'url', 'user', self.tempdir)
+        load_index('url', 'user', self.tempdir)
+        write_completion_index({'staging': ['admin']}, 'url', 'user',
+                               self.tempdir)
+        os.utime(get_completion_index_filename('url', 'user', self.tempdir),
+                 (12345, 12345))
+        self.assertEqual(load_index('url', 'user', self.tempdir)['accounts'],
+                         ['staging'])
+
+    def test_index_is_kept_for_every_server_and_user(self):
+        write_completion_index(ACCOUNTS_AND_ROLES, 'url', 'user', self.tempdir)
+        write_completion_index({'staging': ['admin']}, 'url', 'other user',
+                               self.tempdir)
+        self.assertEqual(
+            len(load_index('url', 'user', self.tempdir)['accounts']), 3)
+        self.assertEqual(
+            load_index('url', 'other user', self.tempdir)['accounts'],
+            ['staging'])
+        self.assertIsNone(load_index('other url', 'user', self.tempdir))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import threading
+
+from unittest2 import TestCase
+
+from afp_cli.servers import ServerRanking, race
+
+
+class ServerRankingTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'servers')
+        self.ranking = ServerRanking(self.filename, smoothing=0.5,
+                                     failure_penalty=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_keeps_order_without_measurements(self):
+        self.assertEqual(self.ranking.rank(['a', 'b', 'c']), ['a', 'b', 'c'])
+
+    def test_fastest_server_comes_first(self):
+        self.ranking.record('a', 0.3)
+        self.ranking.record('b', 0.1)
+        self.assertEqual(self.ranking.rank(['a', 'b']), ['b', 'a'])
+
+    def test_unmeasured_servers_come_first(self):
+        self.ranking.record('a', 0.1)
+        self.assertEqual(self.ranking.rank(['a', 'b']), ['b', 'a'])
+
+    def test_failed_servers_come_last_for_a_while(self):
+        self.ranking.record('a', 0.1)
+        self.ranking.record('b', 0.3)
+        self.ranking.record_failure('a', now=100)
+        self.assertEqual(self.ranking.rank(['a', 'b'], now=110), ['b', 'a'])
+        self.assertEqual(self.ranking.rank(['a', 'b'], now=170), ['a', 'b'])
+
+    def test_latency_is_averaged(self):
+        self.ranking.record('a', 0.1)
+        self.ranking.record('a', 0.3)
+        self.assertAlmostEqual(self.ranking.load()['a']['latency'], 0.2)
+
+    def test_ranking_is_persisted(self):
+        self.ranking.record('a', 0.3)
+        self.ranking.record('b', 0.1)
+        other = ServerRanking(self.filename)
+        self.assertEqual(other.rank(['a', 'b']), ['b', 'a'])
+
+    def test_corrupt_ranking_is_ignored(self):
+        with open(self.filename, 'w') as ranking_file:
+            ranking_file.write('[]')
+        self.assertEqual(self.ranking.rank(['a', 'b']), ['a', 'b'])
+        self.ranking.record('b', 0.1)
+        self.assertEqual(self.ranking.rank(['a', 'b']), ['a', 'b'])
+
+
+class RaceTest(TestCase):
+    def test_fast_first_function_wins_alone(self):
+        calls = []
+
+        def second():
+            calls.append('second')
+            return 'second'
+
+        self.assertEqual(race([lambda: 'first', second], 1), 'first')
+        self.assertEqual(calls, [])
+
+    def test_slow_first_function_is_hedged(self):
+        release = threading.Event()
+
+        def first():
+            release.wait(5)
+            return 'first'
+
+        try:
+            self.assertEqual(race([first, lambda: 'second'], 0.01), 'second')
+        finally:
+            release.set()
+
+    def test_failure_is_followed_by_next_function(self):
+        def first():
+            raise IOError('down')
+
+        self.assertEqual(race([first, lambda: 'second'], 5), 'second')
+
+    def test_last_failure_is_raised(self):
+        def fail():
+            raise IOError('down')
+
+        self.assertRaises(IOError, race, [fail, fail], 5)
+
+    def test_final_errors_are_raised_right_away(self):
+        calls = []
+
+        def first():
+            raise ValueError('no such account')
+
+        def second():
+            calls.append('second')
+
+        self.assertRaises(ValueError, race, [first, second], 5,
+                          lambda exc: isinstance(exc, IOError))
+        self.assertEqual(calls, [])
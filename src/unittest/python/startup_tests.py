@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import os
+import subprocess
+import sys
+
+from unittest2 import TestCase, skipUnless
+
+# Microseconds that importing an entry point may take, override with
+# AFP_IMPORT_BUDGET_MS on slow machines
+IMPORT_BUDGET = int(os.environ.get('AFP_IMPORT_BUDGET_MS', 100)) * 1000
+# Modules that must only be imported on the code paths that need them
+HEAVY_MODULES = ['requests', 'keyring', 'yaml', 'yamlreader']
+
+
+def get_import_times(module):
+    """Return {module name: cumulative import time in microseconds}"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True)
+    _, stderr = process.communicate()
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            import_times[fields[2].strip()] = int(fields[1])
+        except (IndexError, ValueError):
+            pass  # the header line
+    return import_times
+
+
+@skipUnless(sys.version_info >= (3, 7), "needs 'python -X importtime'")
+class StartupTest(TestCase):
+
+    def assert_imports_lazily(self, module):
+        import_times = get_import_times(module)
+        self.assertIn(module, import_times)
+        for heavy_module in HEAVY_MODULES:
+            self.assertNotIn(heavy_module, import_times,
+                             "'{0}' imports '{1}' on startup".format(
+                                 module, heavy_module))
+
+    def assert_imports_within_budget(self, module):
+        # Take the best of a few runs, other processes may slow down one
+        fastest = min(get_import_times(module)[module] for _ in range(3))
+        self.assertLess(fastest, IMPORT_BUDGET,
+                        "Importing '{0}' took {1} ms, the budget is {2} ms"
+                        .format(module, fastest // 1000,
+                                IMPORT_BUDGET // 1000))
+
+    def test_cliv2_imports_lazily(self):
+        self.assert_imports_lazily('afp_cli.cliv2')
+
+    def test_cli_imports_lazily(self):
+        self.assert_imports_lazily('afp_cli.cli')
+
+    def test_cliv2_imports_within_budget(self):
+        self.assert_imports_within_budget('afp_cli.cliv2')
+
+    def test_client_is_still_exported(self):
+        import afp_cli
+        from afp_cli.client import AWSFederationClientCmd
+        self.assertIs(afp_cli.AWSFederationClientCmd, AWSFederationClientCmd)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from six import StringIO
+from unittest2 import TestCase
+
+from afp_cli import timing
+from afp_cli.timing import STDERR, PhaseTimer, get_targets, timed
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class PhaseTimerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = PhaseTimer(clock=self.clock)
+
+    def spend(self, name, seconds):
+        with self.timer.phase(name):
+            self.clock.now += seconds
+
+    def test_phases_add_up(self):
+        self.spend('dns', 0.25)
+        self.spend('http', 0.5)
+        self.spend('http', 0.25)
+        self.clock.now += 0.5
+        record = self.timer.get_record()
+        self.assertEqual(record['total'], 1.5)
+        self.assertEqual(record['other'], 0.5)
+        self.assertEqual(record['phases'],
+                         {'dns': {'seconds': 0.25, 'count': 1},
+                          'http': {'seconds': 0.75, 'count': 2}})
+
+    def test_failing_phase_is_measured(self):
+        def fail():
+            with self.timer.phase('http'):
+                self.clock.now += 1
+                raise IOError()
+
+        self.assertRaises(IOError, fail)
+        self.assertEqual(self.timer.phases, {'http': 1})
+
+    def test_format(self):
+        self.spend('dns', 0.25)
+        self.spend('http', 0.5)
+        self.spend('http', 0.25)
+        self.assertEqual(self.timer.format(self.timer.get_record()),
+                         "afp timing: 1000 ms in total\n"
+                         "  dns                    250 ms\n"
+                         "  http                   750 ms (2x)\n"
+                         "  other                    0 ms")
+
+    def test_report_appends_json_lines(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'timing.jsonl')
+            for subcommand in ['list', 'show']:
+                timer = PhaseTimer([filename], clock=self.clock)
+                timer.details['subcommand'] = subcommand
+                timer.report()
+                timer.report()
+            with open(filename) as timing_file:
+                records = [json.loads(line) for line in timing_file]
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual([r['subcommand'] for r in records], ['list', 'show'])
+
+    def test_report_to_stderr(self):
+        timer = PhaseTimer([STDERR], clock=self.clock)
+        with patch('sys.stderr', new=StringIO()) as stderr:
+            timer.report()
+        self.assertTrue(stderr.getvalue().startswith("afp timing: "))
+
+
+class GetTargetsTest(TestCase):
+    def test_targets(self):
+        self.assertEqual(get_targets({}), [])
+        self.assertEqual(get_targets({'AFP_TIMING': '0'}), [])
+        self.assertEqual(get_targets({'AFP_TIMING': '1'}), [STDERR])
+        self.assertEqual(get_targets({'AFP_TIMING': '/tmp/afp.jsonl'}),
+                         ['/tmp/afp.jsonl'])
+
+
+class TimedTest(TestCase):
+    def tearDown(self):
+        timing.stop()
+
+    @staticmethod
+    @timed('work')
+    def work(value):
+        return value
+
+    def test_nothing_is_measured_without_timer(self):
+        self.assertEqual(self.work(42), 42)
+        self.assertIsNone(timing.get_timer())
+
+    def test_decorated_function_is_measured(self):
+        timer = timing.start({})
+        self.assertEqual(self.work(42), 42)
+        self.assertEqual(timer.counts, {'work': 1})
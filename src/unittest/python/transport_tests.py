@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import threading
+
+import requests
+from mock import Mock
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest2 import TestCase
+
+from afp_cli.transport import (RequestTimer, TLSSessionCache,
+                               configure_session,
+                               create_resuming_ssl_context,
+                               is_tls_resumption_supported)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class RequestTimerTest(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self):
+        with RequestTimer() as timer:
+            response = self.session.get(self.url, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        return timer
+
+    def test_connect_is_only_measured_for_new_connections(self):
+        configure_session(self.session)
+        self.assertIn('connect', self.get().timings)
+        self.assertNotIn('connect', self.get().timings)
+
+    def test_connections_are_not_reused_without_keep_alive(self):
+        configure_session(self.session, keep_alive=False)
+        self.assertIn('connect', self.get().timings)
+        self.assertIn('connect', self.get().timings)
+
+    def test_phases_add_up_to_total(self):
+        timer = RequestTimer()
+        timer.start, timer.end = 10.0, 10.5
+        timer.timings = {'connect': 0.1, 'established': 0.25}
+        connect, tls, server, transfer = timer.get_phases(elapsed=0.4)
+        self.assertAlmostEqual(connect, 0.1)
+        self.assertAlmostEqual(tls, 0.15)
+        self.assertAlmostEqual(server, 0.15)
+        self.assertAlmostEqual(transfer, 0.1)
+        self.assertEqual(
+            timer.format(elapsed=0.4),
+            "500 ms (connect 100 ms, tls 150 ms, server 150 ms, "
+            "transfer 100 ms)")
+
+
+def mock_ssl_socket(session, host='afp.example.com'):
+    return Mock(server_hostname=host, session=session, session_reused=False)
+
+
+class TLSSessionCacheTest(TestCase):
+    def setUp(self):
+        self.cache = TLSSessionCache()
+
+    def wrap(self, ssl_socket, host='afp.example.com'):
+        wrap_socket = Mock(return_value=ssl_socket)
+        self.cache.wrap_socket(wrap_socket, Mock(), server_hostname=host)
+        return wrap_socket.call_args[1]
+
+    def test_first_connection_gets_no_session(self):
+        self.assertNotIn('session', self.wrap(mock_ssl_socket('first')))
+
+    def test_next_connection_resumes_session(self):
+        self.wrap(mock_ssl_socket('first'))
+        self.assertEqual(self.wrap(mock_ssl_socket('second'))['session'],
+                         'first')
+
+    def test_sessions_are_per_host(self):
+        self.wrap(mock_ssl_socket('first'))
+        kwargs = self.wrap(mock_ssl_socket('other', 'other.example.com'),
+                           'other.example.com')
+        self.assertNotIn('session', kwargs)
+
+    def test_session_is_taken_from_open_connection(self):
+        ssl_socket = mock_ssl_socket(None)
+        self.wrap(ssl_socket)
+        ssl_socket.session = 'received later'
+        self.assertEqual(self.cache.get('afp.example.com'), 'received later')
+
+    def test_session_survives_closed_connection(self):
+        ssl_socket = mock_ssl_socket('first')
+        self.wrap(ssl_socket)
+        ssl_socket.session = None
+        self.cache.remember(ssl_socket)
+        self.assertEqual(self.cache.get('afp.example.com'), 'first')
+
+    def test_context_is_shared_by_connections(self):
+        if not is_tls_resumption_supported():
+            self.skipTest("ssl module can not resume sessions")
+        context = create_resuming_ssl_context()
+        session = requests.Session()
+        configure_session(session, ssl_context=context)
+        pool = session.get_adapter('https://').poolmanager.connection_from_url(
+            'https://afp.example.com/')
+        self.assertIs(pool.conn_kw['ssl_context'], context)
+
+    def test_sessions_are_per_way_of_verifying(self):
+        if not is_tls_resumption_supported():
+            self.skipTest("ssl module can not resume sessions")
+        contexts = create_resuming_ssl_context().resuming_contexts
+        verifying = contexts.get(Mock(cert_reqs='CERT_REQUIRED',
+                                      ca_certs='/etc/ca.pem', ca_cert_dir=None,
+                                      ca_cert_data=None))
+        self.assertIsInstance(verifying.tls_session_cache, TLSSessionCache)
+        self.assertIs(contexts.get(Mock(cert_reqs='CERT_REQUIRED',
+                                        ca_certs='/etc/ca.pem',
+                                        ca_cert_dir=None, ca_cert_data=None)),
+                      verifying)
+        for cert_reqs, ca_certs in [('CERT_NONE', '/etc/ca.pem'),
+                                    ('CERT_REQUIRED', '/etc/other.pem')]:
+            other = contexts.get(Mock(cert_reqs=cert_reqs, ca_certs=ca_certs,
+                                      ca_cert_dir=None, ca_cert_data=None))
+            self.assertIsNot(other, verifying)
+            self.assertIsNot(other.tls_session_cache,
+                             verifying.tls_session_cache)